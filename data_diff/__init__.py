@@ -57,8 +57,8 @@ def diff_tables(
     max_update: DbTime = None,
     # Enable/disable threaded diffing. Needed to take advantage of database threads.
     threaded: bool = True,
-    # Maximum size of each threadpool. None = auto. Only relevant when threaded is True.
-    # There may be many pools, so number of actual threads can be a lot higher.
+    # Maximum size of each thread pool. None = auto. Only relevant when threaded is True.
+    # The queries of all the segments share one pool, so at most this many run at once.
     max_threadpool_size: Optional[int] = 1,
     # Algorithm
     algorithm: Algorithm = Algorithm.AUTO,
@@ -66,6 +66,30 @@ def diff_tables(
     bisection_factor: int = DEFAULT_BISECTION_FACTOR,
     # When should we stop bisecting and compare locally (in row count; hashdiff only)
     bisection_threshold: int = DEFAULT_BISECTION_THRESHOLD,
+    # Infer the checksum of the last segment in each bisection from its parent (hashdiff only)
+    additive_checksum: bool = False,
+    # Checksum all the segments of a bisection in a single query per table (hashdiff only)
+    batched_checksum: bool = False,
+    # Download key and row hash first, and full rows only for keys that differ (hashdiff only)
+    download_row_hashes: bool = False,
+    # Choose checkpoints by the key distribution estimated by the database (hashdiff only)
+    histogram_checkpoints: bool = False,
+    # Adjust the bisection factor and threshold to the measured query durations (hashdiff only)
+    adaptive_bisection: bool = False,
+    # Path of a SQLite file for reusing the checksums and diffs of unchanged segments across runs (hashdiff only)
+    checksum_store: Optional[str] = None,
+    # Split the tables by a hash of the key, instead of by key ranges. Works with any key type. (hashdiff only)
+    hash_partitioning: bool = False,
+    # Checksum with the database's own hash function, when both tables are in the same kind of database. (hashdiff only)
+    native_hash: bool = False,
+    # Checksum columns with identical types as they are, when both tables are in the same kind of database. (hashdiff only)
+    skip_normalization: bool = False,
+    # Checksum each column too, to download only the columns that differ, and count differences per column. (hashdiff only)
+    column_checksums: bool = False,
+    # Compare downloaded segments with vectorized joins in Arrow. Requires pyarrow. (hashdiff only)
+    vectorized_diff: bool = False,
+    # Compare downloaded segments in a pool of this many processes. 0 = disabled. (hashdiff only)
+    local_diff_processes: int = 0,
     # Enable/disable validating that the key columns are unique. (joindiff only)
     validate_unique_key: bool = True,
     # Enable/disable sampling of exclusive rows. Creates a temporary table. (joindiff only)
@@ -76,6 +100,10 @@ def diff_tables(
     materialize_all_rows: bool = False,
     # Maximum number of rows to write when materializing, per thread. (joindiff only)
     table_write_limit: int = TABLE_WRITE_LIMIT,
+    # Write the differing rows into a temporary table, and derive the diff and its stats from it. (joindiff only)
+    temp_diff_table: bool = False,
+    # Checksum each segment first, and run the outer join only for the segments that differ. (joindiff only)
+    checksum_segments: bool = False,
 ) -> Iterator:
     """Finds the diff between table1 and table2.
 
@@ -89,20 +117,54 @@ def diff_tables(
         min_update (:data:`DbTime`, optional): Lowest update_column value, used to restrict the segment
         max_update (:data:`DbTime`, optional): Highest update_column value, used to restrict the segment
         threaded (bool): Enable/disable threaded diffing. Needed to take advantage of database threads.
-        max_threadpool_size (int): Maximum size of each threadpool. ``None`` means auto.
+        max_threadpool_size (int): Maximum size of each thread pool. ``None`` means auto.
                                    Only relevant when `threaded` is ``True``.
-                                   There may be many pools, so number of actual threads can be a lot higher.
+                                   Each diff uses two pools of this size: one runs the segments, and one is
+                                   shared by the queries of all the segments, so at most this many queries run
+                                   at once. (Before, each segment queried in a pool of its own, so it ran up to
+                                   twice as many. Raise it to keep that concurrency)
         algorithm (:class:`Algorithm`): Which diffing algorithm to use (`HASHDIFF` or `JOINDIFF`. Default=`AUTO`)
         bisection_factor (int): Into how many segments to bisect per iteration. (Used when algorithm is `HASHDIFF`)
         bisection_threshold (Number): Minimal row count of segment to bisect, otherwise download
                                       and compare locally. (Used when algorithm is `HASHDIFF`).
+        additive_checksum (bool): Infer the count and checksum of the last segment in each bisection
+                                  from its parent, instead of querying it. (Used when algorithm is `HASHDIFF`).
+        batched_checksum (bool): Count and checksum all the segments of a bisection in a single query per table,
+                                 grouped by segment. (Used when algorithm is `HASHDIFF`).
+        download_row_hashes (bool): When comparing a segment locally, download only the key and a hash of each row,
+                                    and then the full rows of the keys that differ. (Used when algorithm is `HASHDIFF`).
+        histogram_checkpoints (bool): Split segments by row count, according to the key distribution estimated
+                                      by the database, when available. (Used when algorithm is `HASHDIFF`).
+        adaptive_bisection (bool): Adjust the bisection factor and threshold during the diff, according to the measured
+                                   query durations. (Used when algorithm is `HASHDIFF`).
+        checksum_store (str, optional): Path of a SQLite file for keeping the checksums and diffs of segments.
+                                        Later diffs of the same tables reuse the diff of segments whose checksums
+                                        didn't change. (Used when algorithm is `HASHDIFF`).
+        hash_partitioning (bool): Split the tables by a hash of the key, instead of by key ranges. Works with any key
+                                  type, but can't use an index on the key. Used automatically for keys that can't be
+                                  split into ranges, like free-form text. (Used when algorithm is `HASHDIFF`).
+        native_hash (bool): When both tables are in the same kind of database, checksum them with the database's own
+                            hash function instead of md5, if both databases hash a sample of values the same.
+                            (Used when algorithm is `HASHDIFF`).
+        skip_normalization (bool): When both tables are in the same kind of database, checksum the columns that have
+                                   identical types without normalizing them first. (Used when algorithm is `HASHDIFF`).
+        column_checksums (bool): Also checksum each column, to find which columns differ. Segments whose keys match
+                                 are compared by downloading only the differing columns, and then the rows that differ.
+                                 (Used when algorithm is `HASHDIFF`).
+        vectorized_diff (bool): Compare downloaded segments with vectorized joins in Arrow, instead of with Python sets.
+                                Requires pyarrow. (Used when algorithm is `HASHDIFF`).
+        local_diff_processes (int): Compare downloaded segments in a pool of this many processes, to use more than
+                                    one core. 0 means disabled. (Used when algorithm is `HASHDIFF`).
         validate_unique_key (bool): Enable/disable validating that the key columns are unique. (used for `JOINDIFF`. default: True)
-                                    Single query, and can't be threaded, so it's very slow on non-cloud dbs.
-                                    Future versions will detect UNIQUE constraints in the schema.
+                                    Skipped for keys that have UNIQUE constraints in the schema.
         sample_exclusive_rows (bool): Enable/disable sampling of exclusive rows. Creates a temporary table. (used for `JOINDIFF`. default: False)
         materialize_to_table (Union[str, DbPath], optional): Path of new table to write diff results to. Disabled if not provided. Used for `JOINDIFF`.
         materialize_all_rows (bool): Materialize every row, not just those that are different. (used for `JOINDIFF`. default: False)
         table_write_limit (int): Maximum number of rows to write when materializing, per thread.
+        temp_diff_table (bool): Write the differing rows of each segment into a temporary table, and derive the diff
+                                and its stats from it, instead of running the outer join once for each. (used for `JOINDIFF`. default: False)
+        checksum_segments (bool): Checksum each segment of both tables first, and run the outer join only for the segments
+                                  that differ. Faster for tables that are mostly the same. (used for `JOINDIFF`. default: False)
 
     Note:
         The following parameters are used to override the corresponding attributes of the given :class:`TableSegment` instances:
@@ -149,6 +211,18 @@ def diff_tables(
         differ = HashDiffer(
             bisection_factor=bisection_factor,
             bisection_threshold=bisection_threshold,
+            additive_checksum=additive_checksum,
+            batched_checksum=batched_checksum,
+            download_row_hashes=download_row_hashes,
+            histogram_checkpoints=histogram_checkpoints,
+            adaptive_bisection=adaptive_bisection,
+            checksum_store=checksum_store,
+            hash_partitioning=hash_partitioning,
+            native_hash=native_hash,
+            skip_normalization=skip_normalization,
+            column_checksums=column_checksums,
+            vectorized_diff=vectorized_diff,
+            local_diff_processes=local_diff_processes,
             threaded=threaded,
             max_threadpool_size=max_threadpool_size,
         )
@@ -163,6 +237,8 @@ def diff_tables(
             materialize_to_table=materialize_to_table,
             materialize_all_rows=materialize_all_rows,
             table_write_limit=table_write_limit,
+            temp_diff_table=temp_diff_table,
+            checksum_segments=checksum_segments,
         )
     else:
         raise ValueError(f"Unknown algorithm: {algorithm}")
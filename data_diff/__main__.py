@@ -4,7 +4,6 @@ import sys
 import time
 import json
 import logging
-from itertools import islice
 from typing import Optional
 
 import rich
@@ -15,10 +14,11 @@ from .diff_tables import Algorithm
 from .hashdiff_tables import HashDiffer, DEFAULT_BISECTION_THRESHOLD, DEFAULT_BISECTION_FACTOR
 from .joindiff_tables import TABLE_WRITE_LIMIT, JoinDiffer
 from .table_segment import TableSegment
+from .incremental import diff_tables_incremental, DEFAULT_WATERMARK_OVERLAP
 from .sqeleton.schema import create_schema
 from .sqeleton.queries.api import current_timestamp
 from .databases import connect
-from .parse_time import parse_time_before, UNITS_STR, ParseError
+from .parse_time import parse_time_before, parse_time_delta, UNITS_STR, ParseError
 from .config import apply_config_from_file
 from .tracking import disable_tracking, set_entrypoint_name
 from .version import __version__
@@ -140,6 +140,20 @@ click.Context.formatter_class = MyHelpFormatter
 @click.option(
     "--max-age", default=None, help="Considers only rows younger than specified. See --min-age.", metavar="AGE"
 )
+@click.option(
+    "--incremental-state",
+    default=None,
+    help="Path to a state file. Only rows updated since the previous run with the same file are diffed, "
+    "according to --update-column, and merged into the previous diff. Deleted rows are not detected.",
+    metavar="PATH",
+)
+@click.option(
+    "--incremental-overlap",
+    default=None,
+    help="How far back before the previous run to look for updated rows, to account for replication lag. "
+    f"See --min-age. Default={int(DEFAULT_WATERMARK_OVERLAP.total_seconds()) // 60}min.",
+    metavar="AGE",
+)
 @click.option("-s", "--stats", is_flag=True, help="Print stats instead of a detailed diff")
 @click.option("-d", "--debug", is_flag=True, help="Print debug info")
 @click.option("--json", "json_output", is_flag=True, help="Print JSONL output for machine readability")
@@ -244,6 +258,8 @@ def _main(
     materialize_all_rows,
     table_write_limit,
     materialize_to_table,
+    incremental_state,
+    incremental_overlap,
     threads1=None,
     threads2=None,
     __conf__=None,
@@ -273,6 +289,20 @@ def _main(
         logging.error("Cannot specify a limit when using the -s/--stats switch")
         return
 
+    if incremental_state and (limit or stats):
+        logging.error("Cannot specify a limit, or the -s/--stats switch, when using --incremental-state")
+        return
+
+    if incremental_state and not update_column:
+        logging.error("Error: --incremental-state requires --update-column to be set.")
+        return
+
+    try:
+        overlap = DEFAULT_WATERMARK_OVERLAP if incremental_overlap is None else parse_time_delta(incremental_overlap)
+    except ParseError as e:
+        logging.error(f"Error while parsing age expression: {e}")
+        return
+
     key_columns = key_columns or ("id",)
     bisection_factor = DEFAULT_BISECTION_FACTOR if bisection_factor is None else int(bisection_factor)
     bisection_threshold = DEFAULT_BISECTION_THRESHOLD if bisection_threshold is None else int(bisection_threshold)
@@ -358,7 +388,8 @@ def _main(
     table_names = table1, table2
     table_paths = [db.parse_table_name(t) for db, t in safezip(dbs, table_names)]
 
-    schemas = list(differ._thread_map(_get_schema, safezip(dbs, table_paths)))
+    with differ._task_pool_scope():
+        schemas = list(differ._thread_map(_get_schema, safezip(dbs, table_paths)))
     schema1, schema2 = schemas = [
         create_schema(db, table_path, schema, case_sensitive)
         for db, table_path, schema in safezip(dbs, table_paths, schemas)
@@ -402,11 +433,14 @@ def _main(
         for db, table_path, raw_schema in safezip(dbs, table_paths, schemas)
     ]
 
-    diff_iter = differ.diff_tables(*segments)
+    if incremental_state:
+        diff_iter = diff_tables_incremental(differ, *segments, incremental_state, overlap)
+    else:
+        diff_iter = differ.diff_tables(*segments)
 
     if limit:
         assert not stats
-        diff_iter = islice(diff_iter, int(limit))
+        diff_iter = diff_iter.limit(int(limit))
 
     if stats:
         if json_output:
@@ -0,0 +1,77 @@
+"""Vectorized diff of downloaded segments, using Arrow tables instead of Python sets (requires pyarrow)"""
+
+from typing import Callable, Iterator, List, Sequence, Union
+
+from .sqeleton.databases.base import import_helper
+
+# Replaces nulls before comparing rows, since Arrow's joins never match nulls. Normalized values can't contain it.
+NULL_SENTINEL = "\x00<null>"
+ROW_INDEX = "__row_index"
+
+
+@import_helper(text="You can install it using 'pip install pyarrow'")
+def import_pyarrow():
+    import pyarrow
+    import pyarrow.compute
+
+    return pyarrow
+
+
+def rows_to_arrow(rows: Sequence[tuple], names: Sequence[str]):
+    "Converts a list of rows into an Arrow table, with the given column names"
+    pa = import_pyarrow()
+    columns = list(zip(*rows)) if rows else [[] for _ in names]
+    return pa.Table.from_arrays([pa.array(c) for c in columns], names=list(names))
+
+
+def _comparable(table):
+    "Casts all the columns to strings without nulls, and adds the index of each row"
+    pa = import_pyarrow()
+    pc = pa.compute
+    columns = [pc.fill_null(pc.cast(c, pa.string()), NULL_SENTINEL) for c in table.columns]
+    return pa.Table.from_arrays(
+        columns + [pa.array(range(len(table)), pa.int64())], names=[f"c{i}" for i in range(len(columns))] + [ROW_INDEX]
+    )
+
+
+def _exclusive_rows(table, other) -> List[int]:
+    "Returns the indices of the rows of 'table' that don't appear in 'other'"
+    joined = table.join(other.drop([ROW_INDEX]), keys=table.column_names[:-1], join_type="left anti")
+    return sorted(joined.column(ROW_INDEX).to_pylist())
+
+
+def _to_rows(table, indices: List[int]) -> List[tuple]:
+    pa = import_pyarrow()
+    taken = table.take(pa.array(indices, pa.int64()))
+    return list(zip(*(c.to_pylist() for c in taken.columns)))
+
+
+def diff_sets_arrow(
+    a: Union[Sequence[tuple], "pyarrow.Table"],
+    b: Union[Sequence[tuple], "pyarrow.Table"],
+    key_len: int = 1,
+    key: Callable = None,
+) -> Iterator:
+    """Yields the same results as diff_sets(), but finds the differing rows with a vectorized join in Arrow
+
+    The rows may be given as two lists of tuples, or as two Arrow tables, with the same number of columns.
+    Only the rows that differ are converted back into Python tuples.
+
+    The results are sorted by key, where 'key' converts each of the key columns into a value that follows
+    the order of the rows. By default the values are compared as they are (like diff_sets()).
+    """
+    key = key or (lambda k: k)
+    pa = import_pyarrow()
+    if not isinstance(a, pa.Table):
+        if not a and not b:
+            return
+        names = [f"c{i}" for i in range(len(a[0] if a else b[0]))]
+        a, b = rows_to_arrow(a, names), rows_to_arrow(b, names)
+
+    ca, cb = _comparable(a), _comparable(b)
+    diff = [("-", row) for row in _to_rows(a, _exclusive_rows(ca, cb))]
+    diff += [("+", row) for row in _to_rows(b, _exclusive_rows(cb, ca))]
+
+    # Stable sort, so for each key, removed rows come first, in their original order (like diff_sets)
+    diff.sort(key=lambda sign_row: tuple(map(key, sign_row[1][:key_len])))
+    yield from diff
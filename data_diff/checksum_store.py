@@ -0,0 +1,158 @@
+"""Persists the checksums of diffed segments, so that later diffs of the same tables can skip unchanged segments"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from .table_segment import TableSegment
+
+logger = logging.getLogger("checksum_store")
+
+SegmentKey = Tuple[str, str]  # (min_key, max_key), as strings
+Checksums = Tuple[int, Optional[int], int, Optional[int]]  # (count1, checksum1, count2, checksum2)
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS segments (
+        pair_id TEXT NOT NULL,
+        min_key TEXT NOT NULL,
+        max_key TEXT NOT NULL,
+        checksums TEXT,
+        diff TEXT,
+        PRIMARY KEY (pair_id, min_key, max_key)
+    )""",
+    "CREATE TABLE IF NOT EXISTS checkpoints (pair_id TEXT PRIMARY KEY, checkpoints TEXT NOT NULL)",
+]
+
+
+def table_pair_id(table1: TableSegment, table2: TableSegment) -> str:
+    "Identifies a pair of tables, and what is compared between them. Restrictions on the key range are ignored."
+    desc = [
+        [
+            t.database.name,
+            t.database.connection_info,  # Tells apart databases of the same type, without their credentials
+            list(t.table_path),
+            list(t.key_columns),
+            t.relevant_columns,
+            t.where,
+            str(t.min_update),
+            str(t.max_update),
+        ]
+        for t in (table1, table2)
+    ]
+    return hashlib.sha1(json.dumps(desc, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ChecksumRun:
+    """Collects the segments of one diff, and looks up the segments of the previous diff of the same tables
+
+    A segment whose counts and checksums didn't change on either side since the previous diff must have the same
+    diff as before. It's found by joining the diffs of the segments that were compared last time
+    (downloaded, or with equal checksums), which together cover the same key range.
+    """
+
+    def __init__(self, pair_id: str, previous: Dict[SegmentKey, tuple], previous_checkpoints: List[str]):
+        self.pair_id = pair_id
+        self.previous_checkpoints = previous_checkpoints
+        self._previous_checksums = {k: c for k, (c, _diff) in previous.items() if c is not None}
+        self._previous_diffs = {k[0]: (k[1], diff) for k, (_c, diff) in previous.items() if diff is not None}
+
+        self._lock = threading.Lock()
+        self.segments: Dict[SegmentKey, list] = {}  # {(min_key, max_key): [checksums, diff]}
+        self.checkpoints = set()
+
+    def add_checksums(self, table: TableSegment, checksums: Checksums):
+        with self._lock:
+            self.segments.setdefault((str(table.min_key), str(table.max_key)), [None, None])[0] = checksums
+
+    def add_diff(self, table: TableSegment, diff: list):
+        with self._lock:
+            self.segments.setdefault((str(table.min_key), str(table.max_key)), [None, None])[1] = diff
+
+    def add_checkpoints(self, checkpoints: list):
+        with self._lock:
+            self.checkpoints.update(map(str, checkpoints))
+
+    def find_diff(self, table: TableSegment, checksums: Checksums) -> Optional[list]:
+        "Returns the diff of the segment from the previous run, if the segment didn't change since"
+        min_key, max_key = str(table.min_key), str(table.max_key)
+        if self._previous_checksums.get((min_key, max_key)) != checksums:
+            return None
+
+        diff = []
+        key = min_key
+        for _ in range(len(self._previous_diffs)):
+            if key not in self._previous_diffs:
+                return None
+            key, segment_diff = self._previous_diffs[key]
+            diff += segment_diff
+            if key == max_key:
+                return diff
+        return None
+
+
+class ChecksumStore:
+    """A SQLite file that keeps the segments of the last complete diff of each pair of tables
+
+    Parameters:
+        path (str): Path of the SQLite database file. Created if it doesn't exist.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        for sql in SCHEMA:
+            conn.execute(sql)
+        return conn
+
+    def load(self, table1: TableSegment, table2: TableSegment) -> ChecksumRun:
+        "Starts a new run for the given tables, with the segments of the previous run"
+        pair_id = table_pair_id(table1, table2)
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT min_key, max_key, checksums, diff FROM segments WHERE pair_id = ?", (pair_id,)
+            ).fetchall()
+            checkpoints = conn.execute("SELECT checkpoints FROM checkpoints WHERE pair_id = ?", (pair_id,)).fetchall()
+        finally:
+            conn.close()
+
+        previous = {
+            (min_key, max_key): (
+                tuple(json.loads(checksums)) if checksums else None,
+                [(sign, tuple(row)) for sign, row in json.loads(diff)] if diff is not None else None,
+            )
+            for min_key, max_key, checksums, diff in rows
+        }
+        logger.info(f"Loaded {len(previous)} segments of the previous diff from {self.path}")
+        return ChecksumRun(pair_id, previous, json.loads(checkpoints[0][0]) if checkpoints else [])
+
+    def save(self, run: ChecksumRun):
+        "Replaces the segments of the previous run of the same tables, with the segments of the given run"
+        rows = [
+            (
+                run.pair_id,
+                min_key,
+                max_key,
+                json.dumps(checksums) if checksums else None,
+                json.dumps(diff, default=str) if diff is not None else None,
+            )
+            for (min_key, max_key), (checksums, diff) in run.segments.items()
+        ]
+
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM segments WHERE pair_id = ?", (run.pair_id,))
+                conn.execute("DELETE FROM checkpoints WHERE pair_id = ?", (run.pair_id,))
+                conn.executemany("INSERT INTO segments VALUES (?, ?, ?, ?, ?)", rows)
+                conn.execute(
+                    "INSERT INTO checkpoints VALUES (?, ?)", (run.pair_id, json.dumps(sorted(run.checkpoints)))
+                )
+        finally:
+            conn.close()
+        logger.info(f"Saved {len(rows)} segments to {self.path}")
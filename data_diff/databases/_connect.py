@@ -41,7 +41,7 @@ class Connect_SetUTC(Connect):
     def _connection_created(self, db):
         db = super()._connection_created(db)
         try:
-            db.query(db.dialect.set_timezone_to_utc())
+            db.configure_session(db.dialect.set_timezone_to_utc())
         except NotImplementedError:
             logging.debug(
                 f"Database '{db}' does not allow setting timezone. We recommend making sure it's set to 'UTC'."
@@ -3,11 +3,13 @@
 
 import re
 import time
+import threading
 from abc import ABC, abstractmethod
 from enum import Enum
+from itertools import islice
 from contextlib import contextmanager
 from operator import methodcaller
-from typing import Dict, Tuple, Iterator, Optional
+from typing import Dict, List, Tuple, Iterator, Optional
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from runtype import dataclass
@@ -39,17 +41,53 @@ def truncate_error(error: str):
 
 @dataclass
 class ThreadBase:
-    "Provides utility methods for optional threading"
+    """Provides utility methods for optional threading
+
+    Threaded calls are only available within _task_pool_scope(). They run on a thread pool that is shared
+    by the open scopes (e.g. concurrent diffs), and shut down when the last one exits.
+    After that, threaded calls raise an error, instead of starting a pool that nothing would shut down.
+    (For example, if made by the workers of a closed diff.)
+    """
 
     threaded: bool = True
     max_threadpool_size: Optional[int] = 1
 
+    _task_pool = None
+    _task_pool_scopes = 0  # Number of open _task_pool_scope() calls
+
+    def __post_init__(self):
+        # Not a field, so it isn't copied by replace(). (setattr is blocked by frozen dataclass)
+        object.__setattr__(self, "_task_pool_lock", threading.Lock())
+
+    @contextmanager
+    def _task_pool_scope(self):
+        with self._task_pool_lock:
+            object.__setattr__(self, "_task_pool_scopes", self._task_pool_scopes + 1)
+        try:
+            yield
+        finally:
+            task_pool = None
+            with self._task_pool_lock:
+                object.__setattr__(self, "_task_pool_scopes", self._task_pool_scopes - 1)
+                if not self._task_pool_scopes:
+                    task_pool = self._task_pool
+                    object.__setattr__(self, "_task_pool", None)
+            if task_pool is not None:
+                task_pool.shutdown(wait=False)
+
+    def _get_task_pool(self) -> ThreadPoolExecutor:
+        with self._task_pool_lock:
+            if not self._task_pool_scopes:
+                raise RuntimeError("Threaded calls must be made within _task_pool_scope()")
+            if self._task_pool is None:
+                object.__setattr__(self, "_task_pool", ThreadPoolExecutor(max_workers=self.max_threadpool_size))
+            return self._task_pool
+
     def _thread_map(self, func, iterable):
         if not self.threaded:
             return map(func, iterable)
 
-        with ThreadPoolExecutor(max_workers=self.max_threadpool_size) as task_pool:
-            return task_pool.map(func, iterable)
+        return self._get_task_pool().map(func, iterable)
 
     def _threaded_call(self, func, iterable):
         "Calls a method for each object in iterable."
@@ -60,10 +98,10 @@ class ThreadBase:
             yield from map(func, iterable)
             return
 
-        with ThreadPoolExecutor(max_workers=self.max_threadpool_size) as task_pool:
-            futures = [task_pool.submit(func, item) for item in iterable]
-            for future in as_completed(futures):
-                yield future.result()
+        task_pool = self._get_task_pool()
+        futures = [task_pool.submit(func, item) for item in iterable]
+        for future in as_completed(futures):
+            yield future.result()
 
     def _threaded_call_as_completed(self, func, iterable):
         "Calls a method for each object in iterable. Returned in order of completion."
@@ -100,6 +138,18 @@ class DiffResultWrapper:
             self.result_list.append(i)
             yield i
 
+    def close(self):
+        "Stop the diff, if it's still running, and release its resources"
+        if hasattr(self.diff, "close"):
+            self.diff.close()
+
+    def limit(self, max_rows: int) -> DiffResult:
+        "Yield up to 'max_rows' diff results, and then stop the diff. Queued work is cancelled."
+        try:
+            yield from islice(self, max_rows)
+        finally:
+            self.close()
+
     def _get_stats(self) -> DiffStats:
         list(self)  # Consume the iterator into result_list, if we haven't already
 
@@ -190,12 +240,12 @@ class TableDiffer(ThreadBase, ABC):
         start = time.monotonic()
         error = None
         try:
+            with self._task_pool_scope():
+                # Query and validate schema
+                table1, table2 = self._threaded_call("with_schema", [table1, table2])
+                self._validate_and_adjust_columns(table1, table2)
 
-            # Query and validate schema
-            table1, table2 = self._threaded_call("with_schema", [table1, table2])
-            self._validate_and_adjust_columns(table1, table2)
-
-            yield from self._diff_tables_root(table1, table2, info_tree)
+                yield from self._diff_tables_root(table1, table2, info_tree)
 
         except BaseException as e:  # Catch KeyboardInterrupt too
             error = e
@@ -245,29 +295,25 @@ class TableDiffer(ThreadBase, ABC):
         ...
 
     def _bisect_and_diff_tables(self, table1, table2, info_tree):
-        if len(table1.key_columns) > 1:
-            raise NotImplementedError("Composite key not supported yet!")
-        if len(table2.key_columns) > 1:
-            raise NotImplementedError("Composite key not supported yet!")
         if len(table1.key_columns) != len(table2.key_columns):
             raise ValueError("Tables should have an equivalent number of key columns!")
-        (key1,) = table1.key_columns
-        (key2,) = table2.key_columns
-
-        key_type = table1._schema[key1]
-        key_type2 = table2._schema[key2]
-        if not isinstance(key_type, IKey):
-            raise NotImplementedError(f"Cannot use column of type {key_type} as a key")
-        if not isinstance(key_type2, IKey):
-            raise NotImplementedError(f"Cannot use column of type {key_type2} as a key")
-        if key_type.python_type is not key_type2.python_type:
-            raise TypeError(f"Incompatible key types: {key_type} and {key_type2}")
+
+        key_types = [table1._schema[k] for k in table1.key_columns]
+        for key1, key2 in safezip(table1.key_columns, table2.key_columns):
+            key_type = table1._schema[key1]
+            key_type2 = table2._schema[key2]
+            if not isinstance(key_type, IKey):
+                raise NotImplementedError(f"Cannot use column of type {key_type} as a key")
+            if not isinstance(key_type2, IKey):
+                raise NotImplementedError(f"Cannot use column of type {key_type2} as a key")
+            if key_type.python_type is not key_type2.python_type:
+                raise TypeError(f"Incompatible key types: {key_type} and {key_type2}")
 
         # Query min/max values
         key_ranges = self._threaded_call_as_completed("query_key_range", [table1, table2])
 
         # Start with the first completed value, so we don't waste time waiting
-        min_key1, max_key1 = self._parse_key_range_result(key_type, next(key_ranges))
+        min_key1, max_key1 = self._parse_key_range_result(key_types, next(key_ranges))
 
         table1, table2 = [t.new(min_key=min_key1, max_key=max_key1) for t in (table1, table2)]
 
@@ -276,12 +322,12 @@ class TableDiffer(ThreadBase, ABC):
             f"size: table1 <= {table1.approximate_size()}, table2 <= {table2.approximate_size()}"
         )
 
-        ti = ThreadedYielder(self.max_threadpool_size)
+        ti = self._create_threaded_yielder()
         # Bisect (split) the table into segments, and diff them recursively.
         ti.submit(self._bisect_and_diff_segments, ti, table1, table2, info_tree)
 
         # Now we check for the second min-max, to diff the portions we "missed".
-        min_key2, max_key2 = self._parse_key_range_result(key_type, next(key_ranges))
+        min_key2, max_key2 = self._parse_key_range_result(key_types, next(key_ranges))
 
         if min_key2 < min_key1:
             pre_tables = [t.new(min_key=min_key2, max_key=min_key1) for t in (table1, table2)]
@@ -293,14 +339,24 @@ class TableDiffer(ThreadBase, ABC):
 
         return ti
 
-    def _parse_key_range_result(self, key_type, key_range):
+    def _create_threaded_yielder(self) -> ThreadedYielder:
+        "Returns the yielder that runs the segment diffs of a single diff_tables() call"
+        return ThreadedYielder(self.max_threadpool_size)
+
+    def _parse_key_range_result(self, key_types, key_range):
         mn, mx = key_range
-        cls = key_type.make_value
-        # We add 1 because our ranges are exclusive of the end (like in Python)
         try:
-            return cls(mn), cls(mx) + 1
+            if len(key_types) > 1:
+                # Composite keys are compared lexicographically, so only the last column is incremented
+                mn = tuple(t.make_value(v) for t, v in safezip(key_types, mn))
+                mx = tuple(t.make_value(v) for t, v in safezip(key_types, mx))
+                return mn, mx[:-1] + (mx[-1] + 1,)
+
+            (key_type,) = key_types
+            # We add 1 because our ranges are exclusive of the end (like in Python)
+            return key_type.make_value(mn), key_type.make_value(mx) + 1
         except (TypeError, ValueError) as e:
-            raise type(e)(f"Cannot apply {key_type} to '{mn}', '{mx}'.") from e
+            raise type(e)(f"Cannot apply {', '.join(map(str, key_types))} to '{mn}', '{mx}'.") from e
 
     def _bisect_and_diff_segments(
         self,
@@ -313,14 +369,31 @@ class TableDiffer(ThreadBase, ABC):
     ):
         assert table1.is_bounded and table2.is_bounded
 
-        # Choose evenly spaced checkpoints (according to min_key and max_key)
-        biggest_table = max(table1, table2, key=methodcaller("approximate_size"))
-        checkpoints = biggest_table.choose_checkpoints(self.bisection_factor - 1)
+        checkpoints = self._choose_checkpoints(table1, table2, level, max_rows)
 
         # Create new instances of TableSegment between each checkpoint
         segmented1 = table1.segment_by_checkpoints(checkpoints)
         segmented2 = table2.segment_by_checkpoints(checkpoints)
 
+        self._diff_segment_pairs(ti, segmented1, segmented2, info_tree, level, max_rows)
+
+    def _choose_bisection_factor(self, max_rows: Optional[int]) -> int:
+        return self.bisection_factor
+
+    def _choose_checkpoints(self, table1: TableSegment, table2: TableSegment, level: int, max_rows: Optional[int]):
+        # Choose evenly spaced checkpoints (according to min_key and max_key)
+        biggest_table = max(table1, table2, key=lambda t: t.approximate_size() or 0)
+        return biggest_table.choose_checkpoints(self._choose_bisection_factor(max_rows) - 1)
+
+    def _diff_segment_pairs(
+        self,
+        ti: ThreadedYielder,
+        segmented1: List[TableSegment],
+        segmented2: List[TableSegment],
+        info_tree: InfoTree,
+        level: int,
+        max_rows: Optional[int],
+    ):
         # Recursively compare each pair of corresponding segments between table1 and table2
         for i, (t1, t2) in enumerate(safezip(segmented1, segmented2)):
             info_node = info_tree.add_node(t1, t2, max_rows=max_rows)
@@ -1,18 +1,28 @@
 import os
+import math
+import time
 from numbers import Number
 import logging
+import threading
+import multiprocessing
 from collections import defaultdict
-from typing import Iterator
-from operator import attrgetter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from operator import attrgetter, methodcaller
 
 from runtype import dataclass
 
-from data_diff.info_tree import InfoTree
+from data_diff.info_tree import InfoTree, SegmentInfo
 
 from .utils import safezip
 from .thread_utils import ThreadedYielder
-from .sqeleton.abcs import ColType_UUID, NumericType, PrecisionType, StringType
+from .sqeleton.abcs import ColType_UUID, IKey, NumericType, PrecisionType, StringType
+from .sqeleton.abcs.database_types import Boolean, Decimal, TemporalType
+from .sqeleton.queries import Select, RowHash
 from .table_segment import TableSegment
+from .checksum_store import ChecksumStore
+from .arrow_diff import diff_sets_arrow
 
 from .diff_tables import TableDiffer
 
@@ -20,28 +30,218 @@ BENCHMARK = os.environ.get("BENCHMARK", False)
 
 DEFAULT_BISECTION_THRESHOLD = 1024 * 16
 DEFAULT_BISECTION_FACTOR = 32
+DEFAULT_BISECTION_FACTOR_BOUNDS = (4, 256)
+DEFAULT_BISECTION_THRESHOLD_BOUNDS = (1024, 1024 * 1024)
+
+# Values that both databases must hash the same, for native_hash to be used
+NATIVE_HASH_SAMPLE = [["1"], ["-12345"], ["data-diff"], ["2022-01-01 00:00:00.000000"], ["1", "0.50", None]]
 
 logger = logging.getLogger("hashdiff_tables")
 
 
-def diff_sets(a: set, b: set) -> Iterator:
+def _iter_key_groups(rows: Iterable[tuple], key: Callable, key_len: int) -> Iterator[Tuple[Any, List[tuple]]]:
+    "Groups consecutive rows by key, while validating that the keys are sorted"
+    last = None
+    for k, group in groupby(rows, key=lambda row: tuple(map(key, row[:key_len]))):
+        if last is not None and k < last:
+            raise ValueError(f"Rows are not sorted by key ({last} > {k})")
+        last = k
+        yield k, list(group)
+
+
+def diff_sorted(a: Iterable[tuple], b: Iterable[tuple], key: Callable = None, key_len: int = 1) -> Iterator:
+    """Diffs two streams of rows, which are both sorted by their key, using a merge-join.
+
+    Yields the same results as diff_sets(), but in a single pass, and without holding more
+    than one key's worth of rows in memory.
+
+    The key of each row is its first 'key_len' items. 'key' converts each of them into a value that follows
+    the order of the rows.
+    """
+    key = key or (lambda k: k)
+    groups_a = _iter_key_groups(a, key, key_len)
+    groups_b = _iter_key_groups(b, key, key_len)
+    next_a = next(groups_a, None)
+    next_b = next(groups_b, None)
+
+    while next_a is not None or next_b is not None:
+        if next_b is None or (next_a is not None and next_a[0] < next_b[0]):
+            for row in next_a[1]:
+                yield "-", row
+            next_a = next(groups_a, None)
+        elif next_a is None or next_b[0] < next_a[0]:
+            for row in next_b[1]:
+                yield "+", row
+            next_b = next(groups_b, None)
+        else:
+            rows_a, rows_b = next_a[1], next_b[1]
+            if rows_a != rows_b:
+                sa = set(rows_a)
+                sb = set(rows_b)
+                for row in rows_a:
+                    if row not in sb:
+                        yield "-", row
+                for row in rows_b:
+                    if row not in sa:
+                        yield "+", row
+            next_a = next(groups_a, None)
+            next_b = next(groups_b, None)
+
+
+def _count_rows(rows: Iterable[tuple], counts: Dict[int, int], i: int) -> Iterator[tuple]:
+    for row in rows:
+        counts[i] += 1
+        yield row
+
+
+def diff_sets(a: set, b: set, key_len: int = 1) -> Iterator:
     sa = set(a)
     sb = set(b)
 
-    # The first item is always the key (see TableDiffer.relevant_columns)
-    # TODO update when we add compound keys to hashdiff
+    # The first items are always the key columns (see TableSegment.relevant_columns)
     d = defaultdict(list)
     for row in a:
         if row not in sb:
-            d[row[0]].append(("-", row))
+            d[row[:key_len]].append(("-", row))
     for row in b:
         if row not in sa:
-            d[row[0]].append(("+", row))
+            d[row[:key_len]].append(("+", row))
 
     for _k, v in sorted(d.items(), key=lambda i: i[0]):
         yield from v
 
 
+def _diff_lists(a: List[tuple], b: List[tuple], key_len: int, sorted_by_int_key: bool) -> List[tuple]:
+    "Diffs two downloaded segments. Runs in the process pool, when local_diff_processes is set."
+    if sorted_by_int_key:
+        return list(diff_sorted(a, b, key=int, key_len=key_len))
+    return list(diff_sets(a, b, key_len=key_len))
+
+
+class ProcessPoolYielder(ThreadedYielder):
+    """A ThreadedYielder that also diffs downloaded segments in a pool of processes, for local_diff_processes
+
+    The process pool lives as long as the yielder, i.e. for a single diff, and is shut down when it's closed.
+    Segments that are diffed after that (by tasks that were already running) are skipped.
+    """
+
+    def __init__(self, max_workers: Optional[int], processes: int):
+        super().__init__(max_workers)
+        # Spawn, because forking a process that runs threads isn't safe
+        self._process_pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"))
+        self._process_pool_lock = threading.Lock()
+        self._process_pool_closed = False
+
+    def diff_lists(self, a: List[tuple], b: List[tuple], key_len: int, sorted_by_int_key: bool) -> List[tuple]:
+        "Diffs two downloaded segments in the process pool. The calling thread waits for the result."
+        with self._process_pool_lock:
+            if self._process_pool_closed:
+                return []  # The results are no longer wanted
+            future = self._process_pool.submit(_diff_lists, a, b, key_len, sorted_by_int_key)
+        return future.result()
+
+    def close(self):
+        super().close()
+        with self._process_pool_lock:
+            if self._process_pool_closed:
+                return
+            self._process_pool_closed = True
+        self._process_pool.shutdown(wait=False)
+
+
+class SiblingChecksums:
+    """Derives the count and checksum of the last sibling segment from the totals of its parent
+
+    Both count() and Checksum are sums, so they are additive: the parent's total equals the sum of
+    its children. Once every other sibling reports its result, the remaining one is computed by subtraction.
+    """
+
+    def __init__(self, parent: SegmentInfo, sibling_count: int, on_complete: Callable[[dict, dict], None]):
+        self._lock = threading.Lock()
+        self._pending = sibling_count
+        self._rowcounts = dict(parent.rowcounts)
+        self._checksums = {i: c or 0 for i, c in parent.checksums.items()}
+        self._on_complete = on_complete
+
+    def add(self, rowcounts: Dict[int, int], checksums: Dict[int, Optional[int]]):
+        with self._lock:
+            for i in (1, 2):
+                self._rowcounts[i] -= rowcounts[i]
+                self._checksums[i] -= checksums[i] or 0
+            self._pending -= 1
+            if self._pending:
+                return
+
+        checksums = {i: c if self._rowcounts[i] else None for i, c in self._checksums.items()}
+        self._on_complete(self._rowcounts, checksums)
+
+
+class BisectionTuner:
+    """Chooses the bisection factor and threshold from the query durations measured during the diff
+
+    The cost model is simple: each level of bisection costs one checksum round-trip per 'parallelism' segments,
+    and downloading a segment costs a fixed time per row. A segment is downloaded once that takes less time than
+    another checksum round-trip, and the factor is chosen to minimize the round-trips needed to get there.
+
+    Until both kinds of queries have been measured, the initial values are used (limited to the bounds).
+    """
+
+    EWMA_WEIGHT = 0.2  # Weight of the latest checksum duration, so recent (smaller) segments count more
+
+    def __init__(
+        self,
+        factor: int,
+        threshold: Number,
+        factor_bounds: Tuple[int, int],
+        threshold_bounds: Tuple[int, int],
+        parallelism: int,
+    ):
+        self._lock = threading.Lock()
+        self._factor = min(max(factor, factor_bounds[0]), factor_bounds[1])
+        self._threshold = min(max(threshold, threshold_bounds[0]), threshold_bounds[1])
+        self._factor_bounds = factor_bounds
+        self._threshold_bounds = threshold_bounds
+        self._parallelism = max(parallelism, 1)
+
+        self._checksum_duration = None
+        self._download_duration = 0.0
+        self._download_rows = 0
+
+    def record_checksum(self, duration: float):
+        with self._lock:
+            if self._checksum_duration is None:
+                self._checksum_duration = duration
+            else:
+                self._checksum_duration += self.EWMA_WEIGHT * (duration - self._checksum_duration)
+
+    def record_download(self, duration: float, rows: int):
+        with self._lock:
+            self._download_duration += duration
+            self._download_rows += rows
+
+    @property
+    def threshold(self) -> Number:
+        with self._lock:
+            if self._checksum_duration is None or not self._download_rows or not self._download_duration:
+                return self._threshold
+            rows_per_checksum = self._checksum_duration * self._download_rows / self._download_duration
+
+        low, high = self._threshold_bounds
+        return int(min(max(rows_per_checksum, low), high))
+
+    def choose_factor(self, max_rows: int) -> int:
+        if self._checksum_duration is None:
+            return self._factor
+        threshold = self.threshold
+
+        def round_trips(factor):
+            levels = math.ceil(math.log(max(max_rows / threshold, 1)) / math.log(factor))
+            return max(levels, 1) * math.ceil(factor / self._parallelism)
+
+        low, high = self._factor_bounds
+        return min(range(low, high + 1), key=round_trips)  # Ties go to the smaller factor (fewer queries)
+
+
 @dataclass
 class HashDiffer(TableDiffer):
     """Finds the diff between two SQL tables
@@ -55,24 +255,242 @@ class HashDiffer(TableDiffer):
         bisection_factor (int): Into how many segments to bisect per iteration.
         bisection_threshold (Number): When should we stop bisecting and compare locally (in row count).
         threaded (bool): Enable/disable threaded diffing. Needed to take advantage of database threads.
-        max_threadpool_size (int): Maximum size of each threadpool. ``None`` means auto.
+        max_threadpool_size (int): Maximum size of each thread pool. ``None`` means auto.
                                    Only relevant when `threaded` is ``True``.
-                                   There may be many pools, so number of actual threads can be a lot higher.
+                                   Each diff uses two pools of this size: one runs the segments, and one is
+                                   shared by the queries of all the segments, so at most this many queries run
+                                   at once. (Before, each segment queried in a pool of its own, so it ran up to
+                                   twice as many. Raise it to keep that concurrency)
+        additive_checksum (bool): Infer the count and checksum of the last segment in each bisection from its parent,
+                                  instead of querying it. Saves 1/bisection_factor of the checksum queries.
+                                  Requires the tables not to change while diffing. (default: False)
+        batched_checksum (bool): Count and checksum all the segments of a bisection in a single query per table,
+                                 grouped by segment, instead of one query per segment. (default: False)
+        download_row_hashes (bool): When comparing a segment locally, first download only the key and a hash of
+                                    each row, and then download the full rows only for keys that differ.
+                                    Reduces network traffic for wide tables. (default: False)
+        histogram_checkpoints (bool): Choose checkpoints that split the rows evenly, according to the key distribution
+                                      estimated by the database (e.g. PostgreSQL's pg_stats), when available.
+                                      Otherwise, checkpoints split the key range evenly. (default: False)
+        adaptive_bisection (bool): Adjust the bisection factor and threshold during the diff, according to the measured
+                                   duration of checksum queries and of downloads. `bisection_factor` and
+                                   `bisection_threshold` are used until there are measurements, limited to the
+                                   bounds below. (default: False)
+        bisection_factor_bounds (Tuple[int, int]): Min and max bisection factor, when `adaptive_bisection` is enabled.
+        bisection_threshold_bounds (Tuple[int, int]): Min and max bisection threshold, when `adaptive_bisection`
+                                                      is enabled.
+        checksum_store (str, optional): Path of a SQLite file for keeping the checksums and diffs of the segments.
+                                        When diffing the same tables again, segments whose checksums didn't change
+                                        on either side reuse their previous diff, instead of bisecting.
+                                        Segments are split at the same checkpoints as in the previous diff.
+        hash_partitioning (bool): Split the tables by a hash of the key, instead of by key ranges, and checksum
+                                  the segments of each split with a single GROUP BY query per table.
+                                  Works with any key type, but can't use an index on the key.
+                                  Used automatically for keys that can't be split into ranges, like free-form text.
+                                  Not supported with `checksum_store`. (default: False)
+        native_hash (bool): When both tables are in the same kind of database, checksum them with the database's
+                            own hash function (e.g. PostgreSQL's hashtextextended, Snowflake's HASH), instead of md5.
+                            Used only if both databases hash a sample of values the same, and not with
+                            `checksum_store`. (default: False)
+        skip_normalization (bool): When both tables are in the same kind of database, checksum the temporal, decimal
+                                   and boolean columns that have identical types on both sides as the database formats
+                                   them, instead of normalizing them first. Assumes both databases are configured
+                                   to format values the same way. Downloaded rows are still normalized. (default: False)
+        column_checksums (bool): Also checksum each column in the same query as the segment, to find which columns
+                                 differ (see SegmentInfo.diff_columns). When a segment's keys match, it's compared
+                                 locally by downloading only the key and the differing columns, and then the full rows
+                                 of the keys that differ. Counts the differences of each column in stats["diff_counts"].
+                                 Not used for segments checksummed by batched_checksum, additive_checksum or
+                                 hash partitioning. (default: False)
+        vectorized_diff (bool): Download segments as Arrow tables, and compare them with vectorized joins, instead of
+                                with Python sets. Faster for large segments, especially with drivers that return
+                                Arrow natively (see Database.query_arrow), but holds both segments in memory.
+                                Requires pyarrow.
+                                (default: False)
+        local_diff_processes (int): Compare downloaded segments in a pool of this many processes, instead of in the
+                                    diffing threads, so that the local comparisons can use more than one core.
+                                    Rows are downloaded in full before being sent to a process, instead of being
+                                    streamed. Not used with `vectorized_diff`. (default: 0, i.e. disabled)
     """
 
     bisection_factor: int = DEFAULT_BISECTION_FACTOR
     bisection_threshold: Number = DEFAULT_BISECTION_THRESHOLD  # Accepts inf for tests
+    additive_checksum: bool = False
+    batched_checksum: bool = False
+    download_row_hashes: bool = False
+    histogram_checkpoints: bool = False
+    adaptive_bisection: bool = False
+    bisection_factor_bounds: Tuple[int, int] = DEFAULT_BISECTION_FACTOR_BOUNDS
+    bisection_threshold_bounds: Tuple[int, int] = DEFAULT_BISECTION_THRESHOLD_BOUNDS
+    checksum_store: Optional[str] = None
+    hash_partitioning: bool = False
+    native_hash: bool = False
+    skip_normalization: bool = False
+    column_checksums: bool = False
+    vectorized_diff: bool = False
+    local_diff_processes: int = 0
 
     stats: dict = {}
 
+    _tuner = None  # BisectionTuner of the current diff, when adaptive_bisection is enabled
+    _checksum_run = None  # ChecksumRun of the current diff, when checksum_store is set
+    _raw_columns = None  # Columns of each table that don't need normalization, when skip_normalization is enabled
+
     def __post_init__(self):
+        super().__post_init__()
+
         # Validate options
-        if self.bisection_factor >= self.bisection_threshold:
-            raise ValueError("Incorrect param values (bisection factor must be lower than threshold)")
         if self.bisection_factor < 2:
             raise ValueError("Must have at least two segments per iteration (i.e. bisection_factor >= 2)")
+        if self.adaptive_bisection:
+            # The tuned values can be anywhere within the bounds
+            min_factor, max_factor = self.bisection_factor_bounds
+            min_threshold, max_threshold = self.bisection_threshold_bounds
+            if not 2 <= min_factor <= max_factor:
+                raise ValueError("Incorrect bisection_factor_bounds (expected 2 <= min <= max)")
+            if not 0 < min_threshold <= max_threshold:
+                raise ValueError("Incorrect bisection_threshold_bounds (expected 0 < min <= max)")
+            if max_factor >= min_threshold:
+                raise ValueError("Incorrect bounds (max bisection factor must be lower than min threshold)")
+        elif self.bisection_factor >= self.bisection_threshold:
+            raise ValueError("Incorrect param values (bisection factor must be lower than threshold)")
+        if self.local_diff_processes < 0:
+            raise ValueError("Incorrect local_diff_processes (expected 0 or more)")
+
+    def _diff_tables_root(self, table1: TableSegment, table2: TableSegment, info_tree: InfoTree) -> Iterator:
+        if not self.checksum_store:
+            yield from super()._diff_tables_root(table1, table2, info_tree)
+            return
+
+        store = ChecksumStore(self.checksum_store)
+        run = store.load(table1, table2)
+        # Not a field, so it isn't copied by replace(). (setattr is blocked by frozen dataclass)
+        object.__setattr__(self, "_checksum_run", run)
+        yield from super()._diff_tables_root(table1, table2, info_tree)
+        # Only a complete diff can be reused
+        store.save(run)
+
+    def _choose_checkpoints(self, table1, table2, level, max_rows):
+        run = self._checksum_run
+        if run is None or level > 0 or table1.is_composite_key:
+            return super()._choose_checkpoints(table1, table2, level, max_rows)
+
+        # Split the table like the previous diff did, so we can find the same segments
+        (key,) = table1.key_columns
+        make_value = table1._schema[key].make_value
+        checkpoints = [c for c in map(make_value, run.previous_checkpoints) if table1.min_key < c < table1.max_key]
+        if not checkpoints:
+            checkpoints = super()._choose_checkpoints(table1, table2, level, max_rows)
+        run.add_checkpoints(checkpoints)
+        return checkpoints
+
+    def _bisect_and_diff_tables(self, table1, table2, info_tree):
+        if self.adaptive_bisection:
+            tuner = BisectionTuner(
+                self.bisection_factor,
+                self.bisection_threshold,
+                self.bisection_factor_bounds,
+                self.bisection_threshold_bounds,
+                parallelism=(self.max_threadpool_size or os.cpu_count()) if self.threaded else 1,
+            )
+            # Not a field, so it isn't copied by replace(). (setattr is blocked by frozen dataclass)
+            object.__setattr__(self, "_tuner", tuner)
+
+        if self.native_hash:
+            table1, table2 = self._with_native_hash(table1, table2)
+        if self._raw_columns:
+            raw1, raw2 = self._raw_columns
+            table1, table2 = table1.new(raw_columns=raw1), table2.new(raw_columns=raw2)
+
+        key_types = [t._schema[k] for t in (table1, table2) for k in t.key_columns]
+        if self.hash_partitioning or not all(isinstance(kt, IKey) for kt in key_types):
+            return self._hash_partition_and_diff_tables(table1, table2, info_tree)
+
+        if self.histogram_checkpoints:
+            table1, table2 = self._threaded_call("with_key_histogram", [table1, table2])
+        return super()._bisect_and_diff_tables(table1, table2, info_tree)
+
+    def _with_native_hash(self, table1: TableSegment, table2: TableSegment) -> Tuple[TableSegment, TableSegment]:
+        if self.checksum_store:
+            logger.warning(
+                "native_hash is ignored with checksum_store, whose checksums must be comparable between runs"
+            )
+            return table1, table2
+
+        db1, db2 = table1.database, table2.database
+        if type(db1.dialect) is not type(db2.dialect):
+            logger.info("Databases are of different kinds. Hashing with md5.")
+            return table1, table2
+
+        try:
+            db1.dialect.native_hash_as_int("''")
+        except NotImplementedError:
+            logger.info(f"{db1.dialect.name} has no native hash function. Hashing with md5.")
+            return table1, table2
+
+        if db1 is not db2:
+            # The hash function may depend on the version or configuration of the database
+            q = Select(columns=[RowHash(values, native=True) for values in NATIVE_HASH_SAMPLE])
+            hashes1, hashes2 = self._thread_map(lambda db: db.query(q, tuple), [db1, db2])
+            if hashes1 != hashes2:
+                logger.warning("The native hash functions of the databases don't agree. Hashing with md5.")
+                return table1, table2
+
+        logger.info(f"Hashing with the native hash function of {db1.dialect.name}")
+        return table1.new(native_hash=True), table2.new(native_hash=True)
+
+    def _hash_partition_and_diff_tables(self, table1, table2, info_tree):
+        if self.checksum_store:
+            raise ValueError("checksum_store is not supported with hash partitioning")
+        if len(table1.key_columns) != len(table2.key_columns):
+            raise ValueError("Tables should have an equivalent number of key columns!")
+
+        table1, table2 = [t.new(key_hash_bucket=(1, 0)) for t in (table1, table2)]
+        max_rows = max(self._threaded_call("count", [table1, table2]))
+        info_tree.info.max_rows = max_rows
+        logger.info(f"Diffing segments by key hash. size <= {max_rows}")
+
+        ti = self._create_threaded_yielder()
+        ti.submit(self._bisect_and_diff_segments, ti, table1, table2, info_tree, max_rows=max_rows)
+        return ti
+
+    def _create_threaded_yielder(self) -> ThreadedYielder:
+        if self.local_diff_processes:
+            return ProcessPoolYielder(self.max_threadpool_size, self.local_diff_processes)
+        return super()._create_threaded_yielder()
+
+    def _choose_bisection_factor(self, max_rows: Optional[int]) -> int:
+        if self._tuner is None or max_rows is None:
+            return self.bisection_factor
+        return self._tuner.choose_factor(max_rows)
+
+    @property
+    def _bisection_threshold(self) -> Number:
+        if self._tuner is None:
+            return self.bisection_threshold
+        return self._tuner.threshold
+
+    def _plan_raw_columns(self, table1: TableSegment, table2: TableSegment) -> Tuple[tuple, tuple]:
+        "Returns the columns of each table that have the same values with or without normalization"
+        if type(table1.database.dialect) is not type(table2.database.dialect):
+            return (), ()
+
+        raw = [
+            (c1, c2)
+            for c1, c2 in safezip(table1.relevant_columns, table2.relevant_columns)
+            if table1._schema[c1] == table2._schema[c2]
+            and isinstance(table1._schema[c1], (TemporalType, Decimal, Boolean))
+        ]
+        if raw:
+            logger.info(f"Checksumming columns without normalization: {', '.join(c1 for c1, _c2 in raw)}")
+        return tuple(c1 for c1, _c2 in raw), tuple(c2 for _c1, c2 in raw)
 
     def _validate_and_adjust_columns(self, table1, table2):
+        if self.skip_normalization:
+            # Planned before the precisions are adjusted, since only identical types can skip normalization
+            # Not a field, so it isn't copied by replace(). (setattr is blocked by frozen dataclass)
+            object.__setattr__(self, "_raw_columns", self._plan_raw_columns(table1, table2))
+
         for c1, c2 in safezip(table1.relevant_columns, table2.relevant_columns):
             if c1 not in table1._schema:
                 raise ValueError(f"Column '{c1}' not found in schema for table {table1}")
@@ -133,6 +551,7 @@ class HashDiffer(TableDiffer):
         level=0,
         segment_index=None,
         segment_count=None,
+        siblings: SiblingChecksums = None,
     ):
         logger.info(
             ". " * level + f"Diffing segment {segment_index}/{segment_count}, "
@@ -148,10 +567,32 @@ class HashDiffer(TableDiffer):
             if max_rows < self.bisection_threshold:
                 return self._bisect_and_diff_segments(ti, table1, table2, info_tree, level=level, max_rows=max_rows)
 
-        (count1, checksum1), (count2, checksum2) = self._threaded_call("count_and_checksum", [table1, table2])
-
-        assert not info_tree.info.rowcounts
-        info_tree.info.rowcounts = {1: count1, 2: count2}
+        if info_tree.info.rowcounts:
+            # Already inferred from the parent segment (see additive_checksum)
+            count1, count2 = info_tree.info.rowcounts[1], info_tree.info.rowcounts[2]
+            checksum1, checksum2 = info_tree.info.checksums[1], info_tree.info.checksums[2]
+        else:
+            start = time.monotonic()
+            if self.column_checksums:
+                (count1, checksum1, columns1), (count2, checksum2, columns2) = self._threaded_call(
+                    "count_and_checksum_by_column", [table1, table2]
+                )
+                info_tree.info.column_checksums = {1: columns1, 2: columns2}
+                info_tree.info.diff_columns = [
+                    c for c, x, y in safezip(table1.relevant_columns, columns1, columns2) if x != y
+                ]
+            else:
+                (count1, checksum1), (count2, checksum2) = self._threaded_call("count_and_checksum", [table1, table2])
+            if self._tuner is not None:
+                self._tuner.record_checksum(time.monotonic() - start)
+            info_tree.info.rowcounts = {1: count1, 2: count2}
+            info_tree.info.checksums = {1: checksum1, 2: checksum2}
+            if siblings is not None:
+                siblings.add(info_tree.info.rowcounts, info_tree.info.checksums)
+
+        run = self._checksum_run
+        if run is not None:
+            run.add_checksums(table1, (count1, checksum1, count2, checksum2))
 
         if count1 == 0 and count2 == 0:
             logger.debug(
@@ -162,13 +603,25 @@ class HashDiffer(TableDiffer):
             )
             assert checksum1 is None and checksum2 is None
             info_tree.info.is_diff = False
+            if run is not None:
+                run.add_diff(table1, [])
             return
 
         if checksum1 == checksum2:
             info_tree.info.is_diff = False
+            if run is not None:
+                run.add_diff(table1, [])
             return
 
         info_tree.info.is_diff = True
+        if run is not None:
+            diff = run.find_diff(table1, (count1, checksum1, count2, checksum2))
+            if diff is not None:
+                info_tree.info.set_diff(diff)
+                run.add_diff(table1, diff)
+                self.stats["reused_segments"] = self.stats.get("reused_segments", 0) + 1
+                return diff
+
         return self._bisect_and_diff_segments(ti, table1, table2, info_tree, level=level, max_rows=max(count1, count2))
 
     def _bisect_and_diff_segments(
@@ -180,25 +633,239 @@ class HashDiffer(TableDiffer):
         level=0,
         max_rows=None,
     ):
-        assert table1.is_bounded and table2.is_bounded
+        assert (table1.is_bounded and table2.is_bounded) or table1.key_hash_bucket is not None
 
-        max_space_size = max(table1.approximate_size(), table2.approximate_size())
+        # Both tables have the same key range. Its size is unknown for most ranges of composite keys.
+        max_space_size = table1.approximate_size()
         if max_rows is None:
-            # We can be sure that row_count <= max_rows iff the table key is unique
-            max_rows = max_space_size
+            if max_space_size is None:
+                max_rows = max(self._threaded_call("count", [table1, table2]))
+            else:
+                # We can be sure that row_count <= max_rows iff the table key is unique
+                max_rows = max_space_size
             info_tree.info.max_rows = max_rows
 
         # If count is below the threshold, just download and compare the columns locally
         # This saves time, as bisection speed is limited by ping and query performance.
-        if max_rows < self.bisection_threshold or max_space_size < self.bisection_factor * 2:
-            rows1, rows2 = self._threaded_call("get_values", [table1, table2])
-            diff = list(diff_sets(rows1, rows2))
+        space_too_small = max_space_size is not None and max_space_size < self._choose_bisection_factor(max_rows) * 2
+        if max_rows < self._bisection_threshold or space_too_small:
+            rowcounts = {1: 0, 2: 0}
+            start = time.monotonic()
+            diff = list(self._diff_rows(ti, table1, table2, rowcounts, info_tree.info.diff_columns))
+            if self._tuner is not None:
+                self._tuner.record_download(time.monotonic() - start, max(rowcounts.values()))
 
             info_tree.info.set_diff(diff)
-            info_tree.info.rowcounts = {1: len(rows1), 2: len(rows2)}
+            info_tree.info.rowcounts = rowcounts
+            if self._checksum_run is not None:
+                self._checksum_run.add_diff(table1, diff)
 
             logger.info(". " * level + f"Diff found {len(diff)} different rows.")
-            self.stats["rows_downloaded"] = self.stats.get("rows_downloaded", 0) + max(len(rows1), len(rows2))
+            self.stats["rows_downloaded"] = self.stats.get("rows_downloaded", 0) + max(rowcounts.values())
             return diff
 
+        if table1.key_hash_bucket is not None:
+            factor = self._choose_bisection_factor(max_rows)
+            segmented1, segmented2 = [t.split_by_key_hash(factor) for t in (table1, table2)]
+            return self._diff_segment_pairs(ti, segmented1, segmented2, info_tree, level, max_rows)
+
         return super()._bisect_and_diff_segments(ti, table1, table2, info_tree, level, max_rows)
+
+    def _diff_rows(
+        self,
+        ti: ThreadedYielder,
+        table1: TableSegment,
+        table2: TableSegment,
+        rowcounts: Dict[int, int],
+        diff_columns: List[str] = None,
+    ) -> Iterator:
+        "Downloads the rows of both segments, and diffs them locally. Updates 'rowcounts' as rows arrive."
+        if diff_columns and not set(diff_columns) & set(table1.key_columns):
+            # The keys match, so only the values of some columns differ
+            return self._diff_rows_by_columns(ti, table1, table2, rowcounts, diff_columns)
+        if self.download_row_hashes:
+            return self._diff_rows_by_hash(ti, table1, table2, rowcounts)
+        return self._download_and_diff(ti, table1, table2, rowcounts, "iter_values", "get_values")
+
+    def _download_and_diff(self, ti, table1, table2, rowcounts, iter_method: str, get_method: str) -> Iterator:
+        key_len = len(table1.key_columns)
+        if self.vectorized_diff:
+            rows1, rows2 = self._threaded_call(f"{get_method}_arrow", [table1, table2])
+            rowcounts.update({1: len(rows1), 2: len(rows2)})
+            key = int if table1.is_key_sorted_like_db else None
+            return diff_sets_arrow(rows1, rows2, key_len=key_len, key=key)
+
+        if table1.is_key_sorted_like_db and not isinstance(ti, ProcessPoolYielder):
+            # Rows arrive sorted by key, in an order we can reproduce, so we can stream them (see TableSegment.get_values)
+            rows1 = _count_rows(methodcaller(iter_method)(table1), rowcounts, 1)
+            rows2 = _count_rows(methodcaller(iter_method)(table2), rowcounts, 2)
+            return diff_sorted(rows1, rows2, key=int, key_len=key_len)
+
+        rows1, rows2 = self._threaded_call(get_method, [table1, table2])
+        rowcounts.update({1: len(rows1), 2: len(rows2)})
+        return self._diff_downloaded(ti, table1, rows1, rows2)
+
+    def _diff_downloaded(
+        self, ti: ThreadedYielder, table: TableSegment, rows1: List[tuple], rows2: List[tuple]
+    ) -> Iterator:
+        "Diffs two downloaded segments, in the process pool if there is one. (The calling thread waits for the result.)"
+        key_len = len(table.key_columns)
+        sorted_by_int_key = table.is_key_sorted_like_db
+        if isinstance(ti, ProcessPoolYielder):
+            return iter(ti.diff_lists(rows1, rows2, key_len, sorted_by_int_key))
+        if sorted_by_int_key:
+            return diff_sorted(rows1, rows2, key=int, key_len=key_len)
+        return diff_sets(rows1, rows2, key_len=key_len)
+
+    def _diff_rows_by_hash(
+        self, ti: ThreadedYielder, table1: TableSegment, table2: TableSegment, rowcounts: Dict[int, int]
+    ) -> Iterator:
+        # Diff (key, hash) pairs first, to find which keys are missing or different
+        hash_diff = self._download_and_diff(ti, table1, table2, rowcounts, "iter_key_hashes", "get_key_hashes")
+        key_len = len(table1.key_columns)
+        # Unique, and in order. Composite keys are tuples.
+        keys = list(dict.fromkeys(row[0] if key_len == 1 else row[:key_len] for _sign, row in hash_diff))
+        if not keys:
+            return iter([])
+
+        if len(keys) > max(rowcounts.values()) / 2:
+            # Most rows differ. Downloading the entire segment is cheaper than fetching them one by one.
+            return self._download_and_diff(ti, table1, table2, {1: 0, 2: 0}, "iter_values", "get_values")
+
+        self.stats["rows_downloaded_by_key"] = self.stats.get("rows_downloaded_by_key", 0) + len(keys)
+        rows1, rows2 = self._thread_map(methodcaller("get_values", keys), [table1, table2])
+        return self._diff_downloaded(ti, table1, rows1, rows2)
+
+    def _diff_rows_by_columns(
+        self,
+        ti: ThreadedYielder,
+        table1: TableSegment,
+        table2: TableSegment,
+        rowcounts: Dict[int, int],
+        diff_columns: List[str],
+    ) -> Iterator:
+        # Download the key and the differing columns, to find which keys differ, and count differences per column
+        key_len = len(table1.key_columns)
+        columns2 = [c2 for c1, c2 in safezip(table1.relevant_columns, table2.relevant_columns) if c1 in diff_columns]
+        rows1, rows2 = self._thread_map(
+            lambda table_columns: table_columns[0].get_values(columns=table_columns[1]),
+            [(table1, diff_columns), (table2, columns2)],
+        )
+        rowcounts.update({1: len(rows1), 2: len(rows2)})
+
+        values2 = {row[:key_len]: row[key_len:] for row in rows2}
+        keys = []
+        diff_counts = self.stats.setdefault("diff_counts", {})
+        for row in rows1:
+            values = values2.get(row[:key_len])
+            if values is None or values == row[key_len:]:
+                continue
+            keys.append(row[0] if key_len == 1 else row[:key_len])
+            for c, x, y in safezip(diff_columns, row[key_len:], values):
+                if x != y:
+                    diff_counts[c] = diff_counts.get(c, 0) + 1
+        if not keys:
+            return iter([])
+
+        self.stats["rows_downloaded_by_key"] = self.stats.get("rows_downloaded_by_key", 0) + len(keys)
+        rows1, rows2 = self._thread_map(methodcaller("get_values", keys), [table1, table2])
+        return self._diff_downloaded(ti, table1, rows1, rows2)
+
+    def _diff_segment_pairs(
+        self,
+        ti: ThreadedYielder,
+        segmented1: List[TableSegment],
+        segmented2: List[TableSegment],
+        info_tree: InfoTree,
+        level: int,
+        max_rows: Optional[int],
+    ):
+        if BENCHMARK or len(segmented1) < 2:
+            return super()._diff_segment_pairs(ti, segmented1, segmented2, info_tree, level, max_rows)
+
+        # Hash buckets are spread over the whole table, so they are always checksummed together
+        if self.batched_checksum or segmented1[0].key_hash_bucket is not None:
+            return self._diff_segment_pairs_batched(ti, segmented1, segmented2, info_tree, level, max_rows)
+
+        if not self.additive_checksum or not info_tree.info.checksums:
+            return super()._diff_segment_pairs(ti, segmented1, segmented2, info_tree, level, max_rows)
+
+        segment_count = len(segmented1)
+        nodes = [info_tree.add_node(t1, t2, max_rows=max_rows) for t1, t2 in safezip(segmented1, segmented2)]
+        *measured, inferred = nodes
+
+        def diff_inferred(rowcounts, checksums):
+            if any(c < 0 for c in rowcounts.values()):
+                # Tables must have changed while diffing. Fall back to querying.
+                logger.warning("Inferred a negative row count for segment. Tables may have changed during the diff.")
+            else:
+                inferred.info.rowcounts = rowcounts
+                inferred.info.checksums = checksums
+                self.stats["inferred_checksums"] = self.stats.get("inferred_checksums", 0) + 1
+            t1, t2 = inferred.info.tables
+            ti.submit(
+                self._diff_segments,
+                ti,
+                t1,
+                t2,
+                inferred,
+                max_rows,
+                level + 1,
+                segment_count,
+                segment_count,
+                priority=level,
+            )
+
+        siblings = SiblingChecksums(info_tree.info, len(measured), diff_inferred)
+        for i, node in enumerate(measured):
+            t1, t2 = node.info.tables
+            ti.submit(
+                self._diff_segments,
+                ti,
+                t1,
+                t2,
+                node,
+                max_rows,
+                level + 1,
+                i + 1,
+                segment_count,
+                siblings=siblings,
+                priority=level,
+            )
+
+    def _diff_segment_pairs_batched(
+        self,
+        ti: ThreadedYielder,
+        segmented1: List[TableSegment],
+        segmented2: List[TableSegment],
+        info_tree: InfoTree,
+        level: int,
+        max_rows: Optional[int],
+    ):
+        # Checksum the whole range once per table, grouped by segment, and hand the results to the children.
+        if segmented1[0].key_hash_bucket is not None:
+            segment_count = len(segmented1)
+            modulus, remainder = segmented1[0].key_hash_bucket
+            table1, table2 = [
+                s[0].new(key_hash_bucket=(modulus // segment_count, remainder)) for s in (segmented1, segmented2)
+            ]
+            count_and_checksum = methodcaller("count_and_checksum_by_key_hash", segment_count)
+        else:
+            checkpoints = [t.max_key for t in segmented1[:-1]]
+            table1, table2 = [s[0].new(max_key=s[-1].max_key) for s in (segmented1, segmented2)]
+            count_and_checksum = methodcaller("count_and_checksum_by_checkpoints", checkpoints)
+        start = time.monotonic()
+        results1, results2 = self._thread_map(count_and_checksum, [table1, table2])
+        if self._tuner is not None:
+            self._tuner.record_checksum(time.monotonic() - start)
+
+        segment_count = len(segmented1)
+        for i, (t1, t2, (count1, checksum1), (count2, checksum2)) in enumerate(
+            safezip(segmented1, segmented2, results1, results2)
+        ):
+            info_node = info_tree.add_node(t1, t2, max_rows=max_rows)
+            info_node.info.rowcounts = {1: count1, 2: count2}
+            info_node.info.checksums = {1: checksum1, 2: checksum2}
+            ti.submit(
+                self._diff_segments, ti, t1, t2, info_node, max_rows, level + 1, i + 1, segment_count, priority=level
+            )
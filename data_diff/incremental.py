@@ -0,0 +1,136 @@
+"""Diffs only the rows that were updated since the previous diff, according to the update_column"""
+
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from operator import methodcaller
+from typing import Iterator, List, Optional, Tuple
+
+from .checksum_store import table_pair_id
+from .diff_tables import TableDiffer
+from .hashdiff_tables import diff_sets
+from .table_segment import TableSegment
+
+logger = logging.getLogger("incremental")
+
+DEFAULT_WATERMARK_OVERLAP = timedelta(minutes=10)
+
+
+class WatermarkState:
+    """A JSON file that keeps, for each pair of tables, the latest update_column value diffed on each side,
+    and the differences that were found so far.
+
+    Parameters:
+        path (str): Path of the JSON file. Created if it doesn't exist.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def load(self, pair_id: str) -> Tuple[List[Optional[datetime]], list]:
+        "Returns the watermark of each table, and the outstanding diff"
+        state = self._read().get(pair_id)
+        if state is None:
+            return [None, None], []
+
+        watermarks = [datetime.fromisoformat(w) if w else None for w in state["watermarks"]]
+        diff = [(sign, tuple(row)) for sign, row in state["diff"]]
+        return watermarks, diff
+
+    def save(self, pair_id: str, watermarks: List[Optional[datetime]], diff: list):
+        state = self._read()
+        state[pair_id] = {
+            "watermarks": [w.isoformat() if w else None for w in watermarks],
+            "diff": diff,
+        }
+
+        # Write to a temporary file first, so an interruption won't corrupt the state
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, default=str)
+        os.replace(tmp_path, self.path)
+
+
+def diff_tables_incremental(
+    differ: TableDiffer,
+    table1: TableSegment,
+    table2: TableSegment,
+    state_path: str,
+    overlap: timedelta = DEFAULT_WATERMARK_OVERLAP,
+) -> Iterator[tuple]:
+    """Diffs the rows updated since the previous run, and merges the result into the diff kept in the state file.
+
+    On the first run, the tables are diffed in full, using the given differ. Later runs only look at the rows
+    with ``update_column >= watermark - overlap`` on either side, where the watermark is the lowest of the two
+    tables. The overlap accounts for replication lag, and for rows committed out of order.
+
+    Those rows, and the rows of previously found differences, are compared again by key, so that fixed rows
+    leave the diff. Deleted rows are only found by a full diff.
+
+    Returns the merged diff. The state file is updated once it's fully consumed.
+    """
+    if not (table1.update_column and table2.update_column):
+        raise ValueError("Incremental diff requires 'update_column' to be set.")
+    if len(table1.key_columns) > 1 or len(table2.key_columns) > 1:
+        raise NotImplementedError("Incremental diff doesn't support composite keys yet!")
+
+    with differ._task_pool_scope():
+        table1, table2 = differ._threaded_call("with_schema", [table1, table2])
+        differ._validate_and_adjust_columns(table1, table2)
+
+        state = WatermarkState(state_path)
+        pair_id = table_pair_id(table1, table2)
+        watermarks, prev_diff = state.load(pair_id)
+
+        # Query the new watermarks before diffing, so rows updated during the diff will be diffed again next time
+        new_watermarks = [_naive(w) for w in differ._threaded_call("query_max_update", [table1, table2])]
+
+        if any(watermarks):
+            since = min(w for w in watermarks if w) - overlap
+            logger.info(f"Diffing rows updated since {since}")
+            segments = [_restrict_updates(t, since) for t in (table1, table2)]
+            updated_keys = differ._thread_map(methodcaller("get_key_hashes"), [t for t in segments if t])
+
+            # Compare the updated rows, and the outstanding differences, without the update filter
+            keys = list(
+                dict.fromkeys([k for rows in updated_keys for k, _hash in rows] + [r[0] for _s, r in prev_diff])
+            )
+            if keys:
+                rows1, rows2 = differ._thread_map(methodcaller("get_values", keys), [table1, table2])
+                diff = list(diff_sets(rows1, rows2))
+            else:
+                diff = []
+            logger.info(f"Compared {len(keys)} updated or previously different rows")
+        else:
+            logger.info("No previous watermark. Diffing all the rows")
+            diff = list(differ.diff_tables(table1, table2))
+
+    yield from diff
+
+    watermarks = [new or old for new, old in zip(new_watermarks, watermarks)]
+    state.save(pair_id, watermarks, diff)
+
+
+def _restrict_updates(table: TableSegment, since: datetime) -> Optional[TableSegment]:
+    # The bounds may be aware, but the watermark is naive UTC
+    min_update, max_update = _naive(table.min_update), _naive(table.max_update)
+    if max_update is not None and since >= max_update:
+        return None  # Nothing to diff
+    if min_update is not None and min_update > since:
+        return table
+    return table.new(min_update=since, max_update=max_update)
+
+
+def _naive(t: Optional[datetime]) -> Optional[datetime]:
+    "Returns the time in UTC, without tzinfo, like the timestamps of the diff (see set_timezone_to_utc())"
+    if t is None or t.tzinfo is None:
+        return t
+    return t.astimezone(timezone.utc).replace(tzinfo=None)
@@ -1,4 +1,4 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 from runtype import dataclass
 
@@ -14,8 +14,13 @@ class SegmentInfo:
     diff_count: int = None
 
     rowcounts: Dict[int, int] = {}
+    checksums: Dict[int, Optional[int]] = {}
     max_rows: int = None
 
+    # Only set by hashdiff's column_checksums
+    column_checksums: Dict[int, tuple] = {}
+    diff_columns: List[str] = None  # Relevant columns of table1 whose checksums differ
+
     def set_diff(self, diff):
         self.diff = diff
         self.diff_count = len(diff)
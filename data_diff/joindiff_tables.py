@@ -28,11 +28,11 @@ from .sqeleton.queries import (
     Compiler,
 )
 from .sqeleton.queries.ast_classes import Concat, Count, Expr, Random, TablePath, Code, ITable
-from .sqeleton.queries.extras import NormalizeAsString
+from .sqeleton.queries.extras import Checksum, NormalizeAsString
 
 from .info_tree import InfoTree
 
-from .query_utils import append_to_table, drop_table
+from .query_utils import append_to_table, append_to_table_queries, drop_table
 from .utils import safezip
 from .table_segment import TableSegment
 from .diff_tables import TableDiffer, DiffResult
@@ -87,14 +87,24 @@ def _outerjoin(db: Database, a: ITable, b: ITable, keys1: List[str], keys2: List
         is_exclusive_b = bool_to_int(is_exclusive_b)
 
     if isinstance(db, MySQL):
-        # No outer join
+        # No outer join. The left join has all the rows of 'a', and the anti-join adds the rows exclusive to 'b'.
+        # They can't overlap, so UNION ALL avoids the sort of UNION.
+        # The anti-join stays a right join, instead of NOT EXISTS, because select_fields refer to the columns of
+        # both tables. It costs the same: the derived table is merged (derived_merge), which leaves the
+        # "key IS NULL" filter on the join, and MySQL stops at the first match of each row ("Not exists" in EXPLAIN).
         l = leftjoin(a, b).on(*on).select(is_exclusive_a=is_exclusive_a, is_exclusive_b=False, **select_fields)
         r = rightjoin(a, b).on(*on).select(is_exclusive_a=False, is_exclusive_b=is_exclusive_b, **select_fields)
-        return l.union(r)
+        return l.union_all(r.where(this.is_exclusive_b))
 
     return outerjoin(a, b).on(*on).select(is_exclusive_a=is_exclusive_a, is_exclusive_b=is_exclusive_b, **select_fields)
 
 
+def _is_exclusive(db: Database) -> Expr:
+    if isinstance(db, Oracle):
+        return (this.is_exclusive_a == 1) | (this.is_exclusive_b == 1)
+    return this.is_exclusive_a | this.is_exclusive_b
+
+
 def _slice_tuple(t, *sizes):
     i = 0
     for size in sizes:
@@ -120,17 +130,28 @@ class JoinDiffer(TableDiffer):
 
     Parameters:
         threaded (bool): Enable/disable threaded diffing. Needed to take advantage of database threads.
-        max_threadpool_size (int): Maximum size of each threadpool. ``None`` means auto.
+        max_threadpool_size (int): Maximum size of each thread pool. ``None`` means auto.
                                    Only relevant when `threaded` is ``True``.
-                                   There may be many pools, so number of actual threads can be a lot higher.
+                                   Each diff uses two pools of this size: one runs the segments, and one is
+                                   shared by the queries of all the segments, so at most this many queries run
+                                   at once. (Before, each segment queried in a pool of its own, so it ran up to
+                                   twice as many. Raise it to keep that concurrency)
         validate_unique_key (bool): Enable/disable validating that the key columns are unique. (default: True)
-                                    If there are no UNIQUE constraints in the schema, it is done in a single query,
-                                    and can't be threaded, so it's very slow on non-cloud dbs.
+                                    If there are no UNIQUE constraints in the schema, the keys are counted as part of
+                                    the query that collects the stats of each segment.
         sample_exclusive_rows (bool): Enable/disable sampling of exclusive rows. (default: False)
                                       Creates a temporary table.
         materialize_to_table (DbPath, optional): Path of new table to write diff results to. Disabled if not provided.
         materialize_all_rows (bool): Materialize every row, not just those that are different. (default: False)
         table_write_limit (int): Maximum number of rows to write when materializing, per thread.
+        temp_diff_table (bool): Write the differing rows of each segment into a temporary table, and derive the diff,
+                                the exclusive rows and the per-column counts from it, instead of running the outer join
+                                once for each of them. (default: False)
+        checksum_segments (bool): Count and checksum both tables in each segment first, as part of the query that
+                                  collects their stats, and run the outer join only for the segments that differ.
+                                  Faster for tables that are mostly the same. Like in hashdiff, the checksums are of
+                                  the normalized values. With materialize_all_rows, every segment is still joined.
+                                  (default: False)
     """
 
     validate_unique_key: bool = True
@@ -138,9 +159,13 @@ class JoinDiffer(TableDiffer):
     materialize_to_table: DbPath = None
     materialize_all_rows: bool = False
     table_write_limit: int = TABLE_WRITE_LIMIT
+    temp_diff_table: bool = False
+    checksum_segments: bool = False
 
     stats: dict = {}
 
+    _unvalidated_keys = None  # Key columns of each table that must be validated as unique, by table number
+
     def _diff_tables_root(self, table1: TableSegment, table2: TableSegment, info_tree: InfoTree) -> DiffResult:
         db = table1.database
 
@@ -149,19 +174,22 @@ class JoinDiffer(TableDiffer):
 
         table1, table2 = self._threaded_call("with_schema", [table1, table2])
 
-        bg_funcs = [partial(self._test_duplicate_keys, table1, table2)] if self.validate_unique_key else []
+        # The schema may have changed since the previous diff
+        db.clear_unique_columns_cache()
+        unvalidated = self._thread_map(self._unvalidated_key_columns, [table1, table2])
+        # Not a field, so it isn't copied by replace(). (setattr is blocked by frozen dataclass)
+        object.__setattr__(self, "_unvalidated_keys", dict(enumerate(unvalidated, 1)))
         if self.materialize_to_table:
             drop_table(db, self.materialize_to_table)
 
-        with self._run_in_background(*bg_funcs):
-            if isinstance(db, (Snowflake, BigQuery)):
-                # Don't segment the table; let the database handling parallelization
-                yield from self._diff_segments(None, table1, table2, info_tree, None)
-            else:
-                yield from self._bisect_and_diff_tables(table1, table2, info_tree)
-            logger.info("Diffing complete")
-            if self.materialize_to_table:
-                logger.info("Materialized diff to table '%s'.", ".".join(self.materialize_to_table))
+        if isinstance(db, (Snowflake, BigQuery)):
+            # Don't segment the table; let the database handling parallelization
+            yield from self._diff_segments(None, table1, table2, info_tree, None)
+        else:
+            yield from self._bisect_and_diff_tables(table1, table2, info_tree)
+        logger.info("Diffing complete")
+        if self.materialize_to_table:
+            logger.info("Materialized diff to table '%s'.", ".".join(self.materialize_to_table))
 
     def _diff_segments(
         self,
@@ -183,28 +211,55 @@ class JoinDiffer(TableDiffer):
                 f"size <= {max_rows}"
             )
 
+        if self.checksum_segments:
+            (count1, checksum1), (count2, checksum2) = self._thread_map(
+                lambda i_table: self._profile_table(*i_table, info_tree, checksum=True), [(1, table1), (2, table2)]
+            )
+            info_tree.info.checksums = {1: checksum1, 2: checksum2}
+            # Identical segments skip the join, unless all their rows must be materialized
+            skip_join = not (self.materialize_to_table and self.materialize_all_rows)
+            if skip_join and count1 == count2 and checksum1 == checksum2:
+                info_tree.info.set_diff([])
+                return
+            profile_funcs = []
+        else:
+            profile_funcs = [
+                partial(self._profile_table, 1, table1, info_tree),
+                partial(self._profile_table, 2, table2, info_tree),
+            ]
+
         db = table1.database
         diff_rows, a_cols, b_cols, is_diff_cols, all_rows = self._create_outer_join(table1, table2)
 
+        if self.temp_diff_table:
+            # Everything but the stats of each table, and materializing all the rows, is read from the temporary table
+            diff_stats_funcs = []
+            query_diff = partial(self._query_diff_via_temp_table, db, diff_rows, a_cols, b_cols, is_diff_cols)
+        else:
+            diff_stats_funcs = [
+                partial(self._sample_and_count_exclusive, db, diff_rows, a_cols, b_cols),
+                partial(self._count_diff_per_column, db, diff_rows, list(a_cols), is_diff_cols),
+            ]
+            query_diff = partial(db.query, diff_rows, list)
+
+        materialize_from_join = self.materialize_to_table and (self.materialize_all_rows or not self.temp_diff_table)
+
         with self._run_in_background(
-            partial(self._collect_stats, 1, table1, info_tree),
-            partial(self._collect_stats, 2, table2, info_tree),
-            partial(self._test_null_keys, table1, table2),
-            partial(self._sample_and_count_exclusive, db, diff_rows, a_cols, b_cols),
-            partial(self._count_diff_per_column, db, diff_rows, list(a_cols), is_diff_cols),
+            *profile_funcs,
+            *diff_stats_funcs,
             partial(
                 self._materialize_diff,
                 db,
                 all_rows if self.materialize_all_rows else diff_rows,
                 segment_index=segment_index,
             )
-            if self.materialize_to_table
+            if materialize_from_join
             else None,
         ):
 
             assert len(a_cols) == len(b_cols)
             logger.debug("Querying for different rows")
-            diff = db.query(diff_rows, list)
+            diff = query_diff()
             info_tree.info.set_diff(diff)
             for is_xa, is_xb, *x in diff:
                 if is_xa and is_xb:
@@ -220,66 +275,53 @@ class JoinDiffer(TableDiffer):
                 if not is_xa:
                     yield "+", tuple(b_row)
 
-    def _test_duplicate_keys(self, table1: TableSegment, table2: TableSegment):
-        logger.debug("Testing for duplicate keys")
+    def _unvalidated_key_columns(self, table_seg: TableSegment) -> List[str]:
+        "Returns the key columns that must be validated as unique, because the schema doesn't declare them unique"
+        if not self.validate_unique_key:
+            return []
 
-        # Test duplicate keys
-        for ts in [table1, table2]:
-            unique = (
-                ts.database.query_table_unique_columns(ts.table_path) if ts.database.SUPPORTS_UNIQUE_CONSTAINT else []
-            )
+        db = table_seg.database
+        constraints = db.query_table_unique_columns(table_seg.table_path) if db.SUPPORTS_UNIQUE_CONSTAINT else []
+        # The key is unique if it includes all the columns of a unique constraint
+        if any(set(columns) <= set(table_seg.key_columns) for columns in constraints):
+            return []
+
+        unvalidated = list(table_seg.key_columns)
+        logger.info(f"Validating that the are no duplicate keys in columns: {unvalidated}")
+        self.stats["validated_unique_keys"] = self.stats.get("validated_unique_keys", []) + [unvalidated]
+        return unvalidated
+
+    def _profile_table(self, i, table_seg: TableSegment, info_tree: InfoTree, checksum: bool = False):
+        """Collects the stats of the table, and tests its keys for nulls and duplicates, in a single query
+
+        Duplicates are counted exactly, because an estimate (like HyperLogLog) can't prove that keys are unique.
 
-            t = ts.make_select()
-            key_columns = ts.key_columns
-
-            unvalidated = list(set(key_columns) - set(unique))
-            if unvalidated:
-                logger.info(f"Validating that the are no duplicate keys in columns: {unvalidated}")
-                # Validate that there are no duplicate keys
-                self.stats["validated_unique_keys"] = self.stats.get("validated_unique_keys", []) + [unvalidated]
-                q = t.select(total=Count(), total_distinct=Count(Concat(this[unvalidated]), distinct=True))
-                total, total_distinct = ts.database.query(q, tuple)
-                if total != total_distinct:
-                    raise ValueError("Duplicate primary keys")
-
-    def _test_null_keys(self, table1, table2):
-        logger.debug("Testing for null keys")
-
-        # Test null keys
-        for ts in [table1, table2]:
-            t = ts.make_select()
-            key_columns = ts.key_columns
-
-            q = t.select(*this[key_columns]).where(or_(this[k] == None for k in key_columns))
-            nulls = ts.database.query(q, list)
-            if nulls:
-                raise ValueError("NULL values in one or more primary keys")
-
-    def _collect_stats(self, i, table_seg: TableSegment, info_tree: InfoTree):
-        logger.debug(f"Collecting stats for table #{i}")
+        Returns the count of rows, and their checksum if 'checksum' is true (see TableSegment.count_and_checksum)
+        """
+        logger.debug(f"Profiling table #{i}")
         db = table_seg.database
+        key_columns = table_seg.key_columns
 
         # Metrics
-        col_exprs = merge_dicts(
-            {
-                # f"min_{c}": min_(this[c]),
-                # f"max_{c}": max_(this[c]),
-            }
-            if c in table_seg.key_columns
-            else {
-                f"sum_{c}": sum_(this[c]),
-                # f"avg_{c}": avg(this[c]),
-                # f"min_{c}": min_(this[c]),
-                # f"max_{c}": max_(this[c]),
-            }
+        col_exprs = {
+            f"sum_{c}": sum_(this[c])
             for c in table_seg.relevant_columns
-            if isinstance(table_seg._schema[c], NumericType)
-        )
+            if c not in key_columns and isinstance(table_seg._schema[c], NumericType)
+        }
         col_exprs["count"] = Count()
 
-        res = db.query(table_seg.make_select().select(**col_exprs), tuple)
+        # Key tests
+        test_exprs = {"null_keys": sum_(bool_to_int(or_(this[k] == None for k in key_columns)))}
+        unvalidated = self._unvalidated_keys[i]
+        if unvalidated:
+            test_exprs["distinct_keys"] = Count(Concat(this[unvalidated]), distinct=True)
+        if checksum:
+            test_exprs["checksum"] = Checksum(table_seg._relevant_columns_hash_repr, table_seg.native_hash)
 
-        for col_name, value in safezip(col_exprs, res):
+        res = db.query(table_seg.make_select().select(**col_exprs, **test_exprs), tuple)
+        stats_res, test_res = _slice_tuple(res, len(col_exprs), len(test_exprs))
+
+        for col_name, value in safezip(col_exprs, stats_res):
             if value is not None:
                 value = json_friendly_value(value)
                 stat_name = f"table{i}_{col_name}"
@@ -292,7 +334,15 @@ class JoinDiffer(TableDiffer):
                 else:
                     self.stats[stat_name] = value
 
-        logger.debug("Done collecting stats for table #%s", i)
+        test_res = dict(safezip(test_exprs, test_res))
+        count = stats_res[-1]
+        if test_res["null_keys"]:
+            raise ValueError("NULL values in one or more primary keys")
+        if "distinct_keys" in test_res and test_res["distinct_keys"] != count:
+            raise ValueError("Duplicate primary keys")
+
+        logger.debug("Done profiling table #%s", i)
+        return count, int(test_res["checksum"]) if count and checksum else None
 
     def _create_outer_join(self, table1, table2):
         db = table1.database
@@ -326,16 +376,16 @@ class JoinDiffer(TableDiffer):
     def _count_diff_per_column(self, db, diff_rows, cols, is_diff_cols):
         logger.debug("Counting differences per column")
         is_diff_cols_counts = db.query(diff_rows.select(sum_(this[c]) for c in is_diff_cols), tuple)
+        self._set_diff_counts(cols, is_diff_cols_counts)
+
+    def _set_diff_counts(self, cols, is_diff_cols_counts):
         diff_counts = {}
         for name, count in safezip(cols, is_diff_cols_counts):
             diff_counts[name] = diff_counts.get(name, 0) + (count or 0)
         self.stats["diff_counts"] = diff_counts
 
     def _sample_and_count_exclusive(self, db, diff_rows, a_cols, b_cols):
-        if isinstance(db, Oracle):
-            exclusive_rows_query = diff_rows.where((this.is_exclusive_a == 1) | (this.is_exclusive_b == 1))
-        else:
-            exclusive_rows_query = diff_rows.where(this.is_exclusive_a | this.is_exclusive_b)
+        exclusive_rows_query = diff_rows.where(_is_exclusive(db))
 
         if not self.sample_exclusive_rows:
             logger.debug("Counting exclusive rows")
@@ -361,6 +411,38 @@ class JoinDiffer(TableDiffer):
         # Run as a sequence of thread-local queries (compiled into a ThreadLocalInterpreter)
         db.query(exclusive_rows(exclusive_rows_query), None)
 
+    def _query_diff_via_temp_table(self, db, diff_rows, a_cols, b_cols, is_diff_cols) -> list:
+        "Runs the outer join once into a temporary table, and queries the diff and its stats from it"
+        diff = []
+
+        def queries():
+            c = Compiler(db)
+            diff_table = table(c.new_unique_table_name("temp_table"), schema=diff_rows.schema)
+            yield Code(create_temp_table(c, diff_table, diff_rows))
+
+            diff.extend((yield diff_table.select()))
+
+            logger.debug("Counting differences per column")
+            is_diff_cols_counts = yield diff_table.select(sum_(this[c]) for c in is_diff_cols)
+            self._set_diff_counts(list(a_cols), is_diff_cols_counts[0])
+
+            exclusive_rows = diff_table.where(_is_exclusive(db))
+            count = yield exclusive_rows.count()
+            self.stats["exclusive_count"] = self.stats.get("exclusive_count", 0) + count[0][0]
+            if self.sample_exclusive_rows:
+                sample_rows = yield sample(exclusive_rows.select(*this[list(a_cols)], *this[list(b_cols)]))
+                self.stats["exclusive_sample"] = self.stats.get("exclusive_sample", []) + sample_rows
+
+            if self.materialize_to_table and not self.materialize_all_rows:
+                yield from append_to_table_queries(db, self.materialize_to_table, diff_table.limit(self.table_write_limit))
+
+            # Only drops if create table succeeded (meaning, the table didn't already exist)
+            yield diff_table.drop()
+
+        # Run as a sequence of thread-local queries, because temporary tables only exist in their own session
+        db.query(queries(), None)
+        return diff
+
     def _materialize_diff(self, db, diff_rows, segment_index=None):
         assert self.materialize_to_table
 
@@ -49,6 +49,11 @@ def _append_to_table(path: DbPath, expr: Expr):
     yield commit
 
 
-def append_to_table(db, path, expr):
+def append_to_table_queries(db, path, expr):
+    "Returns the queries of append_to_table(), for running them as part of another sequence of thread-local queries"
     f = _append_to_table_oracle if isinstance(db, Oracle) else _append_to_table
-    db.query(f(path, expr))
+    return f(path, expr)
+
+
+def append_to_table(db, path, expr):
+    db.query(append_to_table_queries(db, path, expr))
@@ -6,6 +6,7 @@ from .database_types import (
     DbTime,
     IKey,
     ColType_UUID,
+    Integer,
     NumericType,
     PrecisionType,
     StringType,
@@ -244,11 +244,11 @@ class AbstractDatabase:
 
     @abstractmethod
     def select_table_unique_columns(self, path: DbPath) -> str:
-        "Provide SQL for selecting the names of unique columns in the table"
+        "Provide SQL for selecting the unique constraints of the table, as rows of (constraint, column)"
 
     @abstractmethod
-    def query_table_unique_columns(self, path: DbPath) -> List[str]:
-        """Query the table for its unique columns for table in 'path', and return {column}"""
+    def query_table_unique_columns(self, path: DbPath) -> List[List[str]]:
+        """Query the table for its unique constraints for table in 'path', and return [[column]]"""
 
     @abstractmethod
     def _process_table_schema(
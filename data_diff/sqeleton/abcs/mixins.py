@@ -79,6 +79,14 @@ class AbstractMixin_MD5(ABC):
     def md5_as_int(self, s: str) -> str:
         "Provide SQL for computing md5 and returning an int"
 
+    def native_hash_as_int(self, s: str) -> str:
+        """Provide SQL for computing the database's own fast hash function, and returning an int
+
+        The result must have the same range as md5_as_int(), but may differ between databases,
+        and between versions of the same database. Raises NotImplementedError when there isn't one.
+        """
+        raise NotImplementedError()
+
 
 class AbstractMixin_Schema(ABC):
     """Methods for querying the database schema
@@ -2,9 +2,10 @@ from datetime import datetime
 import math
 import sys
 import logging
-from typing import Any, Callable, Dict, Generator, Tuple, Optional, Sequence, Type, List, Union
+from typing import Any, Callable, Dict, Generator, Iterator, Tuple, Optional, Sequence, Type, List, Union
 from functools import partial, wraps
 from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, SimpleQueue
 import threading
 from abc import abstractmethod
 from uuid import UUID
@@ -35,6 +36,9 @@ from ..abcs.mixins import AbstractMixin_Schema
 
 logger = logging.getLogger("database")
 
+DEFAULT_FETCH_BATCH_SIZE = 1024 * 8
+HISTOGRAM_BUCKET_COUNT = 100
+
 
 def parse_table_name(t):
     return tuple(t.split("."))
@@ -65,6 +69,11 @@ class QueryError(Exception):
     pass
 
 
+def histogram_quantiles(count: int = HISTOGRAM_BUCKET_COUNT) -> List[float]:
+    "Returns the quantiles that split a distribution into 'count' buckets (not including 0 and 1)"
+    return [i / count for i in range(1, count)]
+
+
 def _one(seq):
     (x,) = seq
     return x
@@ -238,6 +247,14 @@ class BaseDialect(AbstractDialect):
         return math.floor(math.log(2**p, 10))
 
 
+def _group_columns_by_constraint(rows: Sequence[tuple]) -> List[List[str]]:
+    "Groups rows of (constraint, column) into a list of columns for each constraint"
+    constraints = {}
+    for constraint, column in rows:
+        constraints.setdefault(constraint, []).append(column)
+    return list(constraints.values())
+
+
 class Database(AbstractDatabase):
     """Base abstract class for databases.
 
@@ -249,11 +266,14 @@ class Database(AbstractDatabase):
     default_schema: str = None
     SUPPORTS_ALPHANUMS = True
     SUPPORTS_UNIQUE_CONSTAINT = False
+    SUPPORTS_ARROW = False  # See query_arrow()
 
     CONNECT_URI_KWPARAMS = []
 
     _interactive = False
     is_closed = False
+    _unique_columns_cache = None  # See query_table_unique_columns()
+    connection_info: Dict[str, Any] = {}  # Where the data is (host, database, ...), without credentials. See connect()
 
     @property
     def name(self):
@@ -324,6 +344,43 @@ class Database(AbstractDatabase):
                 raise ValueError(res_type)
         return res
 
+    def configure_session(self, sql_code: str):
+        """Run a statement that configures the session, such as setting its time zone
+
+        Unlike query(), it also applies to connections that are opened later, e.g. for streaming.
+        """
+        self.query(sql_code)
+
+    def query_iter(self, sql_ast: Expr, batch_size: int = DEFAULT_FETCH_BATCH_SIZE) -> Iterator[tuple]:
+        """Query the given SQL AST, and lazily iterate over the resulting rows
+
+        Rows are fetched in batches of 'batch_size', using a server-side cursor where the driver supports it,
+        so memory use is bounded by the batch size, rather than by the size of the result.
+        The query is only executed once the iteration starts.
+        """
+        sql_code = sql_ast if isinstance(sql_ast, str) else Compiler(self).compile(sql_ast)
+        logger.debug("Running SQL (%s-iter): %s", self.name, sql_code)
+        return self._query_iter(sql_code, batch_size)
+
+    def _query_iter(self, sql_code: str, batch_size: int) -> Iterator[tuple]:
+        "Fallback for databases without support for streaming. Fetches the entire result."
+        return iter(self._query(sql_code))
+
+    def query_arrow(self, sql_ast: Expr):
+        """Query the given SQL AST, and return the result as an Arrow table (requires pyarrow)
+
+        The result is fetched in the driver's columnar format, without creating a Python object for each value.
+        Only available if SUPPORTS_ARROW is true.
+        """
+        if not self.SUPPORTS_ARROW:
+            raise NotImplementedError(f"{self.name} can't return results as Arrow")
+        sql_code = sql_ast if isinstance(sql_ast, str) else Compiler(self).compile(sql_ast)
+        logger.debug("Running SQL (%s-arrow): %s", self.name, sql_code)
+        return self._query_arrow(sql_code)
+
+    def _query_arrow(self, sql_code: str):
+        raise NotImplementedError()
+
     def enable_interactive(self):
         self._interactive = True
 
@@ -349,17 +406,50 @@ class Database(AbstractDatabase):
     def select_table_unique_columns(self, path: DbPath) -> str:
         schema, name = self._normalize_table_path(path)
 
+        # Only primary keys and unique constraints (key_column_usage also lists foreign keys)
         return (
-            "SELECT column_name "
-            "FROM information_schema.key_column_usage "
-            f"WHERE table_name = '{name}' AND table_schema = '{schema}'"
+            "SELECT kcu.constraint_name, kcu.column_name "
+            "FROM information_schema.key_column_usage kcu "
+            "JOIN information_schema.table_constraints tc "
+            "ON tc.constraint_name = kcu.constraint_name AND tc.table_schema = kcu.table_schema "
+            "AND tc.table_name = kcu.table_name "
+            f"WHERE kcu.table_name = '{name}' AND kcu.table_schema = '{schema}' "
+            "AND tc.constraint_type IN ('PRIMARY KEY', 'UNIQUE')"
         )
 
-    def query_table_unique_columns(self, path: DbPath) -> List[str]:
+    def query_table_unique_columns(self, path: DbPath) -> List[List[str]]:
+        """Query the table for its unique constraints for table in 'path', and return [[column]]
+
+        Returns the columns of each constraint (including the primary key) separately,
+        because a set of columns is only unique if it includes all the columns of one of them.
+
+        The result is cached until clear_unique_columns_cache() is called.
+        """
         if not self.SUPPORTS_UNIQUE_CONSTAINT:
             raise NotImplementedError("This database doesn't support 'unique' constraints")
-        res = self.query(self.select_table_unique_columns(path), List[str])
-        return list(res)
+
+        if self._unique_columns_cache is None:
+            self._unique_columns_cache = {}
+        key = tuple(path)
+        if key not in self._unique_columns_cache:
+            self._unique_columns_cache[key] = self._query_table_unique_columns(path)
+        return list(self._unique_columns_cache[key])
+
+    def clear_unique_columns_cache(self):
+        "Forget the unique constraints cached by query_table_unique_columns(), in case the schema has changed"
+        self._unique_columns_cache = None
+
+    def _query_table_unique_columns(self, path: DbPath) -> List[List[str]]:
+        res = self.query(self.select_table_unique_columns(path), List[Tuple])
+        return _group_columns_by_constraint(res)
+
+    def query_column_histogram(self, path: DbPath, column: str) -> Optional[list]:
+        """Query the distribution of the values of a column, as estimated by the database.
+
+        Returns a sorted list of values that split the column into buckets of roughly equal row counts,
+        or None if the database doesn't provide an estimate.
+        """
+        return None
 
     def _process_table_schema(
         self, path: DbPath, raw_schema: Dict[str, tuple], filter_columns: Sequence[str], where: str = None
@@ -412,7 +502,7 @@ class Database(AbstractDatabase):
                 if alphanum_samples:
                     if len(alphanum_samples) != len(samples):
                         logger.warning(
-                            f"Mixed Alphanum/Non-Alphanum values detected in column {'.'.join(table_path)}.{col_name}. It cannot be used as a key."
+                            f"Mixed Alphanum/Non-Alphanum values detected in column {'.'.join(table_path)}.{col_name}. It can only be used as a key by hashdiff's hash partitioning."
                         )
                     else:
                         assert col_name in col_dict
@@ -449,6 +539,21 @@ class Database(AbstractDatabase):
         callback = partial(self._query_cursor, c)
         return apply_query(callback, sql_code)
 
+    def _stream_cursor(self, conn):
+        "Return a cursor that fetches results from the server lazily, if the driver supports it."
+        return conn.cursor()
+
+    def _query_cursor_iter(self, c, sql_code: str, batch_size: int) -> Iterator[tuple]:
+        try:
+            c.execute(sql_code)
+            while True:
+                rows = c.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from map(tuple, rows)
+        finally:
+            c.close()
+
     def close(self):
         self.is_closed = True
         return super().close()
@@ -463,6 +568,9 @@ class ThreadedDatabase(Database):
     def __init__(self, thread_count=1):
         self._init_error = None
         self._queue = ThreadPoolExecutor(thread_count, initializer=self.set_conn)
+        self._stream_conns = SimpleQueue()
+        self._stream_slots = threading.BoundedSemaphore(thread_count)
+        self._session_setup = []
         self.thread_local = threading.local()
         logger.info(f"[{self.name}] Starting a threadpool, size={thread_count}.")
 
@@ -473,6 +581,10 @@ class ThreadedDatabase(Database):
         except ModuleNotFoundError as e:
             self._init_error = e
 
+    def configure_session(self, sql_code: str):
+        self._session_setup.append(sql_code)
+        super().configure_session(sql_code)
+
     def _query(self, sql_code: Union[str, ThreadLocalInterpreter]):
         r = self._queue.submit(self._query_in_worker, sql_code)
         return r.result()
@@ -483,6 +595,60 @@ class ThreadedDatabase(Database):
             raise self._init_error
         return self._query_conn(self.thread_local.conn, sql_code)
 
+    def _create_stream_conn(self):
+        if self._init_error:
+            raise self._init_error
+        try:
+            conn = self.create_connection()
+        except ConnectError:
+            raise
+        except Exception as e:
+            raise ConnectError(*e.args) from e
+
+        # Same session as the worker connections. Committed, so it outlives the rollback at the end of each stream.
+        for sql_code in self._session_setup:
+            self._query_conn(conn, sql_code)
+        conn.commit()
+        return conn
+
+    def _release_stream_conn(self, conn):
+        # End the transaction that the stream ran in. Otherwise the idle connection would keep holding its locks,
+        # and its snapshot (e.g. MySQL's REPEATABLE READ), until the next stream.
+        try:
+            conn.rollback()
+        except Exception:
+            conn.close()
+        else:
+            self._stream_conns.put(conn)
+
+    def _query_iter(self, sql_code: str, batch_size: int) -> Iterator[tuple]:
+        # Each stream holds a connection of its own until it's exhausted, instead of a worker thread.
+        # Otherwise, consuming two streams at once (e.g. in a merge-join) could deadlock the threadpool.
+        # Up to 'thread_count' streams are open at once. Beyond that, the result is fetched whole by a worker,
+        # because waiting for a connection could deadlock a consumer that already holds a stream.
+        if not self._stream_slots.acquire(blocking=False):
+            yield from map(tuple, self._query(sql_code))
+            return
+
+        try:
+            try:
+                conn = self._stream_conns.get_nowait()
+            except Empty:
+                conn = self._create_stream_conn()
+
+            completed = False
+            try:
+                yield from self._query_cursor_iter(self._stream_cursor(conn), sql_code, batch_size)
+                completed = True
+            finally:
+                if completed:
+                    self._release_stream_conn(conn)
+                else:
+                    # The stream was abandoned midway, and the connection may still have unread results
+                    conn.close()
+        finally:
+            self._stream_slots.release()
+
     @abstractmethod
     def create_connection(self):
         "Return a connection instance, that supports the .cursor() method."
@@ -490,6 +656,8 @@ class ThreadedDatabase(Database):
     def close(self):
         super().close()
         self._queue.shutdown()
+        while not self._stream_conns.empty():
+            self._stream_conns.get().close()
 
     @property
     def is_autocommit(self) -> bool:
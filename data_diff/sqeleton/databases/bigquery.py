@@ -1,4 +1,4 @@
-from typing import List, Union
+from typing import List, Optional, Union
 from ..abcs.database_types import (
     Timestamp,
     Datetime,
@@ -13,9 +13,9 @@ from ..abcs.database_types import (
 )
 from ..abcs.mixins import AbstractMixin_MD5, AbstractMixin_NormalizeValue, AbstractMixin_Schema
 from ..abcs import Compilable
-from ..queries import this, table, SKIP
+from ..queries import this, table, Code, SKIP
 from .base import BaseDialect, Database, import_helper, parse_table_name, ConnectError, apply_query
-from .base import TIMESTAMP_PRECISION_POS, ThreadLocalInterpreter
+from .base import TIMESTAMP_PRECISION_POS, HISTOGRAM_BUCKET_COUNT, CHECKSUM_MASK, ThreadLocalInterpreter
 
 
 @import_helper(text="Please install BigQuery and configure your google-cloud access.")
@@ -29,6 +29,9 @@ class Mixin_MD5(AbstractMixin_MD5):
     def md5_as_int(self, s: str) -> str:
         return f"cast(cast( ('0x' || substr(TO_HEX(md5({s})), 18)) as int64) as numeric)"
 
+    def native_hash_as_int(self, s: str) -> str:
+        return f"cast(FARM_FINGERPRINT({s}) & {CHECKSUM_MASK} as numeric)"
+
 
 class Mixin_NormalizeValue(AbstractMixin_NormalizeValue):
     def normalize_timestamp(self, value: str, coltype: TemporalType) -> str:
@@ -109,6 +112,7 @@ class BigQuery(Database):
     CONNECT_URI_HELP = "bigquery://<project>/<dataset>"
     CONNECT_URI_PARAMS = ["dataset"]
     dialect = Dialect()
+    SUPPORTS_ARROW = True
 
     def __init__(self, project, *, dataset, **kw):
         bigquery = import_bigquery()
@@ -140,6 +144,23 @@ class BigQuery(Database):
     def _query(self, sql_code: Union[str, ThreadLocalInterpreter]):
         return apply_query(self._query_atom, sql_code)
 
+    def _query_iter(self, sql_code: str, batch_size: int):
+        try:
+            rows = self._client.query(sql_code).result(page_size=batch_size)
+        except Exception as e:
+            msg = "Exception when trying to execute SQL code:\n    %s\n\nGot error: %s"
+            raise ConnectError(msg % (sql_code, e))
+
+        for row in rows:
+            yield tuple(self._normalize_returned_value(v) for v in row.values())
+
+    def _query_arrow(self, sql_code: str):
+        try:
+            return self._client.query(sql_code).to_arrow()
+        except Exception as e:
+            msg = "Exception when trying to execute SQL code:\n    %s\n\nGot error: %s"
+            raise ConnectError(msg % (sql_code, e))
+
     def close(self):
         super().close()
         self._client.close()
@@ -153,9 +174,15 @@ class BigQuery(Database):
             f"WHERE table_name = '{name}' AND table_schema = '{schema}'"
         )
 
-    def query_table_unique_columns(self, path: DbPath) -> List[str]:
+    def query_table_unique_columns(self, path: DbPath) -> List[List[str]]:
+        # BigQuery doesn't enforce primary keys or unique constraints, so they can't be trusted
         return []
 
+    def query_column_histogram(self, path: DbPath, column: str) -> Optional[list]:
+        q = table(*path).select(Code(f"APPROX_QUANTILES({self.dialect.quote(column)}, {HISTOGRAM_BUCKET_COUNT})"))
+        (bounds,) = self.query(q, tuple)
+        return bounds[1:-1]  # Without min and max
+
     def parse_table_name(self, name: str) -> DbPath:
         path = parse_table_name(name)
         return tuple(i for i in self._normalize_table_path(path) if i is not None)
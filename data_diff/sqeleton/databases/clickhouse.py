@@ -3,11 +3,13 @@ from typing import Optional, Type
 from .base import (
     MD5_HEXDIGITS,
     CHECKSUM_HEXDIGITS,
+    CHECKSUM_MASK,
     TIMESTAMP_PRECISION_POS,
     BaseDialect,
     ThreadedDatabase,
     import_helper,
     ConnectError,
+    DEFAULT_FETCH_BATCH_SIZE,
 )
 from ..abcs.database_types import (
     ColType,
@@ -38,6 +40,9 @@ class Mixin_MD5(AbstractMixin_MD5):
         substr_idx = 1 + MD5_HEXDIGITS - CHECKSUM_HEXDIGITS
         return f"reinterpretAsUInt128(reverse(unhex(lowerUTF8(substr(hex(MD5({s})), {substr_idx})))))"
 
+    def native_hash_as_int(self, s: str) -> str:
+        return f"toUInt128(bitAnd(cityHash64({s}), {CHECKSUM_MASK}))"
+
 
 class Mixin_NormalizeValue(AbstractMixin_NormalizeValue):
     def normalize_number(self, value: str, coltype: FractionalType) -> str:
@@ -187,6 +192,11 @@ class Clickhouse(ThreadedDatabase):
         except clickhouse.OperationError as e:
             raise ConnectError(*e.args) from e
 
+    def _stream_cursor(self, conn):
+        c = conn.cursor()
+        c.set_stream_results(True, DEFAULT_FETCH_BATCH_SIZE)
+        return c
+
     @property
     def is_autocommit(self) -> bool:
         return True
@@ -21,6 +21,26 @@ from .vertica import Vertica
 from .duckdb import DuckDB
 
 
+# The connection arguments that locate the data, as opposed to credentials and settings
+CONNECTION_INFO_ARGS = (
+    "host",
+    "port",
+    "account",
+    "project",
+    "server_hostname",
+    "http_path",
+    "catalog",
+    "database",
+    "dbname",
+    "schema",
+    "filepath",
+)
+
+
+def _connection_info(kw: dict) -> dict:
+    return {k: kw[k] for k in CONNECTION_INFO_ARGS if kw.get(k) is not None}
+
+
 @dataclass
 class MatchUriPath:
     database_cls: Type[Database]
@@ -150,7 +170,9 @@ class Connect:
 
             if scheme == "bigquery":
                 kw["project"] = dsn.host
-                return cls(**kw)
+                db = cls(**kw)
+                db.connection_info = _connection_info(kw)
+                return db
 
             if scheme == "snowflake":
                 kw["account"] = dsn.host
@@ -170,6 +192,7 @@ class Connect:
             db = cls(thread_count=thread_count, **kw)
         else:
             db = cls(**kw)
+        db.connection_info = _connection_info(kw)
 
         return self._connection_created(db)
 
@@ -186,6 +209,7 @@ class Connect:
             db = cls(thread_count=thread_count, **d)
         else:
             db = cls(**d)
+        db.connection_info = _connection_info(d)
 
         return self._connection_created(db)
 
@@ -16,7 +16,15 @@ from ..abcs.database_types import (
     Boolean,
 )
 from ..abcs.mixins import AbstractMixin_MD5, AbstractMixin_NormalizeValue
-from .base import MD5_HEXDIGITS, CHECKSUM_HEXDIGITS, BaseDialect, ThreadedDatabase, import_helper, parse_table_name
+from .base import (
+    MD5_HEXDIGITS,
+    CHECKSUM_HEXDIGITS,
+    CHECKSUM_MASK,
+    BaseDialect,
+    ThreadedDatabase,
+    import_helper,
+    parse_table_name,
+)
 
 
 @import_helper(text="You can install it using 'pip install databricks-sql-connector'")
@@ -30,6 +38,9 @@ class Mixin_MD5(AbstractMixin_MD5):
     def md5_as_int(self, s: str) -> str:
         return f"cast(conv(substr(md5({s}), {1+MD5_HEXDIGITS-CHECKSUM_HEXDIGITS}), 16, 10) as decimal(38, 0))"
 
+    def native_hash_as_int(self, s: str) -> str:
+        return f"cast(xxhash64({s}) & {CHECKSUM_MASK} as decimal(38, 0))"
+
 
 class Mixin_NormalizeValue(AbstractMixin_NormalizeValue):
     def normalize_timestamp(self, value: str, coltype: TemporalType) -> str:
@@ -90,6 +101,7 @@ class Databricks(ThreadedDatabase):
     dialect = Dialect()
     CONNECT_URI_HELP = "databricks://:<access_token>@<server_name>/<http_path>"
     CONNECT_URI_PARAMS = ["catalog", "schema"]
+    SUPPORTS_ARROW = True
 
     def __init__(self, *, thread_count, **kw):
         logging.getLogger("databricks.sql").setLevel(logging.WARNING)
@@ -112,6 +124,17 @@ class Databricks(ThreadedDatabase):
         except databricks.sql.exc.Error as e:
             raise ConnectionError(*e.args) from e
 
+    def _query_arrow(self, sql_code: str):
+        return self._queue.submit(self._query_arrow_in_worker, sql_code).result()
+
+    def _query_arrow_in_worker(self, sql_code: str):
+        "This method runs in a worker thread"
+        if self._init_error:
+            raise self._init_error
+        with self.thread_local.conn.cursor() as cursor:
+            cursor.execute(sql_code)
+            return cursor.fetchall_arrow()
+
     def query_table_schema(self, path: DbPath) -> Dict[str, tuple]:
         # Databricks has INFORMATION_SCHEMA only for Databricks Runtime, not for Databricks SQL.
         # https://docs.databricks.com/spark/latest/spark-sql/language-manual/information-schema/columns.html
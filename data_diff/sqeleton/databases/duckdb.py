@@ -1,4 +1,4 @@
-from typing import Union
+from typing import Optional, Union
 
 from ..utils import match_regexps
 from ..abcs.database_types import (
@@ -23,8 +23,10 @@ from .base import (
     ConnectError,
     ThreadLocalInterpreter,
     TIMESTAMP_PRECISION_POS,
+    histogram_quantiles,
 )
-from .base import MD5_HEXDIGITS, CHECKSUM_HEXDIGITS, Mixin_Schema
+from .base import MD5_HEXDIGITS, CHECKSUM_HEXDIGITS, CHECKSUM_MASK, Mixin_Schema
+from ..queries import table, Code
 
 
 @import_helper("duckdb")
@@ -38,6 +40,9 @@ class Mixin_MD5(AbstractMixin_MD5):
     def md5_as_int(self, s: str) -> str:
         return f"('0x' || SUBSTRING(md5({s}), {1+MD5_HEXDIGITS-CHECKSUM_HEXDIGITS},{CHECKSUM_HEXDIGITS}))::BIGINT"
 
+    def native_hash_as_int(self, s: str) -> str:
+        return f"(hash({s}) & {CHECKSUM_MASK}::UBIGINT)::BIGINT"
+
 
 class Mixin_NormalizeValue(AbstractMixin_NormalizeValue):
     def normalize_timestamp(self, value: str, coltype: TemporalType) -> str:
@@ -117,8 +122,9 @@ class Dialect(BaseDialect, Mixin_Schema):
 
 class DuckDB(Database):
     dialect = Dialect()
-    SUPPORTS_UNIQUE_CONSTAINT = False  # Temporary, until we implement it
+    SUPPORTS_UNIQUE_CONSTAINT = True
     default_schema = "main"
+    SUPPORTS_ARROW = True
     CONNECT_URI_HELP = "duckdb://<database>@<dbpath>"
     CONNECT_URI_PARAMS = ["database", "dbpath"]
 
@@ -134,6 +140,33 @@ class DuckDB(Database):
         "Uses the standard SQL cursor interface"
         return self._query_conn(self._conn, sql_code)
 
+    def _query_iter(self, sql_code: str, batch_size: int):
+        return self._query_cursor_iter(self._conn.cursor(), sql_code, batch_size)
+
+    def _query_arrow(self, sql_code: str):
+        c = self._conn.cursor()
+        try:
+            c.execute(sql_code)
+            fetch = getattr(c, "to_arrow_table", None) or c.fetch_arrow_table  # Renamed in newer versions
+            return fetch()
+        finally:
+            c.close()
+
+    def select_table_unique_columns(self, path: DbPath) -> str:
+        schema, name = self._normalize_table_path(path)
+
+        return (
+            "SELECT constraint_index, unnest(constraint_column_names) FROM duckdb_constraints() "
+            f"WHERE table_name = '{name}' AND schema_name = '{schema}' "
+            "AND constraint_type IN ('PRIMARY KEY', 'UNIQUE')"
+        )
+
+    def query_column_histogram(self, path: DbPath, column: str) -> Optional[list]:
+        quantiles = ", ".join(map(str, histogram_quantiles()))
+        q = table(*path).select(Code(f"approx_quantile({self.dialect.quote(column)}, [{quantiles}])"))
+        (bounds,) = self.query(q, tuple)
+        return bounds
+
     def close(self):
         super().close()
         self._conn.close()
@@ -1,4 +1,8 @@
+import json
+from typing import List, Optional
+
 from ..abcs.database_types import (
+    DbPath,
     Datetime,
     Timestamp,
     Float,
@@ -16,6 +20,7 @@ from .base import (
     import_helper,
     ConnectError,
     BaseDialect,
+    histogram_quantiles,
 )
 from .base import MD5_HEXDIGITS, CHECKSUM_HEXDIGITS, TIMESTAMP_PRECISION_POS, Mixin_Schema
 
@@ -126,3 +131,29 @@ class MySQL(ThreadedDatabase):
             elif e.errno == mysql.errorcode.ER_BAD_DB_ERROR:
                 raise ConnectError("Database does not exist") from e
             raise ConnectError(*e.args) from e
+
+    def query_column_histogram(self, path: DbPath, column: str) -> Optional[list]:
+        # Collected by ANALYZE TABLE ... UPDATE HISTOGRAM (MySQL 8.0+)
+        schema, name = self._normalize_table_path(path)
+        res = self.query(
+            "SELECT histogram FROM information_schema.column_statistics "
+            f"WHERE schema_name = '{schema}' AND table_name = '{name}' AND column_name = '{column}'",
+            List[str],
+        )
+        if not res:
+            return None
+
+        # Buckets are [value, cumulative_frequency] (singleton), or [lower, upper, cumulative_frequency, ndv]
+        buckets = json.loads(res[0])["buckets"]
+        upper_bounds = [(b[0], b[1]) if len(b) == 2 else (b[1], b[2]) for b in buckets]
+
+        bounds = []
+        for q in histogram_quantiles():
+            value = next((v for v, freq in upper_bounds if freq >= q), None)
+            if value is not None and value not in bounds:
+                bounds.append(value)
+        return bounds
+
+    def _stream_cursor(self, conn):
+        # Unbuffered cursors read rows from the server as they are fetched
+        return conn.cursor(buffered=False)
@@ -159,6 +159,7 @@ class Dialect(BaseDialect, Mixin_Schema):
 
 class Oracle(ThreadedDatabase):
     dialect = Dialect()
+    SUPPORTS_UNIQUE_CONSTAINT = True
     CONNECT_URI_HELP = "oracle://<user>:<pass>@<host>/<database>"
     CONNECT_URI_PARAMS = ["database?"]
 
@@ -192,3 +193,14 @@ class Oracle(ThreadedDatabase):
             f"SELECT column_name, data_type, 6 as datetime_precision, data_precision as numeric_precision, data_scale as numeric_scale"
             f" FROM ALL_TAB_COLUMNS WHERE table_name = '{name}' AND owner = '{schema}'"
         )
+
+    def select_table_unique_columns(self, path: DbPath) -> str:
+        schema, name = self._normalize_table_path(path)
+
+        # Only constraints that are enforced, and hold for the existing rows
+        return (
+            "SELECT cc.constraint_name, cc.column_name FROM ALL_CONS_COLUMNS cc "
+            "JOIN ALL_CONSTRAINTS c ON c.owner = cc.owner AND c.constraint_name = cc.constraint_name "
+            f"WHERE c.table_name = '{name}' AND c.owner = '{schema}' AND c.constraint_type IN ('P', 'U') "
+            "AND c.status = 'ENABLED' AND c.validated = 'VALIDATED'"
+        )
@@ -1,4 +1,7 @@
+from typing import List, Optional
+
 from ..abcs.database_types import (
+    DbPath,
     Timestamp,
     TimestampTZ,
     Float,
@@ -12,7 +15,7 @@ from ..abcs.database_types import (
 )
 from ..abcs.mixins import AbstractMixin_MD5, AbstractMixin_NormalizeValue
 from .base import BaseDialect, ThreadedDatabase, import_helper, ConnectError, Mixin_Schema
-from .base import MD5_HEXDIGITS, CHECKSUM_HEXDIGITS, _CHECKSUM_BITSIZE, TIMESTAMP_PRECISION_POS
+from .base import MD5_HEXDIGITS, CHECKSUM_HEXDIGITS, _CHECKSUM_BITSIZE, CHECKSUM_MASK, TIMESTAMP_PRECISION_POS
 
 SESSION_TIME_ZONE = None  # Changed by the tests
 
@@ -30,6 +33,9 @@ class Mixin_MD5(AbstractMixin_MD5):
     def md5_as_int(self, s: str) -> str:
         return f"('x' || substring(md5({s}), {1+MD5_HEXDIGITS-CHECKSUM_HEXDIGITS}))::bit({_CHECKSUM_BITSIZE})::bigint"
 
+    def native_hash_as_int(self, s: str) -> str:
+        return f"(hashtextextended({s}, 0) & {CHECKSUM_MASK})"
+
 
 class Mixin_NormalizeValue(AbstractMixin_NormalizeValue):
     def normalize_timestamp(self, value: str, coltype: TemporalType) -> str:
@@ -119,3 +125,33 @@ class PostgreSQL(ThreadedDatabase):
             return c
         except pg.OperationalError as e:
             raise ConnectError(*e.args) from e
+
+    def select_table_unique_columns(self, path: DbPath) -> str:
+        schema, name = self._normalize_table_path(path)
+
+        # Unique indexes, which include the primary key and the unique constraints.
+        # Partial indexes don't count, and neither do expression indexes, whose expressions have no attribute.
+        return (
+            "SELECT i.indexrelid, a.attname FROM pg_catalog.pg_index i "
+            "JOIN pg_catalog.pg_class c ON c.oid = i.indrelid "
+            "JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace "
+            "JOIN pg_catalog.pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) "
+            f"WHERE c.relname = '{name}' AND n.nspname = '{schema}' "
+            "AND i.indisunique AND i.indisvalid AND i.indpredicate IS NULL AND i.indexprs IS NULL"
+        )
+
+    def query_column_histogram(self, path: DbPath, column: str) -> Optional[list]:
+        # Collected by ANALYZE. Each bucket holds about the same number of rows
+        schema, name = self._normalize_table_path(path)
+        res = self.query(
+            "SELECT histogram_bounds::text FROM pg_stats "
+            f"WHERE schemaname = '{schema}' AND tablename = '{name}' AND attname = '{column}'",
+            List[str],
+        )
+        if not res or res[0] is None:
+            return None
+        return res[0].strip("{}").split(",")
+
+    def _stream_cursor(self, conn):
+        # A named cursor is created on the server, and fetched from in batches
+        return conn.cursor(name=f"data_diff_stream_{id(conn)}")
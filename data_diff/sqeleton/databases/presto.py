@@ -173,6 +173,9 @@ class Presto(Database):
 
         return query_cursor(c, sql_code)
 
+    def _query_iter(self, sql_code: str, batch_size: int):
+        return self._query_cursor_iter(self._conn.cursor(), sql_code, batch_size)
+
     def close(self):
         super().close()
         self._conn.close()
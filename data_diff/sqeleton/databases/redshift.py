@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 from ..abcs.database_types import Float, TemporalType, FractionalType, DbPath
 from ..abcs.mixins import AbstractMixin_MD5
 from .postgresql import (
@@ -60,9 +60,14 @@ class Dialect(PostgresqlDialect):
 
 class Redshift(PostgreSQL):
     dialect = Dialect()
+    SUPPORTS_UNIQUE_CONSTAINT = False  # Redshift doesn't enforce them
     CONNECT_URI_HELP = "redshift://<user>:<pass>@<host>/<database>"
     CONNECT_URI_PARAMS = ["database?"]
 
+    def query_column_histogram(self, path: DbPath, column: str) -> Optional[list]:
+        # Redshift's pg_stats doesn't provide the histogram bounds
+        return None
+
     def select_table_schema(self, path: DbPath) -> str:
         schema, table = self._normalize_table_path(path)
 
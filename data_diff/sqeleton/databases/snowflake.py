@@ -1,4 +1,4 @@
-from typing import Union, List
+from typing import Optional, Union, List
 import logging
 
 from ..abcs.database_types import (
@@ -14,8 +14,9 @@ from ..abcs.database_types import (
 )
 from ..abcs.mixins import AbstractMixin_MD5, AbstractMixin_NormalizeValue, AbstractMixin_Schema
 from ..abcs import Compilable
-from data_diff.sqeleton.queries import table, this, SKIP
+from data_diff.sqeleton.queries import table, this, Code, SKIP
 from .base import BaseDialect, ConnectError, Database, import_helper, CHECKSUM_MASK, ThreadLocalInterpreter
+from .base import histogram_quantiles, _group_columns_by_constraint
 
 
 @import_helper("snowflake")
@@ -27,10 +28,20 @@ def import_snowflake():
     return snowflake, serialization, default_backend
 
 
+@import_helper(text="You can install it using 'pip install snowflake-connector-python[pandas]'")
+def import_pyarrow():
+    import pyarrow
+
+    return pyarrow
+
+
 class Mixin_MD5(AbstractMixin_MD5):
     def md5_as_int(self, s: str) -> str:
         return f"BITAND(md5_number_lower64({s}), {CHECKSUM_MASK})"
 
+    def native_hash_as_int(self, s: str) -> str:
+        return f"BITAND(HASH({s}), {CHECKSUM_MASK})"
+
 
 class Mixin_NormalizeValue(AbstractMixin_NormalizeValue):
     def normalize_timestamp(self, value: str, coltype: TemporalType) -> str:
@@ -102,6 +113,8 @@ class Snowflake(Database):
     CONNECT_URI_HELP = "snowflake://<user>:<pass>@<account>/<database>/<SCHEMA>?warehouse=<WAREHOUSE>"
     CONNECT_URI_PARAMS = ["database", "schema"]
     CONNECT_URI_KWPARAMS = ["warehouse"]
+    SUPPORTS_ARROW = True
+    SUPPORTS_UNIQUE_CONSTAINT = True
 
     def __init__(self, *, schema: str, **kw):
         snowflake, serialization, default_backend = import_snowflake()
@@ -141,6 +154,23 @@ class Snowflake(Database):
         "Uses the standard SQL cursor interface"
         return self._query_conn(self._conn, sql_code)
 
+    def _query_iter(self, sql_code: str, batch_size: int):
+        # The connector downloads the result batches lazily, as they are fetched
+        return self._query_cursor_iter(self._conn.cursor(), sql_code, batch_size)
+
+    def _query_arrow(self, sql_code: str):
+        pyarrow = import_pyarrow()
+
+        c = self._conn.cursor()
+        try:
+            c.execute(sql_code)
+            table = c.fetch_arrow_all()
+            if table is None:  # Returned for empty results
+                table = pyarrow.table({col[0]: pyarrow.array([]) for col in c.description})
+            return table
+        finally:
+            c.close()
+
     def select_table_schema(self, path: DbPath) -> str:
         """Provide SQL for selecting the table schema as (name, type, date_prec, num_prec)"""
         database, schema, name = self._normalize_table_path(path)
@@ -170,5 +200,15 @@ class Snowflake(Database):
     def is_autocommit(self) -> bool:
         return True
 
-    def query_table_unique_columns(self, path: DbPath) -> List[str]:
-        return []
+    def _query_table_unique_columns(self, path: DbPath) -> List[List[str]]:
+        # Snowflake doesn't enforce constraints, so only those declared with RELY can be trusted
+        name = ".".join(map(self.dialect.quote, path))
+        rows = self.query(f"SHOW PRIMARY KEYS IN TABLE {name}", list)
+        rows += self.query(f"SHOW UNIQUE KEYS IN TABLE {name}", list)
+        # Columns: created_on, database_name, schema_name, table_name, column_name, key_sequence, constraint_name, rely, ...
+        return _group_columns_by_constraint([(row[6], row[4]) for row in rows if row[7] == "true"])
+
+    def query_column_histogram(self, path: DbPath, column: str) -> Optional[list]:
+        c = self.dialect.quote(column)
+        q = table(*path).select(*[Code(f"APPROX_PERCENTILE({c}, {p})") for p in histogram_quantiles()])
+        return list(self.query(q, tuple))
@@ -150,6 +150,7 @@ class Dialect(BaseDialect, Mixin_Schema):
 
 class Vertica(ThreadedDatabase):
     dialect = Dialect()
+    SUPPORTS_UNIQUE_CONSTAINT = True
     CONNECT_URI_HELP = "vertica://<user>:<pass>@<host>/<database>"
     CONNECT_URI_PARAMS = ["database?"]
 
@@ -177,3 +178,13 @@ class Vertica(ThreadedDatabase):
             "FROM V_CATALOG.COLUMNS "
             f"WHERE table_name = '{name}' AND table_schema = '{schema}'"
         )
+
+    def select_table_unique_columns(self, path: DbPath) -> str:
+        schema, name = self._normalize_table_path(path)
+
+        # Vertica only enforces the constraints that are enabled
+        return (
+            "SELECT constraint_id, column_name FROM V_CATALOG.CONSTRAINT_COLUMNS "
+            f"WHERE table_name = '{name}' AND table_schema = '{schema}' "
+            "AND constraint_type IN ('p', 'u') AND is_enabled"
+        )
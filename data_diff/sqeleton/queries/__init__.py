@@ -9,6 +9,7 @@ from .api import (
     avg,
     min_,
     max_,
+    mod_,
     cte,
     commit,
     when,
@@ -21,4 +22,4 @@ from .api import (
     current_timestamp,
 )
 from .ast_classes import Expr, ExprNode, Select, Count, BinOp, Explain, In, Code, Column
-from .extras import Checksum, NormalizeAsString, ApplyFuncAndNormalizeAsString
+from .extras import Checksum, RowHash, NormalizeAsString, ApplyFuncAndNormalizeAsString, CastToString
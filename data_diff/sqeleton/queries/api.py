@@ -73,6 +73,10 @@ def max_(expr: Expr):
     return Func("max", [expr])
 
 
+def mod_(expr: Expr, divisor: Expr):
+    return Func("mod", [expr, divisor])
+
+
 def if_(cond: Expr, then: Expr, else_: Optional[Expr] = None):
     return when(cond).then(then).else_(else_)
 
@@ -20,6 +20,17 @@ class NormalizeAsString(ExprNode):
         return c.dialect.normalize_value_by_type(expr, self.expr_type or self.expr.type)
 
 
+@dataclass
+class CastToString(ExprNode):
+    "Converts the expression to a string, as the database formats it. Unlike NormalizeAsString, it's not portable."
+
+    expr: ExprNode
+    type = str
+
+    def compile(self, c: Compiler) -> str:
+        return c.dialect.to_string(c.compile(self.expr))
+
+
 @dataclass
 class ApplyFuncAndNormalizeAsString(ExprNode):
     expr: ExprNode
@@ -46,8 +57,17 @@ class ApplyFuncAndNormalizeAsString(ExprNode):
 
 
 @dataclass
-class Checksum(ExprNode):
+class RowHash(ExprNode):
+    """md5 of the given expressions (concatenated), as an int
+
+    If native is true, uses the database's own hash function instead, which is faster, but only comparable
+    to hashes computed by the same kind of database. See AbstractMixin_MD5.native_hash_as_int()
+    """
+
     exprs: Sequence[Expr]
+    native: bool = False
+
+    type = int
 
     def compile(self, c: Compiler):
         if len(self.exprs) > 1:
@@ -58,5 +78,16 @@ class Checksum(ExprNode):
             # No need to coalesce - safe to assume that key cannot be null
             (expr,) = self.exprs
         expr = c.compile(expr)
-        md5 = c.dialect.md5_as_int(expr)
+        if self.native:
+            return c.dialect.native_hash_as_int(expr)
+        return c.dialect.md5_as_int(expr)
+
+
+@dataclass
+class Checksum(ExprNode):
+    exprs: Sequence[Expr]
+    native: bool = False
+
+    def compile(self, c: Compiler):
+        md5 = c.compile(RowHash(self.exprs, self.native))
         return f"sum({md5})"
@@ -242,6 +242,14 @@ class ArithAlphanumeric(ArithString):
             return NotImplemented
         return self._str < other._str
 
+    def __eq__(self, other):
+        if not isinstance(other, type(self)):
+            return NotImplemented
+        return self._str == other._str
+
+    def __hash__(self):
+        return hash(self._str)
+
     def new(self, *args, **kw):
         return type(self)(*args, **kw, max_len=self._max_len)
 
@@ -1,18 +1,78 @@
 import time
-from typing import List, Tuple
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
 import logging
 
 from runtype import dataclass
 
 from .sqeleton.utils import ArithString, split_space
+from .utils import safezip
 from .sqeleton.databases import Database, DbPath, DbKey, DbTime
+from .sqeleton.databases.base import CHECKSUM_HEXDIGITS
+from .sqeleton.abcs import Integer
 from .sqeleton.schema import Schema, create_schema
-from .sqeleton.queries import Count, Checksum, SKIP, table, this, Expr, min_, max_, Code
-from .sqeleton.queries.extras import ApplyFuncAndNormalizeAsString, NormalizeAsString
+from .sqeleton.queries import (
+    Count,
+    Checksum,
+    RowHash,
+    SKIP,
+    table,
+    this,
+    Expr,
+    min_,
+    max_,
+    mod_,
+    Code,
+    In,
+    when,
+    and_,
+    or_,
+)
+from .sqeleton.queries.ast_classes import BinBoolOp
+from .arrow_diff import rows_to_arrow
+from .sqeleton.queries.extras import ApplyFuncAndNormalizeAsString, NormalizeAsString, CastToString
 
 logger = logging.getLogger("table_segment")
 
 RECOMMENDED_CHECKSUM_DURATION = 20
+KEYS_PER_QUERY = 1000  # Oracle doesn't accept longer IN lists
+KEY_HASH_BITS = CHECKSUM_HEXDIGITS * 4  # md5_as_int() and native_hash_as_int() return this many bits
+
+# Composite keys are bounded by tuples, which may be shorter than the key (see compare_keys)
+KeyBound = Union[DbKey, Tuple[DbKey, ...]]
+
+
+def split_key_space(min_key: DbKey, max_key: DbKey, count: int) -> List[DbKey]:
+    "Returns up to 'count' evenly-spaced keys between min_key and max_key (not including them)"
+    if max_key - min_key <= count:
+        count = 1
+
+    if isinstance(min_key, ArithString):
+        assert type(min_key) is type(max_key)
+        checkpoints = min_key.range(max_key, count)
+        assert all(min_key <= x <= max_key for x in checkpoints)
+        return checkpoints
+
+    return split_space(min_key, max_key, count)
+
+
+def compare_keys(key_columns: Sequence[str], bound: tuple, op: str) -> Expr:
+    """Compares the key columns to a key in lexicographic order, where op is either '>=' or '<'.
+
+    The bound may be shorter than the key, in which case only its prefix is compared. So (k1, k2) >= (5,) means k1 >= 5.
+    The comparison is expanded into simple ones, since not every database supports comparing row values.
+    """
+    assert op in (">=", "<")
+    pairs = list(safezip(key_columns[: len(bound)], bound))
+    terms = []
+    for i, (k, v) in enumerate(pairs):
+        if op == "<":
+            cmp = this[k] < v
+        elif i == len(pairs) - 1:
+            cmp = this[k] >= v
+        else:
+            cmp = this[k] > v
+        terms.append(and_(*(this[c] == x for c, x in pairs[:i]), cmp))
+    return or_(*terms)
 
 
 @dataclass
@@ -26,11 +86,20 @@ class TableSegment:
         update_column (str, optional): Name of updated column, which signals that rows changed.
                                        Usually updated_at or last_update. Used by `min_update` and `max_update`.
         extra_columns (Tuple[str, ...], optional): Extra columns to compare
-        min_key (:data:`DbKey`, optional): Lowest key value, used to restrict the segment
-        max_key (:data:`DbKey`, optional): Highest key value, used to restrict the segment
+        min_key (:data:`DbKey`, optional): Lowest key value, used to restrict the segment.
+                                           For composite keys, a tuple that is compared lexicographically,
+                                           and may be shorter than the key (i.e. a prefix).
+        max_key (:data:`DbKey`, optional): Highest key value, used to restrict the segment. See min_key.
         min_update (:data:`DbTime`, optional): Lowest update_column value, used to restrict the segment
         max_update (:data:`DbTime`, optional): Highest update_column value, used to restrict the segment
+        key_hash_bucket (Tuple[int, int], optional): A pair of (modulus, remainder), that restricts the segment
+                                                     to rows whose key hash has that remainder. See split_by_key_hash()
         where (str, optional): An additional 'where' expression to restrict the search space.
+        native_hash (bool): Hash rows with the database's own hash function, instead of md5. Faster, but the
+                            checksums can only be compared to those of the same kind of database.
+        raw_columns (Tuple[str, ...], optional): Relevant columns that are hashed as the database formats them,
+                                                 instead of normalized. Only comparable to the same column type,
+                                                 in the same kind of database. Downloaded values are always normalized.
 
         case_sensitive (bool): If false, the case of column names will adjust according to the schema. Default is true.
 
@@ -46,14 +115,18 @@ class TableSegment:
     extra_columns: Tuple[str, ...] = ()
 
     # Restrict the segment
-    min_key: DbKey = None
-    max_key: DbKey = None
+    min_key: KeyBound = None
+    max_key: KeyBound = None
     min_update: DbTime = None
     max_update: DbTime = None
+    key_hash_bucket: Tuple[int, int] = None
 
     where: str = None
+    native_hash: bool = False
+    raw_columns: Tuple[str, ...] = ()
     case_sensitive: bool = True
     _schema: Schema = None
+    _key_histogram: tuple = None  # Sorted keys that split the table into buckets of about the same size
 
     def __post_init__(self):
         if not self.update_column and (self.min_update or self.max_update):
@@ -78,15 +151,50 @@ class TableSegment:
 
         return self._with_raw_schema(self.database.query_table_schema(self.table_path))
 
+    def with_key_histogram(self) -> "TableSegment":
+        """Queries the database for its estimate of the key distribution, and returns a new instance of TableSegment
+        that uses it to choose checkpoints. Requires a schema.
+
+        Only integer keys are supported. If no estimate is available, returns the same instance.
+        """
+        if len(self.key_columns) != 1:
+            return self
+        (k,) = self.key_columns
+        key_type = self._schema[k]
+        if getattr(key_type, "python_type", None) is not int:
+            return self
+
+        bounds = self.database.query_column_histogram(self.table_path, self._schema.get_key(k))
+        if not bounds:
+            logger.info(f"No key distribution statistics available for table {self.table_path}")
+            return self
+
+        histogram = sorted({key_type.make_value(b) for b in bounds if b is not None})
+        return self.new(_key_histogram=tuple(histogram))
+
+    @property
+    def is_composite_key(self) -> bool:
+        return len(self.key_columns) > 1
+
+    @property
+    def is_key_sorted_like_db(self) -> bool:
+        "Whether the database orders the keys like Python does, once parsed. (Only for integer keys)"
+        return self._schema is not None and all(isinstance(self._schema[k], Integer) for k in self.key_columns)
+
+    def _compare_key(self, bound: KeyBound, op: str) -> Expr:
+        return compare_keys(self.key_columns, bound if self.is_composite_key else (bound,), op)
+
     def _make_key_range(self):
+        k = self.key_columns[0]
         if self.min_key is not None:
-            assert len(self.key_columns) == 1
-            (k,) = self.key_columns
-            yield self.min_key <= this[k]
+            if self.is_composite_key:
+                # Redundant, but lets the database use an index on the key
+                yield this[k] >= self.min_key[0]
+            yield self._compare_key(self.min_key, ">=")
         if self.max_key is not None:
-            assert len(self.key_columns) == 1
-            (k,) = self.key_columns
-            yield this[k] < self.max_key
+            if self.is_composite_key:
+                yield this[k] <= self.max_key[0]
+            yield self._compare_key(self.max_key, "<")
 
     def _make_update_range(self):
         if self.min_update is not None:
@@ -98,30 +206,165 @@ class TableSegment:
     def source_table(self):
         return table(*self.table_path, schema=self._schema)
 
+    def _make_key_hash_mod(self, modulus: int) -> Expr:
+        return mod_(RowHash([NormalizeAsString(this[k]) for k in self.key_columns], self.native_hash), modulus)
+
+    def _make_key_hash_filter(self):
+        if self.key_hash_bucket is not None:
+            modulus, remainder = self.key_hash_bucket
+            if modulus > 1:
+                # Func compares as a dataclass, so == won't build an expression
+                yield BinBoolOp("=", [self._make_key_hash_mod(modulus), remainder])
+
     def make_select(self):
         return self.source_table.where(
-            *self._make_key_range(), *self._make_update_range(), Code(self.where) if self.where else SKIP
+            *self._make_key_range(),
+            *self._make_key_hash_filter(),
+            *self._make_update_range(),
+            Code(self.where) if self.where else SKIP,
         )
 
-    def get_values(self) -> list:
-        "Download all the relevant values of the segment from the database"
-        select = self.make_select().select(*self._relevant_columns_repr)
-        return self.database.query(select, List[Tuple])
+    def _make_values_select(self, columns: Dict[str, Expr], *where_exprs: Expr):
+        select = self.make_select().where(*where_exprs)
+        if self.is_key_sorted_like_db:
+            # Only then can the rows be merged in order (see diff_sorted). Otherwise, sorting is wasted work.
+            # The columns are named, so that ORDER BY refers to the original key columns, and not to their string form
+            select = select.order_by(*this[self.key_columns])
+        return select.select(**columns)
 
-    def choose_checkpoints(self, count: int) -> List[DbKey]:
-        "Suggests a bunch of evenly-spaced checkpoints to split by (not including start, end)"
+    @property
+    def _named_relevant_columns_repr(self) -> Dict[str, Expr]:
+        return {f"{c}_normalized": e for c, e in safezip(self.relevant_columns, self._relevant_columns_repr)}
 
-        if self.max_key - self.min_key <= count:
-            count = 1
+    def _named_columns_repr(self, columns: Sequence[str] = None) -> Dict[str, Expr]:
+        "The key columns and the given columns, or all the relevant columns if None"
+        if columns is None:
+            return self._named_relevant_columns_repr
+        return {f"{c}_normalized": NormalizeAsString(this[c]) for c in list(self.key_columns) + list(columns)}
+
+    @property
+    def _named_key_hash_repr(self) -> Dict[str, Expr]:
+        keys = {f"{k}_normalized": NormalizeAsString(this[k]) for k in self.key_columns}
+        return {**keys, "row_hash": RowHash(self._relevant_columns_hash_repr, self.native_hash)}
+
+    def _make_key_column_filter(self, k: str, value: str) -> Expr:
+        if isinstance(self._schema[k], Integer):
+            return this[k] == int(value)
+        # Expr.__eq__ isn't overloaded for functions, so build the comparison explicitly
+        return BinBoolOp("=", [NormalizeAsString(this[k]), value])
+
+    def _make_keys_filter(self, keys: Sequence[Union[str, tuple]]):
+        if self.is_composite_key:
+            # Not every database supports IN with row values
+            return or_(*(and_(*map(self._make_key_column_filter, self.key_columns, key)) for key in keys))
+
+        (k,) = self.key_columns
+        if isinstance(self._schema[k], Integer):
+            return In(this[k], [int(v) for v in keys])
+        # Compare the normalized form, which is how we received the keys
+        return In(NormalizeAsString(this[k]), list(keys))
+
+    def get_values(self, keys: Sequence[Union[str, tuple]] = None, columns: Sequence[str] = None) -> list:
+        """Download all the relevant values of the segment from the database, ordered by key if it's an integer
+
+        If 'keys' is provided, only rows with those (normalized) keys are downloaded.
+        For composite keys, each key is a tuple.
+
+        If 'columns' is provided, only the key columns and those columns are downloaded, in that order.
+        """
+        if keys is None:
+            return self.database.query(self._make_values_select(self._named_columns_repr(columns)), List[Tuple])
+
+        rows = []
+        for i in range(0, len(keys), KEYS_PER_QUERY):
+            keys_filter = self._make_keys_filter(keys[i : i + KEYS_PER_QUERY])
+            rows += self.database.query(
+                self._make_values_select(self._named_columns_repr(columns), keys_filter), List[Tuple]
+            )
+        return rows
+
+    def iter_values(self) -> Iterator[tuple]:
+        "Like get_values(), but lazily streams the rows from the database, in batches"
+        return self.database.query_iter(self._make_values_select(self._named_relevant_columns_repr))
+
+    def get_values_arrow(self):
+        """Like get_values(), but returns an Arrow table (requires pyarrow)
+
+        Where the driver supports it, the rows are fetched as Arrow batches, without creating Python objects.
+        """
+        return self._query_arrow(self._make_values_select(self._named_relevant_columns_repr))
+
+    def _query_arrow(self, select: Expr):
+        if self.database.SUPPORTS_ARROW:
+            return self.database.query_arrow(select)
+        return rows_to_arrow(self.database.query(select, List[Tuple]), [c.name for c in select.columns])
+
+    def get_key_hashes(self) -> list:
+        "Download the key columns of each row in the segment, with a hash of all its relevant values. See get_values()"
+        return self.database.query(self._make_values_select(self._named_key_hash_repr), List[Tuple])
+
+    def iter_key_hashes(self) -> Iterator[tuple]:
+        "Like get_key_hashes(), but lazily streams the rows from the database, in batches"
+        return self.database.query_iter(self._make_values_select(self._named_key_hash_repr))
+
+    def get_key_hashes_arrow(self):
+        "Like get_key_hashes(), but returns an Arrow table. See get_values_arrow()"
+        return self._query_arrow(self._make_values_select(self._named_key_hash_repr))
 
+    def choose_checkpoints(self, count: int) -> List[KeyBound]:
+        """Suggests a bunch of evenly-spaced checkpoints to split by (not including start, end)
+
+        If the segment has a key histogram with enough values in its range, the checkpoints are spaced by
+        row count (approximately), instead of by key value.
+        """
         assert self.is_bounded
-        if isinstance(self.min_key, ArithString):
-            assert type(self.min_key) is type(self.max_key)
-            checkpoints = self.min_key.range(self.max_key, count)
-            assert all(self.min_key <= x <= self.max_key for x in checkpoints)
-            return checkpoints
+        if self.is_composite_key:
+            return self._choose_composite_checkpoints(count)
 
-        return split_space(self.min_key, self.max_key, count)
+        if self.max_key - self.min_key <= count:
+            count = 1
+
+        if self._key_histogram:
+            bounds = [b for b in self._key_histogram if self.min_key < b < self.max_key]
+            if len(bounds) >= count:
+                return sorted({bounds[len(bounds) * i // (count + 1)] for i in range(1, count + 1)})
+
+        return split_key_space(self.min_key, self.max_key, count)
+
+    def _choose_composite_checkpoints(self, count: int) -> List[tuple]:
+        """Splits the segment along the first key column that varies within it.
+
+        Key columns that are fixed within the segment become part of the checkpoints' prefix. When the bounds
+        don't tell the range of the next key column (e.g. the segment starts at a shorter prefix), it's queried
+        from the database, among the rows that share the prefix.
+        """
+        min_key, max_key = self.min_key, self.max_key
+        prefix = ()
+        for i in range(len(self.key_columns)):
+            if min_key[:i] == prefix and len(min_key) > i:
+                low = min_key[i]
+            else:
+                low = None
+            if max_key[:i] == prefix and len(max_key) > i:
+                # Rows with the same value as max_key's column are included, if max_key is longer
+                high = max_key[i] + 1 if len(max_key) > i + 1 else max_key[i]
+            else:
+                high = None
+
+            if low is None or high is None:
+                min_value, max_value = self._query_key_column_range(prefix)
+                if min_value is None:
+                    return []
+                low = self._parse_key_column(i, min_value) if low is None else low
+                high = self._parse_key_column(i, max_value) + 1 if high is None else high
+
+            if high - low >= 2:
+                return [prefix + (c,) for c in split_key_space(low, high, count)]
+
+            # All the rows in the segment have the same value for this column
+            prefix += (low,)
+
+        return []
 
     def segment_by_checkpoints(self, checkpoints: List[DbKey]) -> List["TableSegment"]:
         "Split the current TableSegment to a bunch of smaller ones, separated by the given checkpoints"
@@ -139,6 +382,15 @@ class TableSegment:
 
         return tables
 
+    def split_by_key_hash(self, count: int) -> List["TableSegment"]:
+        """Split the current TableSegment into 'count' smaller ones, by the hash of the key
+
+        Each segment keeps the rows whose key hash has a remainder of (remainder + modulus * i), for a modulus
+        'count' times bigger than the current one. Together, they have the same rows as the current segment.
+        """
+        modulus, remainder = self.key_hash_bucket or (1, 0)
+        return [self.new(key_hash_bucket=(modulus * count, remainder + modulus * i)) for i in range(count)]
+
     def new(self, **kwargs) -> "TableSegment":
         """Using new() creates a copy of the instance using 'replace()'"""
         return self.replace(**kwargs)
@@ -156,15 +408,19 @@ class TableSegment:
     def _relevant_columns_repr(self) -> List[Expr]:
         return [NormalizeAsString(this[c]) for c in self.relevant_columns]
 
+    @property
+    def _relevant_columns_hash_repr(self) -> List[Expr]:
+        "Like _relevant_columns_repr, but skips normalizing the raw_columns"
+        return [
+            CastToString(this[c]) if c in self.raw_columns else NormalizeAsString(this[c])
+            for c in self.relevant_columns
+        ]
+
     def count(self) -> int:
         """Count how many rows are in the segment, in one pass."""
         return self.database.query(self.make_select().select(Count()), int)
 
-    def count_and_checksum(self) -> Tuple[int, int]:
-        """Count and checksum the rows in the segment, in one pass."""
-        start = time.monotonic()
-        q = self.make_select().select(Count(), Checksum(self._relevant_columns_repr))
-        count, checksum = self.database.query(q, tuple)
+    def _warn_if_slow(self, start: float):
         duration = time.monotonic() - start
         if duration > RECOMMENDED_CHECKSUM_DURATION:
             logger.warning(
@@ -173,30 +429,137 @@ class TableSegment:
                 duration,
             )
 
+    def count_and_checksum(self) -> Tuple[int, int]:
+        """Count and checksum the rows in the segment, in one pass."""
+        start = time.monotonic()
+        q = self.make_select().select(Count(), Checksum(self._relevant_columns_hash_repr, self.native_hash))
+        count, checksum = self.database.query(q, tuple)
+        self._warn_if_slow(start)
+
         if count:
             assert checksum, (count, checksum)
         return count or 0, int(checksum) if count else None
 
-    def query_key_range(self) -> Tuple[int, int]:
-        """Query database for minimum and maximum key. This is used for setting the initial bounds."""
+    def count_and_checksum_by_column(self) -> Tuple[int, Optional[int], Tuple[Optional[int], ...]]:
+        """Count and checksum the rows in the segment, and checksum each of the relevant columns, in one pass.
+
+        Returns (count, checksum, column_checksums), where column_checksums has a checksum for each relevant column.
+        Each column is hashed together with the key, so values that moved between rows still change the checksum.
+        Key columns are hashed on their own, so they only change when the keys do.
+        """
+        start = time.monotonic()
+        column_checksums = []
+        for c in self.relevant_columns:
+            exprs = [NormalizeAsString(this[k]) for k in self.key_columns]
+            if c not in self.key_columns:
+                exprs += [CastToString(this[c]) if c in self.raw_columns else NormalizeAsString(this[c])]
+            column_checksums.append(Checksum(exprs, self.native_hash))
+
+        q = self.make_select().select(
+            Count(), Checksum(self._relevant_columns_hash_repr, self.native_hash), *column_checksums
+        )
+        count, checksum, *column_checksums = self.database.query(q, tuple)
+        self._warn_if_slow(start)
+
+        if not count:
+            return 0, None, tuple(None for _ in column_checksums)
+        return count, int(checksum), tuple(map(int, column_checksums))
+
+    def count_and_checksum_by_checkpoints(self, checkpoints: List[DbKey]) -> List[Tuple[int, Optional[int]]]:
+        """Count and checksum the rows between each of the given checkpoints, in one pass.
+
+        Returns a (count, checksum) pair for each of the segments created by segment_by_checkpoints().
+        """
+        assert checkpoints
+        checkpoints = sorted(checkpoints)
+
+        bucket = when(self._compare_key(checkpoints[0], "<")).then(0)
+        for i, c in enumerate(checkpoints[1:], 1):
+            bucket = bucket.when(self._compare_key(c, "<")).then(i)
+        bucket = bucket.else_(len(checkpoints))
+
+        results = self._count_and_checksum_by(bucket)
+        return [results.get(i, (0, None)) for i in range(len(checkpoints) + 1)]
+
+    def count_and_checksum_by_key_hash(self, count: int) -> List[Tuple[int, Optional[int]]]:
+        """Count and checksum the rows of each of the segments created by split_by_key_hash(), in one pass."""
+        modulus, remainder = self.key_hash_bucket or (1, 0)
+        results = self._count_and_checksum_by(self._make_key_hash_mod(modulus * count))
+        return [results.get(remainder + modulus * i, (0, None)) for i in range(count)]
+
+    def _count_and_checksum_by(self, bucket: Expr) -> Dict[int, Tuple[int, int]]:
+        start = time.monotonic()
+        q = self.make_select().group_by(
+            keys=[bucket], values=[Count(), Checksum(self._relevant_columns_hash_repr, self.native_hash)]
+        )
+        rows = self.database.query(q, list)
+        self._warn_if_slow(start)
+
+        return {int(i): (count, int(checksum)) for i, count, checksum in rows if count}
+
+    def _parse_key_column(self, i: int, value: str) -> DbKey:
+        return self._schema[self.key_columns[i]].make_value(value)
+
+    def _query_key_column_range(self, prefix: tuple) -> Tuple[Optional[str], Optional[str]]:
+        "Query database for the minimum and maximum values of the key column that follows the given prefix"
         # Normalizes the result (needed for UUIDs) after the min/max computation
-        (k,) = self.key_columns
-        select = self.make_select().select(
-            ApplyFuncAndNormalizeAsString(this[k], min_),
-            ApplyFuncAndNormalizeAsString(this[k], max_),
+        k = self.key_columns[len(prefix)]
+        select = (
+            self.make_select()
+            .where(*(this[c] == v for c, v in zip(self.key_columns, prefix)))
+            .select(
+                ApplyFuncAndNormalizeAsString(this[k], min_),
+                ApplyFuncAndNormalizeAsString(this[k], max_),
+            )
         )
-        min_key, max_key = self.database.query(select, tuple)
+        return self.database.query(select, tuple)
+
+    def query_key_range(self) -> Tuple[Union[str, tuple], Union[str, tuple]]:
+        """Query database for minimum and maximum key. This is used for setting the initial bounds.
+
+        For composite keys, returns the lexicographically smallest and largest keys, as tuples.
+        Each key column after the first is queried among the rows that share the previous columns.
+        """
+        min_key, max_key = self._query_key_column_range(())
 
         if min_key is None or max_key is None:
             raise ValueError("Table appears to be empty")
 
+        if not self.is_composite_key:
+            return min_key, max_key
+
+        min_key, max_key = (min_key,), (max_key,)
+        for _ in self.key_columns[1:]:
+            min_prefix = tuple(map(self._parse_key_column, range(len(min_key)), min_key))
+            max_prefix = tuple(map(self._parse_key_column, range(len(max_key)), max_key))
+            min_key += (self._query_key_column_range(min_prefix)[0],)
+            max_key += (self._query_key_column_range(max_prefix)[1],)
         return min_key, max_key
 
+    def query_max_update(self) -> Optional[DbTime]:
+        "Query database for the highest update_column value in the segment. Returns None if it's empty."
+        (max_update,) = self.database.query(self.make_select().select(max_(this[self.update_column])), tuple)
+        return max_update
+
     @property
     def is_bounded(self):
         return self.min_key is not None and self.max_key is not None
 
-    def approximate_size(self):
+    def approximate_size(self) -> Optional[int]:
+        """Returns the number of possible keys in the segment.
+
+        For composite keys, that's only known when the bounds differ in the last key column alone.
+        Otherwise, returns None. For segments split by key hash, returns the number of possible key hashes.
+        """
+        if self.key_hash_bucket is not None:
+            modulus, _remainder = self.key_hash_bucket
+            return (1 << KEY_HASH_BITS) // modulus
         if not self.is_bounded:
             raise RuntimeError("Cannot approximate the size of an unbounded segment. Must have min_key and max_key.")
-        return self.max_key - self.min_key
+        if not self.is_composite_key:
+            return self.max_key - self.min_key
+
+        n = len(self.key_columns)
+        if len(self.min_key) == len(self.max_key) == n and self.min_key[:-1] == self.max_key[:-1]:
+            return self.max_key[-1] - self.min_key[-1]
+        return None
@@ -1,12 +1,14 @@
 import itertools
+import threading
 from queue import PriorityQueue
 from collections import deque
 from collections.abc import Iterable
 from concurrent.futures import ThreadPoolExecutor
 from concurrent.futures.thread import _WorkItem
-from time import sleep
 from typing import Callable, Iterator, Optional
 
+DEFAULT_MAX_BUFFER_SIZE = 1024 * 64
+
 
 class AutoPriorityQueue(PriorityQueue):
     """Overrides PriorityQueue to automatically get the priority from _WorkItem.kwargs
@@ -43,38 +45,111 @@ class ThreadedYielder(Iterable):
 
     To add a source iterator, call ``submit()`` with a function that returns an iterator.
     Priority for the iterator can be provided via the keyword argument 'priority'. (higher runs first)
+
+    The results of each task are collected until it's done, and then added to the buffer together,
+    so they're yielded one after the other (e.g. the -/+ rows of a segment's diff stay adjacent).
+    Results are buffered until they are consumed. When the buffer holds 'max_buffer_size' items,
+    the workers block until the consumer catches up, or until the yielder is closed.
+
+    Closing the yielder (or the iterator) cancels the tasks that didn't start yet, stops running tasks
+    at their next result, and ignores any further calls to ``submit()``.
     """
 
-    def __init__(self, max_workers: Optional[int] = None):
+    def __init__(self, max_workers: Optional[int] = None, max_buffer_size: int = DEFAULT_MAX_BUFFER_SIZE):
         self._pool = PriorityThreadPoolExecutor(max_workers)
-        self._futures = deque()
-        self._yield = deque()
+        self._max_buffer_size = max_buffer_size
+        self._cond = threading.Condition()
+        self._pending = 0  # Submitted tasks that didn't finish yet
+        self._futures = set()
+        self._yield = deque()  # The results of each task, as a list
+        self._buffered = 0  # Number of items in self._yield
         self._exception = None
+        self._closed = False
 
     def _worker(self, fn, *args, **kwargs):
         try:
+            if self._closed:
+                return
             res = fn(*args, **kwargs)
             if res is not None:
-                self._yield += res
+                items = []
+                for item in res:
+                    if self._closed:
+                        return
+                    items.append(item)
+                if items:
+                    self._put(items)
         except Exception as e:
-            self._exception = e
+            with self._cond:
+                self._exception = e
+                self._cond.notify_all()
+        finally:
+            with self._cond:
+                self._pending -= 1
+                self._cond.notify_all()
+
+    def _put(self, items: list):
+        "Add the results of a task to the buffer, blocking while it's full. Dropped if they're no longer wanted."
+        with self._cond:
+            while self._buffered >= self._max_buffer_size and not (self._exception or self._closed):
+                self._cond.wait()
+            if self._exception or self._closed:
+                return
+            self._yield.append(items)
+            self._buffered += len(items)
+            self._cond.notify_all()
 
     def submit(self, fn: Callable, *args, priority: int = 0, **kwargs):
-        self._futures.append(self._pool.submit(self._worker, fn, *args, priority=priority, **kwargs))
-
-    def __iter__(self) -> Iterator:
-        while True:
-            if self._exception:
-                raise self._exception
-
-            while self._yield:
-                yield self._yield.popleft()
-
-            if not self._futures:
-                # No more tasks
+        with self._cond:
+            if self._closed:
                 return
+            self._pending += 1
+            future = self._pool.submit(self._worker, fn, *args, priority=priority, **kwargs)
+            self._futures.add(future)
+        future.add_done_callback(self._discard_future)
+
+    def _discard_future(self, future):
+        with self._cond:
+            self._futures.discard(future)
+
+    def close(self):
+        "Cancel the remaining tasks, discard any pending results, and release the workers waiting to add more"
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._yield.clear()
+            self._buffered = 0
+            futures = list(self._futures)
+            self._cond.notify_all()
+
+        for f in futures:
+            # Only succeeds for tasks that didn't start yet. Their worker never runs, so it can't count them as done.
+            if f.cancel():
+                with self._cond:
+                    self._pending -= 1
+        self._pool.shutdown(wait=False)
 
-            if self._futures[0].done():
-                self._futures.popleft()
-            else:
-                sleep(0.001)
+    def __iter__(self) -> Iterator:
+        try:
+            while True:
+                with self._cond:
+                    while not (self._yield or self._exception or self._closed or not self._pending):
+                        self._cond.wait()
+
+                    if self._exception:
+                        raise self._exception
+
+                    if not self._yield:
+                        # No more tasks, or closed
+                        return
+
+                    batches = list(self._yield)
+                    self._yield.clear()
+                    self._buffered = 0
+                    self._cond.notify_all()
+
+                for items in batches:
+                    yield from items
+        finally:
+            self.close()
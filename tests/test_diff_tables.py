@@ -1,17 +1,23 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Callable
+import os
 import uuid
+import tempfile
 import unittest
+import threading
 
 from data_diff.sqeleton.queries import table, this, commit
 from data_diff.sqeleton.utils import ArithAlphanumeric, numberToAlphanum
 
-from data_diff.hashdiff_tables import HashDiffer
+from data_diff.hashdiff_tables import HashDiffer, BisectionTuner, diff_sets, diff_sorted
 from data_diff.joindiff_tables import JoinDiffer
 from data_diff.table_segment import TableSegment, split_space
+from data_diff.thread_utils import ThreadedYielder
+from data_diff.arrow_diff import diff_sets_arrow
+from data_diff.incremental import diff_tables_incremental, _naive, _restrict_updates
 from data_diff import databases as db
 
-from .common import str_to_checksum, test_each_database_in_list, DiffTestCase, table_segment
+from .common import str_to_checksum, test_each_database_in_list, DiffTestCase, table_segment, get_conn
 
 
 TEST_DATABASES = {
@@ -37,6 +43,132 @@ class TestUtils(unittest.TestCase):
                     r = split_space(i, j + i + n, n)
                     assert len(r) == n, f"split_space({i}, {j+n}, {n}) = {(r)}"
 
+    def test_diff_sorted(self):
+        a = [("1", "a"), ("2", "b"), ("4", "d"), ("4", "d"), ("10", "x")]
+        b = [("1", "a"), ("2", "B"), ("3", "c"), ("10", "x"), ("11", "y")]
+        diff = list(diff_sorted(a, b, key=int))
+        self.assertEqual(
+            diff,
+            [
+                ("-", ("2", "b")),
+                ("+", ("2", "B")),
+                ("+", ("3", "c")),
+                ("-", ("4", "d")),
+                ("-", ("4", "d")),
+                ("+", ("11", "y")),
+            ],
+        )
+        self.assertEqual(sorted(diff), sorted(diff_sets(a, b)))
+        self.assertRaises(ValueError, list, diff_sorted(a[::-1], b, key=int))
+
+    def test_diff_sets_arrow(self):
+        try:
+            import pyarrow  # noqa: F401
+        except ModuleNotFoundError:
+            self.skipTest("pyarrow isn't installed")
+
+        a = [("1", "a", None), ("2", "b", "x"), ("4", "d", None), ("4", "d", None), ("10", "x", "y")]
+        b = [("1", "a", None), ("2", "B", "x"), ("3", "c", None), ("10", "x", None), ("11", "y", "z")]
+        self.assertEqual(list(diff_sets(a, b)), list(diff_sets_arrow(a, b)))
+        self.assertEqual(list(diff_sorted(a, b, key=int)), list(diff_sets_arrow(a, b, key=int)))
+        self.assertEqual([("-", ("1", "a", None))], list(diff_sets_arrow(a[:1], [])))
+        self.assertEqual([], list(diff_sets_arrow([], [])))
+
+    def test_naive_watermark(self):
+        self.assertIsNone(_naive(None))
+        self.assertEqual(datetime(2022, 1, 1, 12), _naive(datetime(2022, 1, 1, 12)))
+        self.assertEqual(datetime(2022, 1, 1, 10), _naive(datetime(2022, 1, 1, 12, tzinfo=timezone(timedelta(hours=2)))))
+
+    def test_restrict_aware_updates(self):
+        tz = timezone(timedelta(hours=2))
+        aware = datetime(2022, 1, 1, 12, tzinfo=tz)
+        table = table_segment(get_conn(db.DuckDB), ("t",), "id", update_column="ts", min_update=aware)
+        self.assertIs(table, _restrict_updates(table, datetime(2022, 1, 1, 9)))
+        self.assertEqual(datetime(2022, 1, 1, 11), _restrict_updates(table, datetime(2022, 1, 1, 11)).min_update)
+
+        table = table.new(min_update=None, max_update=aware)
+        self.assertIsNone(_restrict_updates(table, datetime(2022, 1, 1, 10)))
+        restricted = _restrict_updates(table, datetime(2022, 1, 1, 9))
+        self.assertEqual(datetime(2022, 1, 1, 9), restricted.min_update)
+        self.assertEqual(datetime(2022, 1, 1, 10), restricted.max_update)
+
+    def test_bisection_tuner(self):
+        tuner = BisectionTuner(32, 10000, factor_bounds=(4, 64), threshold_bounds=(1000, 100000), parallelism=8)
+        self.assertEqual(10000, tuner.threshold)
+        self.assertEqual(32, tuner.choose_factor(10**6))
+
+        # Checksum takes as long as downloading 50k rows
+        tuner.record_checksum(0.5)
+        tuner.record_download(0.1, 10000)
+        self.assertEqual(50000, tuner.threshold)
+        self.assertEqual(5, tuner.choose_factor(10**6))  # 2 levels, of one round-trip each
+        self.assertEqual(4, tuner.choose_factor(10**5))
+
+        # Slow downloads are bounded by the minimal threshold
+        tuner.record_download(100, 10)
+        self.assertEqual(1000, tuner.threshold)
+
+    def test_threaded_yielder(self):
+        produced = []
+
+        def produce(start, count):
+            for i in range(start, start + count):
+                produced.append(i)
+                yield i
+
+        ti = ThreadedYielder(2, max_buffer_size=4)
+        for start in range(0, 200, 2):
+            ti.submit(produce, start, 2)
+        it = iter(ti)
+        first = next(it)
+        # Producers wait for the consumer: at most one drained buffer, one full buffer, and one task per worker
+        self.assertLessEqual(len(produced), 4 + 4 + 2 * 2)
+        res = [first, *it]
+        self.assertEqual(list(range(200)), sorted(res))
+        # The results of each task are adjacent
+        self.assertTrue(all(res[res.index(i) + 1] == i + 1 for i in range(0, 200, 2)))
+
+        def fail():
+            raise ZeroDivisionError()
+
+        ti = ThreadedYielder(2)
+        ti.submit(produce, 0, 10)
+        ti.submit(fail)
+        self.assertRaises(ZeroDivisionError, list, ti)
+
+    def test_threaded_yielder_close(self):
+        started = []
+        release = threading.Event()
+
+        def task(i):
+            started.append(i)
+            if i:
+                release.wait(10)
+            return [i]
+
+        ti = ThreadedYielder(1)
+        for i in range(10):
+            ti.submit(task, i)
+        it = iter(ti)
+        self.assertEqual(0, next(it))
+        it.close()
+        ti.submit(task, 10)  # Ignored
+        release.set()
+        ti._pool.shutdown(wait=True)
+        self.assertLessEqual(len(started), 2)  # Queued tasks were cancelled
+
+        # Closing from another thread releases a waiting consumer
+        release.clear()
+        ti = ThreadedYielder(1)
+        for i in range(1, 10):
+            ti.submit(task, i)
+        threading.Timer(0.1, ti.close).start()
+        self.assertEqual([], list(ti))
+        self.assertFalse(release.is_set())
+        release.set()
+        ti._pool.shutdown(wait=True)
+        self.assertEqual(0, ti._pending)
+
 
 @test_each_database
 class TestDates(DiffTestCase):
@@ -180,6 +312,65 @@ class TestDiffTables(DiffTestCase):
         self.assertEqual(2, info.rowcounts[1])
         self.assertEqual(1, info.rowcounts[2])
 
+    def test_task_pool_lifetime(self):
+        time_obj = datetime.fromisoformat("2022-01-01 00:00:00")
+        cols = "id userid movieid rating timestamp".split()
+        rows = [[i, i, i, 9, time_obj] for i in range(1, 11)]
+        self.connection.query(
+            [
+                self.src_table.insert_rows(rows, columns=cols),
+                self.dst_table.insert_rows(rows[1:], columns=cols),
+                commit,
+            ]
+        )
+
+        differ = HashDiffer(bisection_factor=2, bisection_threshold=4)
+        with differ._task_pool_scope():
+            differ._threaded_call("count", [self.table, self.table2])
+            task_pool = differ._task_pool
+            differ._threaded_call("count", [self.table, self.table2])
+            self.assertIs(task_pool, differ._task_pool)
+        self.assertIsNone(differ._task_pool)
+
+        # Once the scope is closed, the pool isn't recreated. (e.g. by the workers of a closed diff)
+        self.assertRaises(RuntimeError, differ._threaded_call, "count", [self.table, self.table2])
+        self.assertIsNone(differ._task_pool)
+
+        diff = list(differ.diff_tables(self.table, self.table2))
+        self.assertEqual(1, len(diff))
+        self.assertIsNone(differ._task_pool)
+
+        diff_res = differ.diff_tables(self.table, self.table2)
+        next(iter(diff_res))
+        diff_res.close()
+        self.assertIsNone(differ._task_pool)
+
+        # A diff that ends doesn't shut down the pool of a concurrent diff
+        diff_iter = iter(differ.diff_tables(self.table, self.table2))
+        next(diff_iter)
+        self.assertEqual(diff, list(differ.diff_tables(self.table, self.table2)))
+        self.assertIsNotNone(differ._task_pool)
+        self.assertEqual([], list(diff_iter))
+        self.assertIsNone(differ._task_pool)
+        self.assertIsNot(differ._task_pool_lock, HashDiffer()._task_pool_lock)
+
+    def test_limit(self):
+        time_obj = datetime.fromisoformat("2022-01-01 00:00:00")
+        cols = "id userid movieid rating timestamp".split()
+        self.connection.query(
+            [
+                self.src_table.insert_rows([[i, i, i, 9, time_obj] for i in range(1, 101)], columns=cols),
+                self.dst_table.insert_rows([[i, i, i, 9, time_obj] for i in range(1, 101, 10)], columns=cols),
+                commit,
+            ]
+        )
+
+        differ = HashDiffer(bisection_factor=2, bisection_threshold=4)
+        diff_res = differ.diff_tables(self.table, self.table2)
+        diff = list(diff_res.limit(5))
+        self.assertEqual(5, len(diff))
+        self.assertIsNone(differ._task_pool)  # The diff was closed
+
     def test_non_threaded(self):
         differ = HashDiffer(bisection_factor=3, bisection_threshold=4, threaded=False)
 
@@ -237,6 +428,367 @@ class TestDiffTables(DiffTestCase):
         self.assertEqual(5, info.rowcounts[1])
         self.assertEqual(4, info.rowcounts[2])
 
+    def test_additive_checksum(self):
+        time = "2022-01-01 00:00:00"
+        time_obj = datetime.fromisoformat(time)
+
+        cols = "id userid movieid rating timestamp".split()
+        rows = [[i, i, i, 9, time_obj] for i in range(1, 65)]
+        self.connection.query(
+            [
+                self.src_table.insert_rows(rows, columns=cols),
+                self.dst_table.insert_rows(rows[:40] + rows[41:], columns=cols),
+                commit,
+            ]
+        )
+
+        differ = HashDiffer(bisection_factor=2, bisection_threshold=4, additive_checksum=True)
+        diff_res = differ.diff_tables(self.table, self.table2)
+        diff = list(diff_res)
+
+        self.assertEqual([("-", ("41", time + ".000000"))], diff)
+        self.assertEqual({1: 64, 2: 63}, diff_res.info_tree.info.rowcounts)
+        self.assertGreater(differ.stats["inferred_checksums"], 0)
+
+    def test_batched_checksum(self):
+        time = "2022-01-01 00:00:00"
+        time_obj = datetime.fromisoformat(time)
+
+        cols = "id userid movieid rating timestamp".split()
+        rows = [[i, i, i, 9, time_obj] for i in range(1, 65)]
+        self.connection.query(
+            [
+                self.src_table.insert_rows(rows, columns=cols),
+                self.dst_table.insert_rows(rows[:40] + rows[41:], columns=cols),
+                commit,
+            ]
+        )
+
+        table = self.table.with_schema().new(min_key=1, max_key=65)
+        results = table.count_and_checksum_by_checkpoints([20, 60])
+        self.assertEqual([19, 40, 5], [count for count, _checksum in results])
+        self.assertEqual(table.new(min_key=20, max_key=60).count_and_checksum(), results[1])
+
+        differ = HashDiffer(bisection_factor=4, bisection_threshold=8, batched_checksum=True)
+        diff_res = differ.diff_tables(self.table, self.table2)
+        diff = list(diff_res)
+
+        self.assertEqual([("-", ("41", time + ".000000"))], diff)
+        self.assertEqual({1: 64, 2: 63}, diff_res.info_tree.info.rowcounts)
+
+    def test_adaptive_bisection(self):
+        time = "2022-01-01 00:00:00"
+        time_obj = datetime.fromisoformat(time)
+
+        cols = "id userid movieid rating timestamp".split()
+        rows = [[i, i, i, 9, time_obj] for i in range(1, 201)]
+        self.connection.query(
+            [
+                self.src_table.insert_rows(rows, columns=cols),
+                self.dst_table.insert_rows(rows[:150] + rows[151:], columns=cols),
+                commit,
+            ]
+        )
+
+        differ = HashDiffer(
+            bisection_factor=2,
+            bisection_threshold=8,
+            adaptive_bisection=True,
+            bisection_factor_bounds=(2, 8),
+            bisection_threshold_bounds=(9, 16),
+            max_threadpool_size=8,
+        )
+        diff = list(differ.diff_tables(self.table, self.table2))
+        self.assertEqual([("-", ("151", time + ".000000"))], diff)
+        self.assertLessEqual(9, differ._bisection_threshold)
+        self.assertLessEqual(differ._bisection_threshold, 16)
+
+        # Slow checksums raise the threshold, which needs fewer levels, so a smaller factor
+        for _ in range(10):
+            differ._tuner.record_checksum(10)
+        differ._tuner.record_download(0.001, 10**6)
+        self.assertEqual(16, differ._bisection_threshold)
+        self.assertEqual(4, differ._choose_bisection_factor(200))
+
+        # Slow downloads lower the threshold, which needs more levels, so a bigger factor
+        differ._tuner.record_download(10**9, 1)
+        self.assertEqual(9, differ._bisection_threshold)
+        self.assertEqual(5, differ._choose_bisection_factor(200))
+
+        self.assertRaises(ValueError, HashDiffer, adaptive_bisection=True, bisection_factor_bounds=(8, 4))
+        self.assertRaises(
+            ValueError,
+            HashDiffer,
+            adaptive_bisection=True,
+            bisection_factor_bounds=(2, 8),
+            bisection_threshold_bounds=(8, 16),
+        )
+        # The initial values only need to be valid once limited to the bounds
+        HashDiffer(bisection_factor=64, bisection_threshold=8, adaptive_bisection=True)
+
+    def test_checksum_store(self):
+        time = "2022-01-01 00:00:00"
+        time_obj = datetime.fromisoformat(time)
+
+        cols = "id userid movieid rating timestamp".split()
+        rows = [[i, i, i, 9, time_obj] for i in range(1, 65)]
+        self.connection.query(
+            [
+                self.src_table.insert_rows(rows, columns=cols),
+                self.dst_table.insert_rows(rows[:10] + rows[11:], columns=cols),
+                commit,
+            ]
+        )
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store_path = os.path.join(tmpdir, "checksums.db")
+            expected = [("-", ("11", time + ".000000"))]
+
+            differ = HashDiffer(bisection_factor=4, bisection_threshold=8, checksum_store=store_path)
+            self.assertEqual(expected, list(differ.diff_tables(self.table, self.table2)))
+            self.assertNotIn("reused_segments", differ.stats)
+
+            # Nothing changed: the different segment is reused, instead of bisected again
+            differ = HashDiffer(bisection_factor=4, bisection_threshold=8, checksum_store=store_path)
+            diff_res = differ.diff_tables(self.table, self.table2)
+            self.assertEqual(expected, list(diff_res))
+            self.assertEqual(1, differ.stats["reused_segments"])
+            self.assertEqual({1: 64, 2: 63}, diff_res.info_tree.info.rowcounts)
+
+            # New rows are found, even though the key range grew
+            self.connection.query([self.src_table.insert_row(100, 100, 100, 9, time_obj, columns=cols), commit])
+            differ = HashDiffer(bisection_factor=4, bisection_threshold=8, checksum_store=store_path)
+            diff = list(differ.diff_tables(self.table, self.table2))
+            self.assertEqual(expected + [("-", ("100", time + ".000000"))], diff)
+            self.assertEqual(1, differ.stats["reused_segments"])
+
+    def test_incremental_diff(self):
+        time = "2022-01-01 00:00:00"
+        time_obj = datetime.fromisoformat(time)
+        later = "2022-02-01 00:00:00"
+        later_obj = datetime.fromisoformat(later)
+        earlier_obj = datetime.fromisoformat("2021-01-01 00:00:00")
+
+        cols = "id userid movieid rating timestamp".split()
+        rows = [[i, i, i, 9, time_obj] for i in range(1, 21)]
+        self.connection.query(
+            [
+                self.src_table.insert_rows(rows, columns=cols),
+                self.dst_table.insert_rows(rows[:10] + rows[11:], columns=cols),
+                commit,
+            ]
+        )
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            state_path = os.path.join(tmpdir, "state.json")
+            differ = HashDiffer(bisection_factor=4, bisection_threshold=8)
+
+            diff = list(diff_tables_incremental(differ, self.table, self.table2, state_path))
+            self.assertEqual([("-", ("11", time + ".000000"))], diff)
+
+            self.connection.query(
+                [
+                    self.dst_table.insert_rows([rows[10]], columns=cols),  # Fixes the previous difference
+                    self.src_table.insert_row(30, 30, 30, 9, later_obj, columns=cols),
+                    self.src_table.insert_row(40, 40, 40, 9, earlier_obj, columns=cols),  # Before the watermark
+                    commit,
+                ]
+            )
+            diff = list(diff_tables_incremental(differ, self.table, self.table2, state_path, timedelta(0)))
+            self.assertEqual([("-", ("30", later + ".000000"))], diff)
+
+    def test_histogram_checkpoints(self):
+        time = "2022-01-01 00:00:00"
+        time_obj = datetime.fromisoformat(time)
+
+        cols = "id userid movieid rating timestamp".split()
+        # Clustered keys: evenly-spaced checkpoints would leave most segments empty
+        rows = [[i, i, i, 9, time_obj] for i in list(range(1, 51)) + list(range(100000, 100050))]
+        self.connection.query(
+            [
+                self.src_table.insert_rows(rows, columns=cols),
+                self.dst_table.insert_rows(rows[:60] + rows[61:], columns=cols),
+                commit,
+            ]
+        )
+
+        table = self.table.with_schema().with_key_histogram()
+        if table._key_histogram is None:
+            self.skipTest(f"{self.db_cls.__name__} doesn't provide a key distribution")
+
+        checkpoints = table.new(min_key=1, max_key=100050).choose_checkpoints(3)
+        self.assertEqual(3, len(checkpoints))
+        counts = [t.count() for t in table.new(min_key=1, max_key=100050).segment_by_checkpoints(checkpoints)]
+        self.assertLess(max(counts) - min(counts), 10)
+
+        differ = HashDiffer(bisection_factor=4, bisection_threshold=8, histogram_checkpoints=True)
+        diff = list(differ.diff_tables(self.table, self.table2))
+        self.assertEqual([("-", ("100010", time + ".000000"))], diff)
+
+    def test_download_row_hashes(self):
+        time = "2022-01-01 00:00:00"
+        time_obj = datetime.fromisoformat(time)
+
+        cols = "id userid movieid rating timestamp".split()
+        rows = [[i, i, i, 9, time_obj] for i in range(1, 21)]
+        self.connection.query(
+            [
+                self.src_table.insert_rows(rows, columns=cols),
+                self.dst_table.insert_rows(rows[:19], columns=cols),
+                commit,
+            ]
+        )
+
+        table = self.table.with_schema()
+        self.assertEqual(20, len(table.get_key_hashes()))
+        self.assertEqual([("3", time + ".000000"), ("7", time + ".000000")], table.get_values(["7", "3"]))
+
+        differ = HashDiffer(bisection_threshold=64, download_row_hashes=True)
+        diff = list(differ.diff_tables(self.table, self.table2))
+        self.assertEqual([("-", ("20", time + ".000000"))], diff)
+        self.assertEqual(1, differ.stats["rows_downloaded_by_key"])
+
+    def test_native_hash(self):
+        time = "2022-01-01 00:00:00"
+        time_obj = datetime.fromisoformat(time)
+
+        cols = "id userid movieid rating timestamp".split()
+        rows = [[i, i, i, 9, time_obj] for i in range(1, 65)]
+        self.connection.query(
+            [
+                self.src_table.insert_rows(rows, columns=cols),
+                self.dst_table.insert_rows(rows[:40] + rows[41:], columns=cols),
+                commit,
+            ]
+        )
+
+        table = self.table.with_schema().new(native_hash=True)
+        hashes = [h for _key, h in table.get_key_hashes()]
+        self.assertEqual(64, len(set(hashes)))
+        assert all(0 <= h < 2**60 for h in hashes), hashes
+
+        differ = HashDiffer(bisection_factor=2, bisection_threshold=4, native_hash=True)
+        diff = list(differ.diff_tables(self.table, self.table2))
+        self.assertEqual([("-", ("41", time + ".000000"))], diff)
+
+    def test_skip_normalization(self):
+        time = "2022-01-01 00:00:00"
+        time_obj = datetime.fromisoformat(time)
+        time_obj2 = datetime.fromisoformat("2021-01-01 00:00:00")
+
+        cols = "id userid movieid rating timestamp".split()
+        rows = [[i, i, i, 9, time_obj] for i in range(1, 65)]
+        self.connection.query(
+            [
+                self.src_table.insert_rows(rows, columns=cols),
+                self.dst_table.insert_rows(rows[:40] + [[41, 41, 41, 9, time_obj2]] + rows[41:], columns=cols),
+                commit,
+            ]
+        )
+
+        differ = HashDiffer(bisection_factor=2, bisection_threshold=4, skip_normalization=True)
+        diff = list(differ.diff_tables(self.table, self.table2))
+        self.assertEqual([("-", ("41", time + ".000000")), ("+", ("41", "2021-01-01 00:00:00.000000"))], diff)
+        self.assertEqual((("timestamp",), ("timestamp",)), differ._raw_columns)
+
+    def test_column_checksums(self):
+        time = "2022-01-01 00:00:00"
+        time_obj = datetime.fromisoformat(time)
+
+        cols = "id userid movieid rating timestamp".split()
+        rows = [[i, i, i, 9, time_obj] for i in range(1, 65)]
+        self.connection.query(
+            [
+                self.src_table.insert_rows(rows, columns=cols),
+                self.dst_table.insert_rows(rows[:40] + [[41, 41, 0, 9, time_obj]] + rows[41:], columns=cols),
+                commit,
+            ]
+        )
+
+        extra_columns = ("userid", "movieid")
+        table1 = table_segment(self.connection, self.table_src_path, "id", extra_columns=extra_columns)
+        table2 = table_segment(self.connection, self.table_dst_path, "id", extra_columns=extra_columns)
+
+        table = table1.with_schema()
+        count, checksum, column_checksums = table.count_and_checksum_by_column()
+        self.assertEqual((64, checksum), table.count_and_checksum())
+        self.assertEqual(3, len(column_checksums))
+        self.assertEqual([("1", "1"), ("2", "2")], table.new(max_key=3).get_values(columns=["movieid"]))
+
+        differ = HashDiffer(bisection_factor=2, bisection_threshold=4, column_checksums=True)
+        diff_res = differ.diff_tables(table1, table2)
+        diff = list(diff_res)
+        self.assertEqual([("-", ("41", "41", "41")), ("+", ("41", "41", "0"))], diff)
+
+        def iter_nodes(node):
+            yield node
+            for child in node.children:
+                yield from iter_nodes(child)
+
+        # Differing segments below the root are checksummed by column
+        diff_columns = {tuple(n.info.diff_columns) for n in iter_nodes(diff_res.info_tree) if n.info.diff_columns}
+        self.assertEqual({("movieid",)}, diff_columns)
+        self.assertEqual({"movieid": 1}, differ.stats["diff_counts"])
+        self.assertEqual(1, differ.stats["rows_downloaded_by_key"])
+
+    def test_vectorized_diff(self):
+        try:
+            import pyarrow  # noqa: F401
+        except ModuleNotFoundError:
+            self.skipTest("pyarrow isn't installed")
+
+        time = "2022-01-01 00:00:00"
+        time_obj = datetime.fromisoformat(time)
+
+        cols = "id userid movieid rating timestamp".split()
+        rows = [[i, i, i, 9, time_obj] for i in range(1, 21)]
+        self.connection.query(
+            [
+                self.src_table.insert_rows(rows, columns=cols),
+                self.dst_table.insert_rows(rows[:19], columns=cols),
+                commit,
+            ]
+        )
+
+        table = self.table.with_schema()
+        values = table.get_values_arrow()
+        self.assertEqual(2, values.num_columns)
+        self.assertEqual(table.get_values(), list(zip(*(c.to_pylist() for c in values.columns))))
+
+        differ = HashDiffer(bisection_threshold=64, vectorized_diff=True)
+        diff = list(differ.diff_tables(self.table, self.table2))
+        self.assertEqual([("-", ("20", time + ".000000"))], diff)
+
+    def test_local_diff_processes(self):
+        time = "2022-01-01 00:00:00"
+        time_obj = datetime.fromisoformat(time)
+
+        cols = "id userid movieid rating timestamp".split()
+        rows = [[i, i, i, 9, time_obj] for i in range(1, 65)]
+        self.connection.query(
+            [
+                self.src_table.insert_rows(rows, columns=cols),
+                self.dst_table.insert_rows(rows[:40] + rows[41:] + [[65, 65, 65, 9, time_obj]], columns=cols),
+                commit,
+            ]
+        )
+
+        self.assertRaises(ValueError, HashDiffer, local_diff_processes=-1)
+
+        differ = HashDiffer(bisection_factor=2, bisection_threshold=4, local_diff_processes=2)
+        diff = list(differ.diff_tables(self.table, self.table2))
+        self.assertEqual({("-", ("41", time + ".000000")), ("+", ("65", time + ".000000"))}, set(diff))
+
+        # Once the diff is closed, segments that are still being diffed are skipped
+        ti = differ._create_threaded_yielder()
+        self.assertEqual([("-", (1, "a"))], ti.diff_lists([(1, "a")], [], 1, True))
+        ti.close()
+        self.assertEqual([], ti.diff_lists([(1, "a")], [], 1, True))
+
+        differ = differ.replace(download_row_hashes=True)
+        diff = list(differ.diff_tables(self.table, self.table2))
+        self.assertEqual({("-", ("41", time + ".000000")), ("+", ("65", time + ".000000"))}, set(diff))
+
     def test_return_empty_array_when_same(self):
         time = "2022-01-01 00:00:00"
         time_obj = datetime.fromisoformat(time)
@@ -345,6 +897,132 @@ class TestDiffTables2(DiffTestCase):
         assert diff == []
 
 
+@test_each_database
+class TestCompositeKey(DiffTestCase):
+    src_schema = {"tenant_id": int, "id": int, "rating": int}
+    dst_schema = {"tenant_id": int, "id": int, "rating": int}
+
+    def setUp(self):
+        super().setUp()
+
+        rows = [[tenant, i, 9] for tenant in (1, 2, 5) for i in range(1, 41)]
+        changed = [[5, 7, 10]]
+        self.connection.query(
+            [
+                self.src_table.insert_rows(rows),
+                self.dst_table.insert_rows([r for r in rows if r[:2] not in ([2, 40], [5, 1], [5, 7])] + changed),
+                commit,
+            ]
+        )
+
+        key = ("tenant_id", "id")
+        self.table = table_segment(self.connection, self.table_src_path, key, extra_columns=("rating",))
+        self.table2 = table_segment(self.connection, self.table_dst_path, key, extra_columns=("rating",))
+        self.expected = [
+            ("-", ("2", "40", "9")),
+            ("-", ("5", "1", "9")),
+            ("-", ("5", "7", "9")),
+            ("+", ("5", "7", "10")),
+        ]
+
+    def test_key_range(self):
+        table = self.table.with_schema()
+        self.assertEqual((("1", "1"), ("5", "40")), table.query_key_range())
+
+        # A segment that starts within tenant 1, and ends before tenant 5
+        segment = table.new(min_key=(1, 30), max_key=(5,))
+        self.assertEqual(51, segment.count())
+        self.assertIsNone(segment.approximate_size())
+
+        checkpoints = segment.choose_checkpoints(2)
+        self.assertTrue(checkpoints)
+        self.assertTrue(all(segment.min_key < c < segment.max_key for c in checkpoints))
+        segments = segment.segment_by_checkpoints(checkpoints)
+        self.assertEqual(51, sum(s.count() for s in segments))
+
+        # Within a single tenant, the segment is split by id
+        segment = table.new(min_key=(2,), max_key=(3,))
+        self.assertEqual([(2, 14), (2, 27)], segment.choose_checkpoints(2))
+
+    def test_diff(self):
+        for differ in [
+            HashDiffer(bisection_factor=3, bisection_threshold=4),
+            HashDiffer(bisection_factor=4, bisection_threshold=8, batched_checksum=True),
+            HashDiffer(bisection_factor=4, bisection_threshold=8, download_row_hashes=True),
+        ]:
+            diff_res = differ.diff_tables(self.table, self.table2)
+            self.assertEqual(self.expected, list(diff_res))
+            self.assertEqual({1: 120, 2: 118}, diff_res.info_tree.info.rowcounts)
+
+        differ = HashDiffer(bisection_factor=4, bisection_threshold=8, hash_partitioning=True)
+        self.assertEqual(sorted(self.expected), sorted(differ.diff_tables(self.table, self.table2)))
+
+
+@test_each_database
+class TestCompositeTextKey(DiffTestCase):
+    src_schema = {"name": str, "id": int, "rating": int}
+    dst_schema = {"name": str, "id": int, "rating": int}
+
+    def setUp(self):
+        super().setUp()
+
+        rows = [[name, i, 9] for name in ("alice", "bob") for i in range(1, 21)]
+        self.connection.query(
+            [
+                self.src_table.insert_rows(rows),
+                self.dst_table.insert_rows([r for r in rows if r[:2] not in (["alice", 3], ["bob", 7], ["bob", 9])]),
+                self.dst_table.insert_row("bob", 9, 10),
+                commit,
+            ]
+        )
+
+        key = ("name", "id")
+        self.table = table_segment(self.connection, self.table_src_path, key, extra_columns=("rating",))
+        self.table2 = table_segment(self.connection, self.table_dst_path, key, extra_columns=("rating",))
+
+    def test_download_row_hashes(self):
+        values = self.table.with_schema().get_values([("bob", "7"), ("alice", "3")])
+        self.assertEqual([("alice", "3", "9"), ("bob", "7", "9")], values)
+
+        differ = HashDiffer(bisection_threshold=64, download_row_hashes=True)
+        diff = list(differ.diff_tables(self.table, self.table2))
+        self.assertEqual(
+            {("-", ("alice", "3", "9")), ("-", ("bob", "7", "9")), ("-", ("bob", "9", "9")), ("+", ("bob", "9", "10"))},
+            set(diff),
+        )
+        self.assertEqual(3, differ.stats["rows_downloaded_by_key"])
+
+
+@test_each_database
+class TestTextKeys(DiffTestCase):
+    src_schema = {"email": str, "name": str}
+
+    def setUp(self):
+        super().setUp()
+
+        rows = [(f"user.{i}@example.com", f"User {i}") for i in range(100)]
+        self.connection.query(
+            [
+                self.src_table.insert_rows(rows),
+                table(self.table_dst_path).create(self.src_table),
+                self.src_table.insert_row("new-user@example.com", "New user"),
+                commit,
+            ]
+        )
+
+        self.a = table_segment(self.connection, self.table_src_path, "email", extra_columns=("name",))
+        self.b = table_segment(self.connection, self.table_dst_path, "email", extra_columns=("name",))
+
+    def test_hash_partitioning(self):
+        differ = HashDiffer(bisection_factor=4, bisection_threshold=8)
+        diff_res = differ.diff_tables(self.a, self.b)
+        self.assertEqual([("-", ("new-user@example.com", "New user"))], list(diff_res))
+        self.assertEqual({1: 101, 2: 100}, diff_res.info_tree.info.rowcounts)
+        self.assertLess(differ.stats["rows_downloaded"], 100)
+
+        self.assertEqual(101, sum(t.count() for t in self.a.with_schema().split_by_key_hash(8)))
+
+
 @test_each_database
 class TestUUIDs(DiffTestCase):
     src_schema = {"id": str, "text_comment": str}
@@ -435,7 +1113,12 @@ class TestAlphanumericKeys(DiffTestCase):
         self.a = table_segment(self.connection, self.table_src_path, "id", "text_comment", case_sensitive=False)
         self.b = table_segment(self.connection, self.table_dst_path, "id", "text_comment", case_sensitive=False)
 
-        self.assertRaises(NotImplementedError, list, differ.diff_tables(self.a, self.b))
+        # The key can't be split into ranges anymore, so the tables are partitioned by key hash instead
+        expected = {
+            ("-", (str(self.new_alphanum), "This one is different")),
+            ("-", ("@@@", "<-- this bad value should not break us")),
+        }
+        self.assertEqual(expected, set(differ.diff_tables(self.a, self.b)))
 
 
 @test_each_database_in_list(TEST_DATABASES - {db.MySQL})
@@ -492,7 +1175,12 @@ class TestVaryingAlphanumericKeys(DiffTestCase):
         self.a = table_segment(self.connection, self.table_src_path, "id", "text_comment", case_sensitive=False)
         self.b = table_segment(self.connection, self.table_dst_path, "id", "text_comment", case_sensitive=False)
 
-        self.assertRaises(NotImplementedError, list, differ.diff_tables(self.a, self.b))
+        # The key can't be split into ranges anymore, so the tables are partitioned by key hash instead
+        expected = {
+            ("-", (str(self.new_alphanum), "This one is different")),
+            ("-", ("@@@", "<-- this bad value should not break us")),
+        }
+        self.assertEqual(expected, set(differ.diff_tables(self.a, self.b)))
 
 
 @test_each_database
@@ -751,7 +1439,8 @@ class TestDuplicateTables(DiffTestCase):
         src_values = [(12, "ABCDE"), (12, "ABCDE")]
         dst_values = [(4, "ABCDEF"), (4, "ABCDE"), (4, "ABCDE"), (6, "ABCDE"), (6, "ABCDE"), (6, "ABCDE")]
 
-        self.diffs = [("-", (str(r[0]), r[1])) for r in src_values] + [("+", (str(r[0]), r[1])) for r in dst_values]
+        diffs = [("-", (str(r[0]), r[1])) for r in src_values] + [("+", (str(r[0]), r[1])) for r in dst_values]
+        self.diffs = sorted(diffs, key=lambda d: int(d[1][0]))
 
         self.connection.query([self.src_table.insert_rows(src_values), self.dst_table.insert_rows(dst_values), commit])
 
@@ -1,11 +1,12 @@
 from typing import List
+import unittest
 from datetime import datetime
 
 from data_diff.sqeleton.queries.ast_classes import TablePath
-from data_diff.sqeleton.queries import table, commit
+from data_diff.sqeleton.queries import table, commit, Compiler
 from data_diff.table_segment import TableSegment
 from data_diff import databases as db
-from data_diff.joindiff_tables import JoinDiffer
+from data_diff.joindiff_tables import JoinDiffer, _outerjoin
 
 from .test_diff_tables import DiffTestCase
 
@@ -172,6 +173,63 @@ class TestJoindiff(DiffTestCase):
         self.assertEqual(5, info.rowcounts[1])
         self.assertEqual(4, info.rowcounts[2])
 
+    def test_temp_diff_table(self):
+        time = "2022-01-01 00:00:00"
+        time_obj = datetime.fromisoformat(time)
+
+        cols = "id userid movieid rating timestamp".split()
+
+        self.connection.query(
+            [
+                self.src_table.insert_rows([[1, 1, 1, 9, time_obj], [2, 2, 2, 9, time_obj]], columns=cols),
+                self.dst_table.insert_rows([[1, 1, 1, 9, time_obj], [3, 3, 3, 9, time_obj]], columns=cols),
+                commit,
+            ]
+        )
+
+        materialize_path = self.connection.parse_table_name(f"test_mat_{random_table_suffix()}")
+        differ = JoinDiffer(temp_diff_table=True, sample_exclusive_rows=True, materialize_to_table=materialize_path)
+        diff = list(differ.diff_tables(self.table, self.table2))
+        expected = [("-", ("2", time + ".000000")), ("+", ("3", time + ".000000"))]
+        self.assertEqual(expected, sorted(diff, key=lambda sign_row: sign_row[1]))
+        self.assertEqual(2, differ.stats["exclusive_count"])
+        self.assertEqual(2, len(differ.stats["exclusive_sample"]))
+
+        t = TablePath(materialize_path)
+        rows = self.connection.query(t.select(), List[tuple])
+        self.assertEqual(2, len(rows))
+        self.connection.query(t.drop())
+
+    def test_checksum_segments(self):
+        time = "2022-01-01 00:00:00"
+        time_obj = datetime.fromisoformat(time)
+
+        cols = "id userid movieid rating timestamp".split()
+        rows = [[i, i, i, 9, time_obj] for i in range(1, 101)]
+
+        self.connection.query(
+            [
+                self.src_table.insert_rows(rows, columns=cols),
+                self.dst_table.insert_rows(rows[:49] + rows[50:], columns=cols),
+                commit,
+            ]
+        )
+
+        differ = JoinDiffer(checksum_segments=True)
+        diff_res = differ.diff_tables(self.table, self.table2)
+        diff = list(diff_res)
+        self.assertEqual([("-", ("50", time + ".000000"))], diff)
+        self.assertEqual({1: 100, 2: 99}, diff_res.info_tree.info.rowcounts)
+        self.assertEqual(1, sum(1 for node in diff_res.info_tree.children if node.info.is_diff))
+
+        # Materializing all the rows includes the segments that are identical
+        materialize_path = self.connection.parse_table_name(f"test_mat_{random_table_suffix()}")
+        mdiffer = differ.replace(materialize_to_table=materialize_path, materialize_all_rows=True)
+        self.assertEqual(diff, list(mdiffer.diff_tables(self.table, self.table2)))
+        t = TablePath(materialize_path)
+        self.assertEqual(100, self.connection.query(t.count(), int))
+        self.connection.query(t.drop())
+
     def test_return_empty_array_when_same(self):
         time = "2022-01-01 00:00:00"
         time_obj = datetime.fromisoformat(time)
@@ -297,17 +355,38 @@ class TestUniqueConstraint(DiffTestCase):
         )
 
         # Test no active validation
+        table = TableSegment(self.connection, self.table_src_path, ("id", "userid"), case_sensitive=False)
+        table2 = TableSegment(self.connection, self.table_dst_path, ("id", "userid"), case_sensitive=False)
+
+        res = list(self.differ.diff_tables(table, table2))
+        assert not res
+        assert "validated_unique_keys" not in self.differ.stats
+
+        # Test active validation. A key is only unique if it includes all the columns of a constraint.
         table = TableSegment(self.connection, self.table_src_path, ("id",), case_sensitive=False)
         table2 = TableSegment(self.connection, self.table_dst_path, ("id",), case_sensitive=False)
 
         res = list(self.differ.diff_tables(table, table2))
         assert not res
-        assert "validated_unique_keys" not in self.differ.stats
+        self.assertEqual(self.differ.stats["validated_unique_keys"], [["id"]])
 
-        # Test active validation
         table = TableSegment(self.connection, self.table_src_path, ("userid",), case_sensitive=False)
         table2 = TableSegment(self.connection, self.table_dst_path, ("userid",), case_sensitive=False)
 
-        res = list(self.differ.diff_tables(table, table2))
+        differ = JoinDiffer()
+        res = list(differ.diff_tables(table, table2))
         assert not res
-        self.assertEqual(self.differ.stats["validated_unique_keys"], [["userid"]])
+        self.assertEqual(differ.stats["validated_unique_keys"], [["userid"], ["userid"]])
+
+
+class TestMySQLOuterJoin(unittest.TestCase):
+    def test_compile(self):
+        mysql = db.MySQL(thread_count=1, database="x")
+        a = table("a", schema={"id": int, "v": int})
+        b = table("b", schema={"id": int, "v": int})
+        sql = Compiler(mysql).compile(_outerjoin(mysql, a, b, ["id"], ["id"], {"v_a": a["v"], "v_b": b["v"]}))
+
+        left, right = sql.split(" UNION ALL ")
+        assert " LEFT JOIN " in left and " WHERE " not in left
+        assert " RIGHT JOIN " in right and right.endswith("WHERE `is_exclusive_b`")
+        assert "(`tmp3`.`id` IS NULL) AS `is_exclusive_b`" in right
@@ -1,4 +1,5 @@
 import unittest
+from datetime import datetime
 
 from data_diff import TableSegment, HashDiffer
 from data_diff import databases as db
@@ -69,3 +70,62 @@ class TestUUID(unittest.TestCase):
         self.connection.query(self.table_src.drop(True))
         self.connection.query(self.table_dst.drop(True))
         mysql_conn.query(self.table_dst.drop(True))
+
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self) -> None:
+        self.connection = get_conn(db.PostgreSQL)
+
+        table_suffix = random_table_suffix()
+        self.table_src = table(f"src{table_suffix}", schema={"id": int, "created_at": datetime})
+        self.table_dst = table(f"dst{table_suffix}", schema={"id": int, "created_at": datetime})
+
+    def test_drop_after_streamed_diff(self):
+        time_obj = datetime(2022, 1, 1)
+        rows = [[i, time_obj] for i in range(100)]
+        self.connection.query(
+            [
+                self.table_src.create(),
+                self.table_dst.create(),
+                self.table_src.insert_rows(rows),
+                self.table_dst.insert_rows(rows[1:]),
+                commit,
+            ]
+        )
+
+        # Streams run in the same session time zone as the other queries
+        self.assertEqual([("UTC",)], list(self.connection.query_iter("SELECT current_setting('TimeZone')")))
+
+        a = TableSegment(self.connection, self.table_src.path, ("id",), "created_at")
+        b = TableSegment(self.connection, self.table_dst.path, ("id",), "created_at")
+        differ = HashDiffer(bisection_threshold=1000)
+        self.assertEqual([("-", ("0", "2022-01-01 00:00:00.000000"))], list(differ.diff_tables(a, b)))
+
+        def drop_tables():
+            # Fails instead of waiting, if the idle stream connections still hold locks on the tables
+            yield "SET LOCAL lock_timeout = '5s'"
+            yield self.table_src.drop()
+            yield self.table_dst.drop()
+            yield commit
+
+        self.connection.query(drop_tables(), None)
+
+
+class TestUniqueColumns(unittest.TestCase):
+    def setUp(self) -> None:
+        self.connection = get_conn(db.PostgreSQL)
+        self.table_name = f"src{random_table_suffix()}"
+
+    def test_expression_index(self):
+        self.connection.query(
+            [
+                f"CREATE TABLE {self.table_name} (id int, name varchar, email varchar UNIQUE)",
+                f"CREATE UNIQUE INDEX ON {self.table_name} (id, lower(name))",
+                commit,
+            ]
+        )
+        try:
+            # The expression index isn't unique on 'id' alone, so it isn't reported
+            self.assertEqual([["email"]], self.connection.query_table_unique_columns((self.table_name,)))
+        finally:
+            self.connection.query([table(self.table_name).drop(), commit])